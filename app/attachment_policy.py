@@ -0,0 +1,143 @@
+import os
+import json
+import logging
+import mimetypes
+import threading
+from collections import Counter
+
+
+def _split_list(value):
+    return [item.strip().lower() for item in (value or '').split(',') if item.strip()]
+
+
+# 跳过内联图片（cid: 签名 logo、追踪像素）；内联的 PDF 等文档仍然保留
+ATTACHMENT_SKIP_INLINE = os.environ.get('ATTACHMENT_SKIP_INLINE', 'true').lower() in ('1', 'true', 'yes', 'on')
+# 以 / 结尾的条目按前缀匹配，如 image/；允许列表为空表示不限制
+ATTACHMENT_ALLOW_TYPES = _split_list(os.environ.get('ATTACHMENT_ALLOW_TYPES', ''))
+ATTACHMENT_DENY_TYPES = _split_list(os.environ.get('ATTACHMENT_DENY_TYPES', 'video/,audio/'))
+# 只对图片生效（追踪像素、签名小图标）；很小的 txt、csv、ics 等同样有内容
+ATTACHMENT_MIN_BYTES = int(os.environ.get('ATTACHMENT_MIN_BYTES', '1024'))
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', str(15 * 1024 * 1024)))
+ATTACHMENT_EMAIL_BUDGET_BYTES = int(os.environ.get('ATTACHMENT_EMAIL_BUDGET_BYTES', str(50 * 1024 * 1024)))
+SKIPPED_FILE = 'attachments_skipped.json'
+
+REASON_INLINE = 'inline'
+REASON_TYPE = 'content_type'
+REASON_TOO_SMALL = 'too_small'
+REASON_TOO_LARGE = 'too_large'
+REASON_BUDGET = 'email_budget'
+REASON_REFERENCE = 'reference'
+
+
+def _type_matches(content_type, entries):
+    for entry in entries:
+        if entry.endswith('/') and content_type.startswith(entry):
+            return True
+        if entry == content_type:
+            return True
+    return False
+
+
+def effective_content_type(name, content_type):
+    # Graph 常把未知类型标成 octet-stream，此时按扩展名再猜一次
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if not content_type or content_type == 'application/octet-stream':
+        guessed, _ = mimetypes.guess_type(name or '')
+        if guessed:
+            return guessed
+    return content_type or 'application/octet-stream'
+
+
+class AttachmentPolicy:
+    """Decides which attachments are worth downloading and uploading.
+
+    Rules are checked in order: reference attachments (links, no content),
+    inline images, denied or not-allowed content types, minimum image size,
+    maximum size, and finally the per-email byte budget, which keeps attachments in
+    their original order until the budget runs out.
+    """
+
+    def __init__(self, skip_inline=ATTACHMENT_SKIP_INLINE, allow_types=None, deny_types=None,
+                 min_bytes=ATTACHMENT_MIN_BYTES, max_bytes=ATTACHMENT_MAX_BYTES,
+                 email_budget=ATTACHMENT_EMAIL_BUDGET_BYTES):
+        self.skip_inline = skip_inline
+        self.allow_types = ATTACHMENT_ALLOW_TYPES if allow_types is None else allow_types
+        self.deny_types = ATTACHMENT_DENY_TYPES if deny_types is None else deny_types
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.email_budget = email_budget
+        self._reasons = Counter()
+        self._lock = threading.Lock()
+
+    def _evaluate(self, att):
+        if att.get('@odata.type', '').endswith('referenceAttachment'):
+            return REASON_REFERENCE
+        content_type = effective_content_type(att.get('name'), att.get('contentType'))
+        if self.skip_inline and att.get('isInline') and content_type.startswith('image/'):
+            return REASON_INLINE
+        if _type_matches(content_type, self.deny_types):
+            return REASON_TYPE
+        if self.allow_types and not _type_matches(content_type, self.allow_types):
+            return REASON_TYPE
+        size = att.get('size')
+        if size is not None:
+            if size < self.min_bytes and content_type.startswith('image/'):
+                return REASON_TOO_SMALL
+            if self.max_bytes and size > self.max_bytes:
+                return REASON_TOO_LARGE
+        return None
+
+    def select(self, attachments):
+        """Splits Graph attachment metadata into ``(kept, skipped)``.
+
+        ``skipped`` entries carry the name, type, size and reason so they can
+        be reported with the email.
+        """
+        kept, skipped = [], []
+        used = 0
+        for att in attachments:
+            reason = self._evaluate(att)
+            size = att.get('size') or 0
+            if reason is None and self.email_budget and used + size > self.email_budget:
+                reason = REASON_BUDGET
+            if reason is None:
+                used += size
+                kept.append(att)
+                continue
+            skipped.append({'name': att.get('name'), 'contentType': att.get('contentType'),
+                            'size': att.get('size'), 'reason': reason})
+        if skipped:
+            with self._lock:
+                self._reasons.update(item['reason'] for item in skipped)
+        return kept, skipped
+
+    def select_paths(self, paths):
+        # 按本地文件再筛一次，覆盖策略上线前已下载的附件（本地文件没有 isInline 信息）
+        metadata = [{'name': os.path.basename(path), 'contentType': None, 'size': os.path.getsize(path), 'path': path}
+                    for path in paths]
+        kept, skipped = self.select(metadata)
+        return [att['path'] for att in kept], skipped
+
+    def stats(self):
+        with self._lock:
+            return {'skipped': dict(self._reasons)}
+
+
+def save_skipped(folder, skipped):
+    path = os.path.join(folder, SKIPPED_FILE)
+    if not skipped:
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(skipped, f, ensure_ascii=False, indent=2)
+
+
+def load_skipped(folder):
+    path = os.path.join(folder, SKIPPED_FILE)
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logging.warning(f"Failed to read {path}")
+        return []
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from .throttle import http
+from .mailboxes import parse_graph_datetime, format_graph_datetime
+
+BACKFILL_STATE_FILE = os.environ.get('BACKFILL_STATE_FILE', os.path.join('state', 'backfill_state.json'))
+# 旧版本的默认位置，新文件不存在时从这里恢复未完成的任务
+LEGACY_BACKFILL_STATE_FILE = 'backfill_state.json'
+BACKFILL_CONCURRENCY = int(os.environ.get('BACKFILL_CONCURRENCY', '4'))
+BACKFILL_PARTITION_HOURS = float(os.environ.get('BACKFILL_PARTITION_HOURS', '24'))
+# 下载速率上限（封/秒）与待处理邮件组上限，防止回填挤占实时邮件
+BACKFILL_RATE = float(os.environ.get('BACKFILL_RATE', '2'))
+BACKFILL_MAX_PENDING = int(os.environ.get('BACKFILL_MAX_PENDING', '200'))
+# 统计待处理邮件组要扫描磁盘，每隔这么久才重新统计一次
+CAPACITY_CHECK_SECONDS = 5
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, stop):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.next_at)
+            self.next_at = slot + self.interval
+        if slot > now:
+            stop.wait(slot - now)
+
+
+def split_range(start, end, hours):
+    partitions = []
+    step = timedelta(hours=hours)
+    cursor = start
+    while cursor < end:
+        upper = min(end, cursor + step)
+        partitions.append({'start': format_graph_datetime(cursor), 'end': format_graph_datetime(upper),
+                           'status': PENDING, 'listed': 0, 'fetched': 0, 'skipped': 0, 'errors': 0})
+        cursor = upper
+    return partitions
+
+
+class Backfill:
+    """Re-ingests a ``receivedDateTime`` range split into partitions.
+
+    Partitions are listed in parallel with ``$filter`` and feed the normal
+    fetch stage at ``rate`` emails per second, pausing while too many groups
+    wait for the workflow. Progress is saved per partition, so a restart
+    resumes with the partitions that had not finished; messages that were
+    already processed are skipped. ``processed_ids`` may return Graph ids
+    and ``internetMessageId`` values; ``is_done`` covers messages fetched
+    by other replicas.
+    """
+
+    def __init__(self, base_url, mailboxes, fetch, processed_ids, pending_groups, is_done=None,
+                 state_file=BACKFILL_STATE_FILE, concurrency=BACKFILL_CONCURRENCY, rate=BACKFILL_RATE,
+                 max_pending=BACKFILL_MAX_PENDING):
+        self.base_url = base_url
+        self.mailboxes = mailboxes
+        self.fetch = fetch
+        self.processed_ids = processed_ids
+        self.is_done = is_done or (lambda msg: False)
+        self._known = set()
+        self.pending_groups = pending_groups
+        self._capacity_lock = threading.Lock()
+        self._capacity_checked_at = float('-inf')
+        self._pending_estimate = 0
+        self.state_file = state_file
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.max_pending = max_pending
+        self.job = self._load()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load(self):
+        path = self.state_file
+        if not os.path.exists(path):
+            path = LEGACY_BACKFILL_STATE_FILE
+            if not os.path.exists(path):
+                return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logging.exception(f"Failed to read {path}")
+            return None
+
+    def _save(self):
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.job, f, indent=2)
+        os.replace(tmp_path, self.state_file)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def unfinished(self):
+        return bool(self.job) and any(p['status'] != DONE for p in self.job['partitions'])
+
+    def start(self, mailbox_id, start, end, partition_hours=BACKFILL_PARTITION_HOURS):
+        if self.running:
+            raise RuntimeError("A backfill is already running")
+        if end <= start:
+            raise ValueError("end must be after start")
+        mailbox = self.mailboxes.get(mailbox_id)
+        with self._lock:
+            self.job = {
+                'mailbox': mailbox.id,
+                'start': format_graph_datetime(start),
+                'end': format_graph_datetime(end),
+                'created_at': time.time(),
+                'partitions': split_range(start, end, partition_hours),
+            }
+            self._save()
+        self.resume()
+
+    def resume(self):
+        if self.running or not self.unfinished():
+            return False
+        with self._lock:
+            for partition in self.job['partitions']:
+                # 中断时正在跑的分区从头再来，已处理的邮件会被跳过
+                if partition['status'] in (RUNNING, FAILED):
+                    partition['status'] = PENDING
+            self._save()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='backfill', daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def _run(self):
+        mailbox = self.mailboxes.get(self.job['mailbox'])
+        partitions = [p for p in self.job['partitions'] if p['status'] == PENDING]
+        self._known = self.processed_ids()
+        logging.info(f"Backfill of {mailbox.id} started with {len(partitions)} partitions")
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='backfill') as pool:
+            list(pool.map(lambda p: self._run_partition(mailbox, p), partitions))
+        logging.info(f"Backfill of {mailbox.id} {'paused' if self._stop.is_set() else 'finished'}")
+
+    def _set(self, partition, **values):
+        with self._lock:
+            partition.update(values)
+            self._save()
+
+    def _add(self, partition, key, amount=1):
+        # 计数只在内存里累加，分区状态变化和每页结束时落盘
+        with self._lock:
+            partition[key] += amount
+
+    def _run_partition(self, mailbox, partition):
+        if self._stop.is_set():
+            return
+        self._set(partition, status=RUNNING, listed=0, skipped=0, errors=0, error=None)
+        url = mailbox.url(self.base_url, f"messages?$filter=receivedDateTime ge {partition['start']} "
+                                         f"and receivedDateTime lt {partition['end']}"
+                                         f"&$orderby=receivedDateTime asc&$top=50")
+        try:
+            while url:
+                resp = http.get(url, headers=mailbox.headers, timeout=60)
+                if resp.status_code != 200:
+                    raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+                data = resp.json()
+                messages = data.get('value', [])
+                self._add(partition, 'listed', len(messages))
+                for msg in messages:
+                    if self._stop.is_set():
+                        self._set(partition, status=PENDING)
+                        return
+                    if msg['id'] in self._known or msg.get('internetMessageId') in self._known or self.is_done(msg):
+                        self._add(partition, 'skipped')
+                        continue
+                    self._wait_for_capacity()
+                    self.limiter.wait(self._stop)
+                    if self._stop.is_set():
+                        continue
+                    try:
+                        fetched = self.fetch(mailbox, msg)
+                    except Exception:
+                        logging.exception(f"Backfill failed to fetch {msg['id']}")
+                        self._add(partition, 'errors')
+                        continue
+                    # fetch 返回 False 表示其他副本已经认领
+                    self._add(partition, 'fetched' if fetched else 'skipped')
+                url = data.get('@odata.nextLink')
+                self._set(partition)
+        except Exception as e:
+            logging.exception(f"Backfill partition {partition['start']} failed")
+            self._set(partition, status=FAILED, error=str(e))
+            return
+        self._set(partition, status=FAILED if partition['errors'] else DONE)
+
+    def _wait_for_capacity(self):
+        while not self._stop.is_set():
+            with self._capacity_lock:
+                if time.monotonic() - self._capacity_checked_at >= CAPACITY_CHECK_SECONDS:
+                    self._pending_estimate = self.pending_groups()
+                    self._capacity_checked_at = time.monotonic()
+                if self._pending_estimate < self.max_pending:
+                    # 两次统计之间每放行一封都计入估计值，不会超出上限
+                    self._pending_estimate += 1
+                    return
+            self._stop.wait(CAPACITY_CHECK_SECONDS)
+
+    def status(self):
+        with self._lock:
+            if not self.job:
+                return {'running': False, 'job': None}
+            partitions = self.job['partitions']
+            counts = {}
+            for p in partitions:
+                counts[p['status']] = counts.get(p['status'], 0) + 1
+            return {
+                'running': self.running,
+                'mailbox': self.job['mailbox'],
+                'start': self.job['start'],
+                'end': self.job['end'],
+                'partitions': counts,
+                'listed': sum(p['listed'] for p in partitions),
+                'fetched': sum(p['fetched'] for p in partitions),
+                'skipped': sum(p['skipped'] for p in partitions),
+                'errors': sum(p['errors'] for p in partitions),
+                'failed_partitions': [{'start': p['start'], 'end': p['end'], 'error': p.get('error')}
+                                      for p in partitions if p['status'] == FAILED],
+            }
+
+
+def parse_range_bound(value):
+    return parse_graph_datetime(value if 'T' in value else f"{value}T00:00:00Z")
@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+import threading
+
+import requests
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '3'))
+CIRCUIT_RESET_SECONDS = float(os.environ.get('CIRCUIT_RESET_SECONDS', '60'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ServiceUnavailableError(RuntimeError):
+    """Upstream rejected or failed the call (429/5xx); counts against the breaker."""
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """Classic closed/open/half-open breaker.
+
+    Only network errors and ``ServiceUnavailableError`` count as failures;
+    other exceptions (bad input, 4xx, ``DeadlineExceeded``) pass through
+    without changing the state, so a half-open trial that runs out of time
+    neither closes nor re-opens the breaker; the next call gets the trial.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.counters = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = HALF_OPEN
+            self.trial_in_flight = False
+
+    def is_open(self):
+        with self._lock:
+            self._refresh()
+            return self.state == OPEN or (self.state == HALF_OPEN and self.trial_in_flight)
+
+    def _before_call(self):
+        with self._lock:
+            self._refresh()
+            if self.state == OPEN or (self.state == HALF_OPEN and self.trial_in_flight):
+                self.counters['rejected'] += 1
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            if self.state == HALF_OPEN:
+                self.trial_in_flight = True
+            self.counters['calls'] += 1
+
+    def _on_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info(f"{self.name} circuit closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def _on_neutral(self):
+        with self._lock:
+            self.trial_in_flight = False
+
+    def _on_failure(self):
+        with self._lock:
+            self.counters['failures'] += 1
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.counters['opened'] += 1
+                    logging.warning(f"{self.name} circuit opened after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except (requests.RequestException, ServiceUnavailableError):
+            self._on_failure()
+            raise
+        except Exception:
+            # 与上游可用性无关的错误（含本地时间用完），不能证明上游已恢复，状态保持不变
+            self._on_neutral()
+            raise
+        self._on_success()
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            self._refresh()
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at)), 1)
+            return {'state': self.state, 'consecutive_failures': self.failures, 'retry_in_seconds': retry_in,
+                    **self.counters}
+
+
+class Deadline:
+    """Wall-clock budget; ``None`` seconds means unlimited."""
+
+    def __init__(self, seconds):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def share(self, parts, minimum=0.0):
+        # 把剩余时间平均分给剩余的任务，但每份不少于 minimum，也不超过总剩余时间
+        remaining = self.remaining()
+        if remaining is None:
+            return Deadline(None)
+        return Deadline(min(remaining, max(minimum, remaining / max(1, parts))))
+
+    def timeout(self, cap):
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline exceeded")
+        return min(cap, remaining)
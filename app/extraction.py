@@ -0,0 +1,302 @@
+import os
+import re
+import codecs
+import json
+import logging
+import zipfile
+import threading
+from collections import Counter
+from xml.etree import ElementTree
+
+from .workflow_cache import file_digest
+from .metrics import ATTACHMENT_EXTRACTIONS
+
+# 默认关闭：工作流需先声明 EXTRACTION_INPUT_NAME 输入变量，否则提取出的文本会被 Dify 丢弃
+EXTRACTION_ENABLED = os.environ.get('EXTRACTION_ENABLED', '').lower() in ('1', 'true', 'yes', 'on')
+EXTRACTION_CACHE_DIR = os.environ.get('EXTRACTION_CACHE_DIR', 'extraction_cache')
+# 每个附件最多保留的字符数，超出部分截断并注明
+EXTRACTION_MAX_CHARS = int(os.environ.get('EXTRACTION_MAX_CHARS', '20000'))
+# 提取成功后是否仍上传原文件（默认只传文本）
+EXTRACTION_UPLOAD_ORIGINALS = os.environ.get('EXTRACTION_UPLOAD_ORIGINALS', '').lower() in ('1', 'true', 'yes', 'on')
+# Dify 工作流中接收附件文本的输入变量名
+EXTRACTION_INPUT_NAME = os.environ.get('EXTRACTION_INPUT_NAME', 'attachments_text')
+# 提取逻辑变化时递增，旧缓存自动失效
+EXTRACTOR_VERSION = 1
+
+TEXT_EXTENSIONS = ('txt', 'csv', 'tsv', 'md', 'markdown', 'json', 'log')
+# 制表符保留，表格的列靠它对齐
+WHITESPACE_RE = re.compile(r'[ \r\f\v\u00a0]+')
+SLIDE_RE = re.compile(r'^ppt/slides/slide(\d+)\.xml$')
+SHEET_RE = re.compile(r'^xl/worksheets/sheet(\d+)\.xml$')
+
+NS_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+NS_A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+NS_S = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+class UnsupportedDocument(Exception):
+    pass
+
+
+class TextBuffer:
+    """Collects lines until ``max_chars`` is reached.
+
+    Extractors check ``full`` to stop reading early, which is what keeps a
+    100k-row spreadsheet from being parsed to the end.
+    """
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.lines = []
+        self.size = 0
+        self.truncated = False
+
+    @property
+    def full(self):
+        return self.truncated
+
+    def add(self, line):
+        line = WHITESPACE_RE.sub(' ', line).strip()
+        if not line or self.truncated:
+            return
+        remaining = self.max_chars - self.size
+        if len(line) >= remaining:
+            line = line[:remaining]
+            self.truncated = True
+        self.lines.append(line)
+        self.size += len(line) + 1
+
+    def text(self):
+        return '\n'.join(self.lines)
+
+
+def _decode(data, final=True):
+    # final=False 时末尾被截断的半个多字节字符留在解码器里丢弃，不会让整段退回 latin-1
+    for encoding in ('utf-8-sig', 'gb18030'):
+        try:
+            return codecs.getincrementaldecoder(encoding)().decode(data, final=final)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('latin-1')
+
+
+def extract_plain(path, buf):
+    # 按字符上限的几倍读取即可，不必把大文件整个读进来
+    with open(path, 'rb') as f:
+        data = f.read(buf.max_chars * 4 + 4)
+    truncated = len(data) > buf.max_chars * 4
+    for line in _decode(data, final=not truncated).splitlines():
+        buf.add(line)
+        if buf.full:
+            break
+    buf.truncated = buf.truncated or truncated
+
+
+def extract_docx(path, buf):
+    with zipfile.ZipFile(path) as zf, zf.open('word/document.xml') as f:
+        parts = []
+        for event, elem in ElementTree.iterparse(f, events=('end',)):
+            if elem.tag == f'{NS_W}t' and elem.text:
+                parts.append(elem.text)
+            elif elem.tag == f'{NS_W}tab':
+                parts.append('\t')
+            elif elem.tag == f'{NS_W}p':
+                buf.add(''.join(parts))
+                parts = []
+                elem.clear()
+                if buf.full:
+                    return
+
+
+def extract_pptx(path, buf):
+    with zipfile.ZipFile(path) as zf:
+        slides = sorted((int(m.group(1)), name) for name in zf.namelist() for m in [SLIDE_RE.match(name)] if m)
+        for number, name in slides:
+            buf.add(f'[Slide {number}]')
+            with zf.open(name) as f:
+                parts = []
+                for event, elem in ElementTree.iterparse(f, events=('end',)):
+                    if elem.tag == f'{NS_A}t' and elem.text:
+                        parts.append(elem.text)
+                    elif elem.tag == f'{NS_A}p':
+                        buf.add(''.join(parts))
+                        parts = []
+                        elem.clear()
+            if buf.full:
+                return
+
+
+def _column_index(ref):
+    index = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        index = index * 26 + ord(ch.upper()) - 64
+    return index - 1
+
+
+def extract_xlsx(path, buf):
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+        shared = []
+        if 'xl/sharedStrings.xml' in names:
+            with zf.open('xl/sharedStrings.xml') as f:
+                for event, elem in ElementTree.iterparse(f, events=('end',)):
+                    if elem.tag == f'{NS_S}si':
+                        shared.append(''.join(t.text or '' for t in elem.iter(f'{NS_S}t')))
+                        elem.clear()
+        sheet_names = {}
+        if 'xl/workbook.xml' in names:
+            root = ElementTree.fromstring(zf.read('xl/workbook.xml'))
+            for position, sheet in enumerate(root.iter(f'{NS_S}sheet'), 1):
+                sheet_names[position] = sheet.get('name')
+        sheets = sorted((int(m.group(1)), name) for name in names for m in [SHEET_RE.match(name)] if m)
+        for number, name in sheets:
+            buf.add(f"[Sheet {sheet_names.get(number) or number}]")
+            with zf.open(name) as f:
+                for event, elem in ElementTree.iterparse(f, events=('end',)):
+                    if elem.tag != f'{NS_S}row':
+                        continue
+                    cells = []
+                    for cell in elem.iter(f'{NS_S}c'):
+                        value = cell.find(f'{NS_S}v')
+                        if cell.get('t') == 'inlineStr':
+                            text = ''.join(t.text or '' for t in cell.iter(f'{NS_S}t'))
+                        elif value is None or value.text is None:
+                            continue
+                        elif cell.get('t') == 's':
+                            text = shared[int(value.text)] if int(value.text) < len(shared) else ''
+                        else:
+                            text = value.text
+                        column = _column_index(cell.get('r', ''))
+                        if column >= 0:
+                            cells.extend([''] * (column - len(cells)))
+                        cells.append(text)
+                    elem.clear()
+                    buf.add('\t'.join(cells).rstrip('\t'))
+                    if buf.full:
+                        return
+
+
+def extract_pdf(path, buf):
+    # pypdf 是可选依赖，未安装时 PDF 仍按原文件上传
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedDocument('pypdf is not installed')
+    reader = PdfReader(path)
+    for number, page in enumerate(reader.pages, 1):
+        buf.add(f'[Page {number}]')
+        for line in (page.extract_text() or '').splitlines():
+            buf.add(line)
+        if buf.full:
+            return
+
+
+EXTRACTORS = {
+    'docx': extract_docx,
+    'xlsx': extract_xlsx,
+    'xlsm': extract_xlsx,
+    'pptx': extract_pptx,
+    'pdf': extract_pdf,
+}
+EXTRACTORS.update({ext: extract_plain for ext in TEXT_EXTENSIONS})
+
+
+class TextExtractor:
+    """Turns document attachments into compact text, cached by content hash.
+
+    Each result is stored as ``<cache_dir>/<sha256[:2]>/<sha256>.json`` so an
+    attachment that arrives again (reply chains, forwards, retries) is never
+    parsed twice. Failures are cached too; raising ``max_chars`` only
+    re-extracts entries that were truncated under the old cap.
+    """
+
+    def __init__(self, cache_dir=EXTRACTION_CACHE_DIR, max_chars=EXTRACTION_MAX_CHARS, enabled=EXTRACTION_ENABLED):
+        self.cache_dir = cache_dir
+        self.max_chars = max_chars
+        self.enabled = enabled
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def supports(self, path):
+        return self.enabled and os.path.splitext(path)[1].lower().lstrip('.') in EXTRACTORS
+
+    def _count(self, outcome):
+        ATTACHMENT_EXTRACTIONS.labels(outcome).inc()
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def _cache_path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], f'{digest}.json')
+
+    def _load(self, digest):
+        path = self._cache_path(digest)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('version') != EXTRACTOR_VERSION:
+            return None
+        if entry.get('truncated') and entry.get('max_chars', 0) < self.max_chars:
+            return None
+        return entry
+
+    def _store(self, digest, entry):
+        path = self._cache_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def extract(self, path):
+        """Returns ``{'text', 'truncated', 'chars'}`` or ``None`` if the file can't be extracted."""
+        if not self.supports(path):
+            return None
+        digest = file_digest(path)
+        entry = self._load(digest)
+        if entry is not None:
+            self._count('hit')
+        else:
+            entry = {'version': EXTRACTOR_VERSION, 'max_chars': self.max_chars}
+            buf = TextBuffer(self.max_chars)
+            try:
+                EXTRACTORS[os.path.splitext(path)[1].lower().lstrip('.')](path, buf)
+                entry.update(text=buf.text(), truncated=buf.truncated, chars=buf.size)
+                self._count('extracted')
+            except UnsupportedDocument:
+                # 不写缓存：装上可选依赖后应当重新提取
+                self._count('unsupported')
+                return None
+            except (zipfile.BadZipFile, KeyError, ElementTree.ParseError, ValueError, OSError) as e:
+                logging.warning(f"Failed to extract text from {path}: {e}")
+                entry['error'] = f'{type(e).__name__}: {e}'
+                self._count('failed')
+            except Exception as e:
+                # pypdf 等解析库的异常类型很多，失败就退回上传原文件
+                logging.exception(f"Failed to extract text from {path}")
+                entry['error'] = f'{type(e).__name__}: {e}'
+                self._count('failed')
+            self._store(digest, entry)
+        if entry.get('error') or not entry.get('text'):
+            return None
+        text = entry['text'][:self.max_chars]
+        truncated = entry['truncated'] or len(entry['text']) > self.max_chars
+        return {'text': text, 'truncated': truncated, 'chars': len(text)}
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'max_chars': self.max_chars, 'outcomes': dict(self._counts)}
+
+
+def format_attachment_texts(items):
+    # 每个附件一段，标明文件名和是否截断，方便工作流里的提示词引用
+    sections = []
+    for name, result in items:
+        note = ' (truncated)' if result['truncated'] else ''
+        sections.append(f"### {name}{note}\n{result['text']}")
+    return '\n\n'.join(sections)
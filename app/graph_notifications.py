@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+
+from .throttle import http
+
+GRAPH_NOTIFICATION_URL = os.environ.get('GRAPH_NOTIFICATION_URL')
+GRAPH_CLIENT_STATE = os.environ.get('GRAPH_CLIENT_STATE', 'xarl-email-agent')
+GRAPH_SUBSCRIPTION_RESOURCE = "me/mailFolders('inbox')/messages"
+# 放在 ./state 卷上，容器重建后不必重新订阅、重建 delta 基线
+GRAPH_SUBSCRIPTION_FILE = os.environ.get('GRAPH_SUBSCRIPTION_FILE', os.path.join('state', 'graph_subscription.json'))
+GRAPH_DELTA_FILE = os.environ.get('GRAPH_DELTA_FILE', os.path.join('state', 'graph_delta.json'))
+# 已收到通知但尚未下载完成的邮件 id，重启后继续下载
+GRAPH_PENDING_FILE = os.environ.get('GRAPH_PENDING_FILE', os.path.join('state', 'graph_pending.json'))
+# 旧版本的默认位置，新文件不存在时从这里读取
+LEGACY_GRAPH_FILES = {GRAPH_SUBSCRIPTION_FILE: 'graph_subscription.json', GRAPH_DELTA_FILE: 'graph_delta.json'}
+# Outlook 消息订阅最长 4230 分钟
+GRAPH_SUBSCRIPTION_MINUTES = int(os.environ.get('GRAPH_SUBSCRIPTION_MINUTES', '4230'))
+GRAPH_SUBSCRIPTION_RENEW_BEFORE_SECONDS = int(os.environ.get('GRAPH_SUBSCRIPTION_RENEW_BEFORE_SECONDS', '3600'))
+GRAPH_RENEW_CHECK_SECONDS = int(os.environ.get('GRAPH_RENEW_CHECK_SECONDS', '300'))
+GRAPH_DELTA_FALLBACK_SECONDS = int(os.environ.get('GRAPH_DELTA_FALLBACK_SECONDS', '900'))
+GRAPH_SEEN_IDS_MAX = 5000
+
+
+def _parse_graph_datetime(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        path = LEGACY_GRAPH_FILES.get(path)
+        if not path or not os.path.exists(path):
+            return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class GraphNotifications:
+    """Push ingestion for new inbox messages.
+
+    Change notifications only enqueue message ids; the fetch stage drains
+    them with ``take_pending`` and reports back with ``ack`` once an email is
+    on disk, or ``requeue`` when it failed so the id is tried again. While no subscription is active, or when no
+    notification has arrived for a while, a delta query over the inbox fills
+    the same queue so missed notifications are still picked up. Delta also
+    reports changes to old messages (read flags, moves), so entries that
+    ``is_new`` rejects or whose id is in ``processed_ids`` are not enqueued.
+    Pending and in-flight ids are persisted to ``pending_file`` so a restart
+    does not lose notifications that were never fetched.
+    """
+
+    def __init__(self, base_url, headers, notification_url=GRAPH_NOTIFICATION_URL,
+                 client_state=GRAPH_CLIENT_STATE, is_new=None, processed_ids=None, pending_file=GRAPH_PENDING_FILE):
+        self.base_url = base_url
+        self.headers = headers
+        self.is_new = is_new or (lambda msg: True)
+        self.processed_ids = processed_ids or set
+        self.notification_url = notification_url
+        self.client_state = client_state
+        self.pending_file = pending_file
+        # 上次退出时下载中的邮件也放回待下载队列
+        self._pending = OrderedDict((message_id, time.time()) for message_id in (_load_json(pending_file) or []))
+        self._inflight = set()
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_notification_at = None
+        self.last_delta_at = None
+        self.counters = {'notifications': 0, 'rejected': 0, 'enqueued': 0, 'delta_polls': 0, 'renewals': 0}
+
+    @property
+    def enabled(self):
+        return bool(self.notification_url)
+
+    # --- message id queue ---
+
+    def enqueue(self, message_id):
+        with self._lock:
+            if message_id in self._pending or message_id in self._inflight or message_id in self._seen:
+                return False
+            self._pending[message_id] = time.time()
+            self.counters['enqueued'] += 1
+            self._save_pending()
+            return True
+
+    def take_pending(self, limit):
+        with self._lock:
+            ids = []
+            while self._pending and len(ids) < limit:
+                message_id, _ = self._pending.popitem(last=False)
+                ids.append(message_id)
+                self._inflight.add(message_id)
+            return ids
+
+    def ack(self, message_id):
+        # 下载完成后才记为已见，之后重复的通知直接忽略
+        with self._lock:
+            self._inflight.discard(message_id)
+            self._seen[message_id] = None
+            while len(self._seen) > GRAPH_SEEN_IDS_MAX:
+                self._seen.popitem(last=False)
+            self._save_pending()
+
+    def requeue(self, message_id, front=False):
+        with self._lock:
+            self._inflight.discard(message_id)
+            if message_id not in self._seen:
+                self._pending.setdefault(message_id, time.time())
+                if front:
+                    self._pending.move_to_end(message_id, last=False)
+            self._save_pending()
+
+    def _save_pending(self):
+        # 调用方持有 self._lock
+        _save_json(self.pending_file, list(self._inflight) + list(self._pending))
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    # --- change notifications ---
+
+    def handle_notifications(self, payload):
+        enqueued = 0
+        for item in payload.get('value', []):
+            if item.get('clientState') != self.client_state:
+                self.counters['rejected'] += 1
+                logging.warning(f"Rejected Graph notification with unexpected clientState for {item.get('subscriptionId')}")
+                continue
+            if item.get('lifecycleEvent'):
+                # reauthorizationRequired / subscriptionRemoved / missed
+                # 在后台处理，尽快给 Graph 返回 202
+                logging.info(f"Graph lifecycle event: {item['lifecycleEvent']}")
+                if item['lifecycleEvent'] == 'missed':
+                    target, kwargs = self.delta_poll, {}
+                else:
+                    target, kwargs = self.ensure_subscription, {'force': True}
+                threading.Thread(target=target, kwargs=kwargs, daemon=True).start()
+                continue
+            self.counters['notifications'] += 1
+            self.last_notification_at = time.time()
+            message_id = (item.get('resourceData') or {}).get('id')
+            if not message_id and item.get('resource'):
+                message_id = item['resource'].rstrip('/').split('/')[-1].split("('")[-1].rstrip("')")
+            if message_id and self.enqueue(message_id):
+                enqueued += 1
+        return enqueued
+
+    # --- subscription lifecycle ---
+
+    def load_subscription(self):
+        return _load_json(GRAPH_SUBSCRIPTION_FILE)
+
+    def subscription_active(self):
+        subscription = self.load_subscription()
+        if not subscription:
+            return False
+        return _parse_graph_datetime(subscription['expirationDateTime']) > datetime.now(timezone.utc)
+
+    def _expiration(self):
+        expires = datetime.now(timezone.utc) + timedelta(minutes=GRAPH_SUBSCRIPTION_MINUTES)
+        return expires.strftime('%Y-%m-%dT%H:%M:%S.0000000Z')
+
+    def _create_subscription(self):
+        body = {
+            'changeType': 'created',
+            'notificationUrl': self.notification_url,
+            'lifecycleNotificationUrl': self.notification_url,
+            'resource': GRAPH_SUBSCRIPTION_RESOURCE,
+            'expirationDateTime': self._expiration(),
+            'clientState': self.client_state,
+        }
+        resp = http.post(f"{self.base_url}/subscriptions", headers=self.headers, json=body, timeout=30)
+        if resp.status_code != 201:
+            logging.error(f"Failed to create Graph subscription: {resp.status_code} {resp.text}")
+            return None
+        subscription = resp.json()
+        _save_json(GRAPH_SUBSCRIPTION_FILE, {'id': subscription['id'], 'expirationDateTime': subscription['expirationDateTime']})
+        logging.info(f"Created Graph subscription {subscription['id']}")
+        return subscription
+
+    def ensure_subscription(self, force=False):
+        if not self.enabled:
+            return None
+        subscription = self.load_subscription()
+        if not subscription:
+            return self._create_subscription()
+        remaining = (_parse_graph_datetime(subscription['expirationDateTime']) - datetime.now(timezone.utc)).total_seconds()
+        if not force and remaining > GRAPH_SUBSCRIPTION_RENEW_BEFORE_SECONDS:
+            return subscription
+        if remaining <= 0:
+            return self._create_subscription()
+        resp = http.patch(f"{self.base_url}/subscriptions/{subscription['id']}", headers=self.headers,
+                          json={'expirationDateTime': self._expiration()}, timeout=30)
+        if resp.status_code == 404:
+            return self._create_subscription()
+        if resp.status_code != 200:
+            logging.error(f"Failed to renew Graph subscription: {resp.status_code} {resp.text}")
+            return subscription
+        subscription['expirationDateTime'] = resp.json()['expirationDateTime']
+        _save_json(GRAPH_SUBSCRIPTION_FILE, subscription)
+        self.counters['renewals'] += 1
+        return subscription
+
+    # --- delta polling fallback ---
+
+    def needs_delta_poll(self):
+        if not self.subscription_active():
+            return True
+        last_signal = max(self.last_notification_at or 0, self.last_delta_at or 0)
+        return time.time() - last_signal > GRAPH_DELTA_FALLBACK_SECONDS
+
+    def delta_poll(self):
+        state = _load_json(GRAPH_DELTA_FILE)
+        # 首次 delta 只建立基线，不把收件箱里的历史邮件全部入队
+        baseline = state is None
+        url = state['deltaLink'] if state else (
+            f"{self.base_url}/{GRAPH_SUBSCRIPTION_RESOURCE}/delta?$select=id,receivedDateTime")
+        enqueued = 0
+        known = None
+        while url:
+            resp = http.get(url, headers=self.headers, timeout=30)
+            if resp.status_code == 410:
+                # deltaLink 失效，重新建立基线
+                if state is None:
+                    logging.error(f"Graph delta baseline returned 410\n{resp.text}")
+                    return enqueued
+                for path in (GRAPH_DELTA_FILE, LEGACY_GRAPH_FILES.get(GRAPH_DELTA_FILE)):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                return self.delta_poll()
+            if resp.status_code != 200:
+                logging.error(f"Error polling Graph delta: {resp.status_code}\n{resp.text}")
+                return enqueued
+            data = resp.json()
+            if not baseline:
+                for msg in data.get('value', []):
+                    if '@removed' in msg or not self.is_new(msg):
+                        continue
+                    if known is None:
+                        known = self.processed_ids()
+                    if msg['id'] not in known and self.enqueue(msg['id']):
+                        enqueued += 1
+            url = data.get('@odata.nextLink')
+            if data.get('@odata.deltaLink'):
+                _save_json(GRAPH_DELTA_FILE, {'deltaLink': data['@odata.deltaLink']})
+        self.last_delta_at = time.time()
+        self.counters['delta_polls'] += 1
+        return enqueued
+
+    # --- background renewal ---
+
+    def _renew_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.ensure_subscription()
+            except Exception:
+                logging.exception("Graph subscription renewal failed")
+            self._stop.wait(GRAPH_RENEW_CHECK_SECONDS)
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._renew_loop, name='graph-subscription-renewal', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self):
+        return {
+            'enabled': self.enabled,
+            'subscription': self.load_subscription(),
+            'subscription_active': self.subscription_active(),
+            'pending': self.pending_count(),
+            'inflight': len(self._inflight),
+            'counters': dict(self.counters),
+        }
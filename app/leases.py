@@ -0,0 +1,205 @@
+import os
+import time
+import socket
+import logging
+import sqlite3
+import threading
+
+WORKER_MODE = os.environ.get('WORKER_MODE', '').lower() in ('1', 'true', 'yes', 'on')
+WORKER_ID = os.environ.get('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+# 多个副本必须挂载同一个目录；SQLite WAL 不适用于网络文件系统
+LEASE_DB = os.environ.get('LEASE_DB', os.path.join('state', 'leases.db'))
+LEASE_TTL_SECONDS = float(os.environ.get('LEASE_TTL_SECONDS', '300'))
+LEASE_RETENTION_DAYS = float(os.environ.get('LEASE_RETENTION_DAYS', '30'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class LeaseStore:
+    """Expiring work claims shared by every replica through one SQLite file.
+
+    A key is claimed by inserting or taking over its row inside a write
+    transaction, so only one worker can win. Claims held by this process are
+    also tracked in memory, so a second claim of a held key fails even from
+    the same worker (or with the store disabled), and are renewed in the
+    background; when a worker dies its leases simply expire
+    and the next claim takes them over. Completed keys stay marked as done so
+    that no replica processes them again.
+    """
+
+    def __init__(self, path=LEASE_DB, worker_id=WORKER_ID, ttl=LEASE_TTL_SECONDS, enabled=WORKER_MODE):
+        self.path = path
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.enabled = enabled
+        self.held = set()
+        self.counters = {'claimed': 0, 'reclaimed': 0, 'contended': 0, 'completed': 0, 'released': 0, 'lost': 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def claim(self, key):
+        # 本进程已持有的租约不能再次认领（回填与实时拉取不会重复下载），只有 renew 会刷新它
+        with self._lock:
+            if key in self.held:
+                self.counters['contended'] += 1
+                return False
+            self.held.add(key)
+        if not self.enabled:
+            return True
+        try:
+            outcome, previous = self._claim_row(key)
+        except BaseException:
+            with self._lock:
+                self.held.discard(key)
+            raise
+        if outcome is not None:
+            self._count(outcome)
+        if outcome in (None, 'contended'):
+            with self._lock:
+                self.held.discard(key)
+            return False
+        if outcome == 'reclaimed':
+            logging.info(f"Reclaimed expired lease {key} from {previous}")
+        return True
+
+    def _claim_row(self, key):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT owner, expires_at, done FROM leases WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                conn.execute('INSERT INTO leases (key, owner, expires_at, updated_at) VALUES (?, ?, ?, ?)',
+                             (key, self.worker_id, now + self.ttl, now))
+                outcome = 'claimed'
+            elif row[2]:
+                outcome = None
+            elif row[0] == self.worker_id or row[1] < now:
+                # 本进程没有持有却记在自己名下：同一 WORKER_ID 上次退出前留下的租约
+                conn.execute('UPDATE leases SET owner = ?, expires_at = ?, attempts = attempts + 1, updated_at = ? '
+                             'WHERE key = ?', (self.worker_id, now + self.ttl, now, key))
+                outcome = 'claimed' if row[0] == self.worker_id else 'reclaimed'
+            else:
+                outcome = 'contended'
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return outcome, row[0] if row else None
+
+    def _finish(self, key, done):
+        with self._lock:
+            self.held.discard(key)
+        if not self.enabled:
+            return
+        conn = self._connect()
+        if done:
+            cursor = conn.execute('UPDATE leases SET done = 1, expires_at = 0, updated_at = ? WHERE key = ? AND owner = ?',
+                                  (time.time(), key, self.worker_id))
+        else:
+            cursor = conn.execute('DELETE FROM leases WHERE key = ? AND owner = ? AND done = 0', (key, self.worker_id))
+        if cursor.rowcount:
+            self._count('completed' if done else 'released')
+        else:
+            # 续约没跟上，租约已被别的副本接管
+            self._count('lost')
+            logging.warning(f"Lease {key} was taken over by another worker before it finished")
+
+    def complete(self, key):
+        self._finish(key, True)
+
+    def release(self, key):
+        self._finish(key, False)
+
+    def is_done(self, key):
+        if not self.enabled:
+            return False
+        row = self._connect().execute('SELECT done FROM leases WHERE key = ?', (key,)).fetchone()
+        return bool(row and row[0])
+
+    def renew(self):
+        with self._lock:
+            keys = list(self.held)
+        if not keys:
+            return
+        conn = self._connect()
+        now = time.time()
+        conn.executemany('UPDATE leases SET expires_at = ?, updated_at = ? WHERE key = ? AND owner = ? AND done = 0',
+                         [(now + self.ttl, now, key, self.worker_id) for key in keys])
+
+    def prune(self):
+        cutoff = time.time() - LEASE_RETENTION_DAYS * 86400
+        self._connect().execute('DELETE FROM leases WHERE done = 1 AND updated_at < ?', (cutoff,))
+
+    def _renew_loop(self):
+        last_prune = 0.0
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self.renew()
+                if time.time() - last_prune > 3600:
+                    self.prune()
+                    last_prune = time.time()
+            except Exception:
+                logging.exception("Lease renewal failed")
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._renew_loop, name='lease-renewal', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        # 正常退出时立即释放未完成的租约，其他副本不必等到过期
+        with self._lock:
+            keys = list(self.held)
+        for key in keys:
+            try:
+                self.release(key)
+            except sqlite3.Error:
+                logging.exception(f"Failed to release lease {key}")
+
+    def stats(self):
+        result = {'enabled': self.enabled, 'worker_id': self.worker_id, 'ttl_seconds': self.ttl}
+        with self._lock:
+            result['held'] = len(self.held)
+            result['counters'] = dict(self.counters)
+        if self.enabled:
+            rows = self._connect().execute(
+                'SELECT done, expires_at < ?, COUNT(*) FROM leases GROUP BY 1, 2', (time.time(),)).fetchall()
+            result['store'] = {'done': 0, 'active': 0, 'expired': 0}
+            for done, expired, count in rows:
+                result['store']['done' if done else ('expired' if expired else 'active')] += count
+        return result
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+# "me,team@corp.com=TEAM_MAILBOX_TOKEN,shared@corp.com"
+# 等号后是存放该邮箱访问令牌的环境变量名，省略时使用 EMAIL_ACCESS_TOKEN
+GRAPH_MAILBOXES = os.environ.get('GRAPH_MAILBOXES', 'me')
+# 放在 ./state 卷上，容器重建后游标不丢
+MAILBOX_STATE_FILE = os.environ.get('MAILBOX_STATE_FILE', os.path.join('state', 'mailbox_cursors.json'))
+# 旧版本的默认位置，新文件不存在时从这里读取
+LEGACY_MAILBOX_STATE_FILE = 'mailbox_cursors.json'
+MAILBOX_MAX_PAGES = int(os.environ.get('MAILBOX_MAX_PAGES', '5'))
+# 同一封邮件连续下载/渲染失败这么多次后隔离，不再阻塞游标
+FETCH_MAX_ATTEMPTS = int(os.environ.get('FETCH_MAX_ATTEMPTS', '3'))
+QUARANTINE_KEEP = 100
+SOURCE_FILE = 'source.json'
+
+
+def parse_graph_datetime(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def format_graph_datetime(dt):
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class Mailbox:
+    def __init__(self, mailbox_id, token):
+        self.id = mailbox_id
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    @property
+    def path(self):
+        return 'me' if self.id == 'me' else f"users/{quote(self.id)}"
+
+    def url(self, base_url, suffix):
+        return f"{base_url}/{self.path}/{suffix}"
+
+
+def parse_mailboxes(spec, default_token):
+    mailboxes = []
+    for item in spec.split(','):
+        mailbox_id, _, token_env = item.strip().partition('=')
+        if not mailbox_id:
+            continue
+        token = os.environ.get(token_env.strip()) if token_env.strip() else default_token
+        if token_env.strip() and not token:
+            logging.warning(f"Token variable {token_env.strip()} for mailbox {mailbox_id} is not set")
+        mailboxes.append(Mailbox(mailbox_id, token))
+    return mailboxes
+
+
+class MailboxRegistry:
+    """Configured mailboxes, their receive cursors and fair fetch selection.
+
+    A mailbox cursor is the ``receivedDateTime`` of the oldest listed message
+    that has not been fetched yet, plus the ids already fetched at or after
+    it. Listing from the cursor therefore never drops a message that lost
+    out to higher-priority mail or to another mailbox in an earlier round.
+
+    Fetch failures are counted per message; after ``max_attempts`` the
+    message is quarantined so a single bad email cannot pin the cursor.
+    """
+
+    def __init__(self, mailboxes, state_file=MAILBOX_STATE_FILE, legacy_cursor_file=None,
+                 max_attempts=FETCH_MAX_ATTEMPTS):
+        self.mailboxes = {mailbox.id: mailbox for mailbox in mailboxes}
+        self.default = mailboxes[0]
+        self.state_file = state_file
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._offset = 0
+        self.state = self._load()
+        legacy_cursor = self._load_legacy_cursor(legacy_cursor_file)
+        if legacy_cursor and self.default.id not in self.state:
+            # 兼容单邮箱时代的 run_log.txt
+            self.state[self.default.id] = {'cursor': format_graph_datetime(legacy_cursor), 'fetched': {}}
+        self.lag = {}
+
+    @staticmethod
+    def _load_legacy_cursor(path):
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                return datetime.fromisoformat(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _load(self):
+        path = self.state_file
+        if not os.path.exists(path):
+            path = LEGACY_MAILBOX_STATE_FILE
+            if not os.path.exists(path):
+                return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logging.exception(f"Failed to read {path}, starting without cursors")
+            return {}
+
+    def _save(self):
+        directory = os.path.dirname(self.state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_file)
+
+    def get(self, mailbox_id=None):
+        if mailbox_id is None:
+            return self.default
+        return self.mailboxes.get(mailbox_id) or self.default
+
+    def cursor(self, mailbox_id):
+        with self._lock:
+            state = self.state.get(mailbox_id)
+            if not state or not state.get('cursor'):
+                return None
+            return parse_graph_datetime(state['cursor'])
+
+    def is_new(self, mailbox_id, msg):
+        with self._lock:
+            state = self.state.get(mailbox_id) or {}
+        cursor = state.get('cursor')
+        if msg['id'] in state.get('fetched', {}):
+            return False
+        received = msg.get('receivedDateTime')
+        return not (cursor and received and parse_graph_datetime(received) < parse_graph_datetime(cursor))
+
+    def select(self, candidates, limit, sort_key):
+        """Round-robins over mailboxes, each in its own priority order.
+
+        The starting mailbox rotates every call so small mailboxes are not
+        always served after the busy ones.
+        """
+        queues = {mailbox_id: sorted(messages, key=sort_key) for mailbox_id, messages in candidates.items() if messages}
+        order = sorted(queues)
+        if order:
+            start = self._offset % len(order)
+            order = order[start:] + order[:start]
+            self._offset += 1
+        chosen = []
+        while len(chosen) < limit and any(queues.values()):
+            for mailbox_id in order:
+                if queues[mailbox_id] and len(chosen) < limit:
+                    chosen.append((mailbox_id, queues[mailbox_id].pop(0)))
+        return chosen
+
+    def advance(self, mailbox_id, candidates, chosen_ids):
+        # 没被选中的邮件里最早的那封就是新的游标；全部选中则推进到本轮最晚的收件时间。
+        # candidates 必须是从旧游标开始的完整列举，只看本轮选中的邮件，不用之前轮次记下的更晚时间
+        waiting = [parse_graph_datetime(m['receivedDateTime']) for m in candidates
+                   if m['id'] not in chosen_ids and m.get('receivedDateTime')]
+        chosen = [m for m in candidates if m['id'] in chosen_ids]
+        with self._lock:
+            state = self.state.setdefault(mailbox_id, {'cursor': None, 'fetched': {}})
+            fetched = state.setdefault('fetched', {})
+            for msg in chosen:
+                fetched[msg['id']] = msg.get('receivedDateTime') or format_graph_datetime(datetime.now(timezone.utc))
+            if waiting:
+                cursor = min(waiting)
+            else:
+                received = [parse_graph_datetime(fetched[msg['id']]) for msg in chosen]
+                old = parse_graph_datetime(state['cursor']) if state.get('cursor') else None
+                cursor = max(received + ([old] if old else [])) if received or old else None
+            if cursor is not None:
+                state['cursor'] = format_graph_datetime(cursor)
+                state['fetched'] = {k: v for k, v in fetched.items() if parse_graph_datetime(v) >= cursor}
+            self.lag[mailbox_id] = max(0.0, time.time() - cursor.timestamp()) if waiting else 0.0
+            self._save()
+        return self.lag[mailbox_id]
+
+    def record_failure(self, mailbox_id, message_id, error):
+        """Counts a failed fetch; returns True once the message is quarantined."""
+        with self._lock:
+            state = self.state.setdefault(mailbox_id, {'cursor': None, 'fetched': {}})
+            failures = state.setdefault('failures', {})
+            entry = failures.setdefault(message_id, {'attempts': 0})
+            entry.update(attempts=entry['attempts'] + 1, error=f'{type(error).__name__}: {error}',
+                         last_failed=format_graph_datetime(datetime.now(timezone.utc)))
+            quarantined = entry['attempts'] >= self.max_attempts
+            if quarantined:
+                del failures[message_id]
+                logging.error(f"Quarantined message {message_id} in {mailbox_id} after "
+                              f"{entry['attempts']} failed attempts: {entry['error']}")
+                quarantine = state.setdefault('quarantined', {})
+                quarantine[message_id] = entry
+                while len(quarantine) > QUARANTINE_KEEP:
+                    del quarantine[next(iter(quarantine))]
+            self._save()
+            return quarantined
+
+    def clear_failure(self, mailbox_id, message_id):
+        with self._lock:
+            failures = (self.state.get(mailbox_id) or {}).get('failures') or {}
+            if failures.pop(message_id, None) is not None:
+                self._save()
+
+    def stats(self):
+        with self._lock:
+            return {mailbox_id: {
+                'cursor': (self.state.get(mailbox_id) or {}).get('cursor'),
+                'lag_seconds': round(self.lag[mailbox_id], 1) if mailbox_id in self.lag else None,
+                'failing': dict((self.state.get(mailbox_id) or {}).get('failures') or {}),
+                'quarantined': dict((self.state.get(mailbox_id) or {}).get('quarantined') or {}),
+            } for mailbox_id in self.mailboxes}
+
+
+def save_source(folder, mailbox_id, message_id, received, **extra):
+    with open(os.path.join(folder, SOURCE_FILE), 'w', encoding='utf-8') as f:
+        json.dump(dict({'mailbox': mailbox_id, 'message_id': message_id, 'received': received}, **extra), f)
+
+
+def load_source(folder):
+    path = os.path.join(folder, SOURCE_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
@@ -1,7 +1,9 @@
 import os
+import time
 import logging
-import requests
-from fastapi import FastAPI, HTTPException
+import threading
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timezone
@@ -10,7 +12,29 @@ from fpdf import FPDF
 import email
 from email import policy
 import re
-import base64
+import json
+
+from .retention import ArchiveStore, RETENTION_DAYS, eml_message_id
+from .triage import Triage, ROUTE_SKIP, ROUTE_LIGHTWEIGHT, ROUTE_FULL
+from .workflow_cache import WorkflowCache, content_key, normalize_addresses
+from .attachment_policy import AttachmentPolicy, save_skipped, load_skipped
+from .extraction import (TextExtractor, format_attachment_texts, EXTRACTION_UPLOAD_ORIGINALS,
+                         EXTRACTION_INPUT_NAME)
+from .priority import PriorityWorkQueue, NORMAL, LOW
+from .graph_notifications import GraphNotifications
+from .throttle import http
+from . import metrics
+from .metrics import observe_stage, count_bytes
+from . import tracing
+from .tracing import span, start_trace
+from .profiling import Profiler
+from .scheduler import PollScheduler, DAEMON_MODE
+from .backfill import Backfill, parse_range_bound, BACKFILL_PARTITION_HOURS
+from .pipeline import Pipeline, PIPELINE_MODE
+from .leases import LeaseStore
+from .mailboxes import (MailboxRegistry, parse_mailboxes, parse_graph_datetime, format_graph_datetime,
+                        save_source, load_source, GRAPH_MAILBOXES, MAILBOX_MAX_PAGES)
+from .circuit import CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, ServiceUnavailableError
 
 # --- CONFIGURATION ---
 DIFY_BASE_URL = os.environ.get('DIFY_BASE_URL', 'http://192.168.2.13/v1')
@@ -23,21 +47,76 @@ WORKFLOW_RESPONSES_DIR = os.environ.get('WORKFLOW_RESPONSES_DIR', 'workflow_resp
 WECOM_CORPID = os.environ.get("WECOM_CORPID")
 WECOM_CORPSECRET = os.environ.get("WECOM_CORPSECRET")
 WECOM_AGENTID = os.environ.get("WECOM_AGENTID")
+WECOM_BASE_URL = os.environ.get("WECOM_BASE_URL", "https://qyapi.weixin.qq.com")
+WECOM_MAX_ATTEMPTS = int(os.environ.get("WECOM_MAX_ATTEMPTS", "3"))
+WECOM_RETRY_SECONDS = float(os.environ.get("WECOM_RETRY_SECONDS", "1"))
+# 企业微信出错时 HTTP 状态仍是 200：-1 系统繁忙，45009 接口调用超过限制，40014/42001 access_token 无效或过期
+WECOM_RETRYABLE_ERRCODES = {-1, 45009, 40014, 42001}
 
+GRAPH_BASE_URL = os.environ.get('GRAPH_BASE_URL', 'https://graph.microsoft.com/v1.0')
 EMAIL_ACCESS_TOKEN = os.environ.get('EMAIL_ACCESS_TOKEN')
-EMAIL_HEADERS = {'Authorization': f'Bearer {EMAIL_ACCESS_TOKEN}'}
 EMAIL_DOWNLOAD_DIR = 'downloaded_emails'
 EMAIL_PROCESSED_DIR = 'processed_emails'
 EMAIL_LOG_FILE = 'run_log.txt'
-EMAIL_DEFAULT_EMAIL_COUNT = 10
+EMAIL_DEFAULT_EMAIL_COUNT = int(os.environ.get('EMAIL_DEFAULT_EMAIL_COUNT', '10'))
+
+# 单次 process_emails 的总耗时上限，按剩余邮件数平均分配
+PROCESS_RUN_DEADLINE_SECONDS = float(os.environ.get('PROCESS_RUN_DEADLINE_SECONDS', '900'))
+PROCESS_MIN_GROUP_SECONDS = float(os.environ.get('PROCESS_MIN_GROUP_SECONDS', '30'))
+
+archive_store = ArchiveStore()
+triage = Triage()
+attachment_policy = AttachmentPolicy()
+text_extractor = TextExtractor()
+workflow_cache = WorkflowCache()
+workflow_queue = PriorityWorkQueue()
+mailboxes = MailboxRegistry(parse_mailboxes(GRAPH_MAILBOXES, EMAIL_ACCESS_TOKEN), legacy_cursor_file=EMAIL_LOG_FILE)
+# 推送订阅只覆盖第一个（默认）邮箱；delta 里早于其游标或已下载过的旧邮件不再入队
+graph_notifications = GraphNotifications(GRAPH_BASE_URL, mailboxes.default.headers,
+                                         is_new=lambda msg: mailboxes.is_new(mailboxes.default.id, msg),
+                                         processed_ids=lambda: processed_message_ids())
+dify_breaker = CircuitBreaker('dify')
+profiler = Profiler()
+leases = LeaseStore()
+# 守护模式下的定时拉取与手动调用接口互斥，避免同时操作同一批邮件
+pipeline_lock = threading.RLock()
+# fpdf 首次加载字体时会写 .pkl 缓存，并发读写会读到半个文件
+font_lock = threading.Lock()
+scheduler = PollScheduler(lambda: get_emails(), None if PIPELINE_MODE else lambda: process_emails(),
+                          EMAIL_DEFAULT_EMAIL_COUNT)
+pipeline = Pipeline(workflow_queue, lambda group: enqueue_email_group(group), lambda group: run_group(group),
+                    lambda: collect_email_groups())
+backfill = Backfill(GRAPH_BASE_URL, mailboxes,
+                    fetch=lambda mailbox, msg: fetch_claimed(dict(msg, backfill=True), mailbox) is not None,
+                    processed_ids=lambda: processed_message_ids(),
+                    pending_groups=lambda: len(workflow_queue) if pipeline.enabled else len(collect_email_groups()),
+                    is_done=lambda msg: leases.is_done(f"message:{msg['id']}"))
 
 logging.basicConfig(level=logging.INFO)
 
 app = FastAPI(title="XARL Email Workflow API", description="API to process new emails and trigger Dify workflow.")
 
+@app.on_event("startup")
+def start_background_tasks():
+    graph_notifications.start()
+    leases.start()
+    pipeline.start()
+    if DAEMON_MODE:
+        scheduler.start()
+    if backfill.resume():
+        logging.info("Resumed unfinished backfill")
+
+@app.on_event("shutdown")
+def stop_background_tasks():
+    scheduler.stop()
+    backfill.stop()
+    pipeline.stop()
+    leases.stop()
+    graph_notifications.stop()
+
 @app.get("/health", summary="健康检查", tags=["Health"])
 def health_check():
-    return {"status": "ok"}
+    return {"status": "ok", "dify_circuit": dify_breaker.snapshot()}
 
 class ProcessResult(BaseModel):
     folder_name: str
@@ -45,31 +124,60 @@ class ProcessResult(BaseModel):
     workflow_response: dict
     webhook_status: Optional[int] = None
     webhook_response: Optional[dict] = None
+    triage: Optional[str] = None
+    cache: Optional[str] = None
+    skipped_attachments: Optional[List[dict]] = None
+    trace_id: Optional[str] = None
     error: Optional[str] = None
 
 # 辅助函数 - 移到全局作用域
-def file_is_newer_than(path, dt):
-    mtime = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
-    return mtime > dt
-
 def guess_mime_type(filename):
     mime_type, _ = mimetypes.guess_type(filename)
     return mime_type or 'application/octet-stream'
 
-def upload_file(filepath):
+@observe_stage(metrics.STAGE_DIFY_UPLOAD)
+@span(metrics.STAGE_DIFY_UPLOAD)
+def upload_file(filepath, deadline=None):
     url = f"{DIFY_BASE_URL}/files/upload"
     headers = {'Authorization': f'Bearer {DIFY_API_KEY}'}
     mime_type = guess_mime_type(filepath)
     with open(filepath, 'rb') as f:
         files = {'file': (os.path.basename(filepath), f, mime_type)}
         data = {'user': USER_ID}
-        resp = requests.post(url, headers=headers, files=files, data=data, timeout=30)
+        # 重复上传只会在 Dify 多出一个文件，可以按幂等请求重试
+        resp = http.post(url, headers=headers, files=files, data=data, timeout=30, idempotent=True, deadline=deadline)
+    count_bytes(metrics.STAGE_DIFY_UPLOAD, 'out', os.path.getsize(filepath))
+    tracing.set_attribute('file', os.path.basename(filepath))
+    tracing.set_attribute('bytes', os.path.getsize(filepath))
     if resp.status_code == 201:
         data = resp.json()
         return data.get('id') or data.get('file_id')
     else:
         logging.error(f"Failed to upload {filepath}: {resp.status_code} {resp.text}")
+        # 不能静默丢弃附件，让整封邮件失败并在下一轮重试
+        error_type = ServiceUnavailableError if resp.status_code == 429 or resp.status_code >= 500 else RuntimeError
+        raise error_type(f"Failed to upload {os.path.basename(filepath)}: HTTP {resp.status_code}")
+
+@observe_stage(metrics.STAGE_WORKFLOW_RUN)
+@span(metrics.STAGE_WORKFLOW_RUN)
+def run_workflow(body, deadline=None):
+    workflow_url = f"{DIFY_BASE_URL}/workflows/run"
+    headers = {
+        'Authorization': f'Bearer {DIFY_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+    resp = http.post(workflow_url, headers=headers, json=body, timeout=60, deadline=deadline)
+    if resp.status_code == 429 or resp.status_code >= 500:
+        # 限流或服务端错误不写结果文件，邮件保持待处理状态
+        raise ServiceUnavailableError(f"Workflow run failed: HTTP {resp.status_code}")
+    return resp
+
+def read_eml(folder_name):
+    eml_path = os.path.join(EMAIL_DOWNLOAD_DIR, f"{folder_name}.eml")
+    if not os.path.exists(eml_path):
         return None
+    with open(eml_path, 'rb') as f:
+        return email.message_from_binary_file(f, policy=policy.default)
 
 def get_api_file_type(filename):
     ext = filename.lower().split('.')[-1]
@@ -84,14 +192,51 @@ def get_api_file_type(filename):
     else:
         return 'custom'
 
+@observe_stage(metrics.STAGE_ATTACHMENT_EXTRACT)
+@span(metrics.STAGE_ATTACHMENT_EXTRACT)
+def extract_attachment_texts(attachment_paths):
+    """Splits attachments into extracted texts and files that still need uploading.
+
+    Returns ``(texts, upload_paths)``; files that can't be extracted are
+    always uploaded, extracted ones only with EXTRACTION_UPLOAD_ORIGINALS.
+    """
+    texts = []
+    upload_paths = []
+    for att_path in attachment_paths:
+        result = text_extractor.extract(att_path)
+        if result is not None:
+            texts.append((os.path.basename(att_path), result))
+            if not EXTRACTION_UPLOAD_ORIGINALS:
+                continue
+        upload_paths.append(att_path)
+    return texts, upload_paths
+
+class WeComError(RuntimeError):
+    def __init__(self, errcode, message):
+        super().__init__(message)
+        self.errcode = errcode
+
+def check_wecom_response(resp, action):
+    try:
+        data = resp.json()
+    except ValueError:
+        raise WeComError(None, f"{action} failed: HTTP {resp.status_code} {resp.text[:200]}")
+    errcode = data.get('errcode', 0)
+    if resp.status_code != 200 or errcode:
+        raise WeComError(errcode, f"{action} failed: HTTP {resp.status_code} errcode {errcode} {data.get('errmsg', '')}")
+    return data
+
+@observe_stage(metrics.STAGE_WECOM_TOKEN)
+@span(metrics.STAGE_WECOM_TOKEN)
 def get_wecom_access_token(corpid, corpsecret):
-    url = f"https://qyapi.weixin.qq.com/cgi-bin/gettoken?corpid={corpid}&corpsecret={corpsecret}"
-    resp = requests.get(url, timeout=10)
-    data = resp.json()
-    return data["access_token"]
+    url = f"{WECOM_BASE_URL}/cgi-bin/gettoken?corpid={corpid}&corpsecret={corpsecret}"
+    resp = http.get(url, timeout=10)
+    return check_wecom_response(resp, 'WeCom gettoken')["access_token"]
 
+@observe_stage(metrics.STAGE_WECOM_SEND)
+@span(metrics.STAGE_WECOM_SEND)
 def send_wecom_app_message(access_token, agentid, touser, content):
-    url = f"https://qyapi.weixin.qq.com/cgi-bin/message/send?access_token={access_token}"
+    url = f"{WECOM_BASE_URL}/cgi-bin/message/send?access_token={access_token}"
     payload = {
         "touser": touser,
         "msgtype": "text",
@@ -99,46 +244,60 @@ def send_wecom_app_message(access_token, agentid, touser, content):
         "text": {"content": content},
         "safe": 0
     }
-    resp = requests.post(url, json=payload, timeout=10)
+    resp = http.post(url, json=payload, timeout=10)
+    check_wecom_response(resp, 'WeCom message/send')
     return resp
 
-def get_last_run_time():
-    if not os.path.exists(EMAIL_LOG_FILE):
-        return None
-    with open(EMAIL_LOG_FILE, 'r') as f:
-        ts = f.read().strip()
-        if ts:
-            try:
-                return datetime.fromisoformat(ts)
-            except Exception:
-                return None
-    return None
-
-def log_run_time():
-    now = datetime.now(timezone.utc).isoformat()
-    with open(EMAIL_LOG_FILE, 'w') as f:
-        f.write(now)
-    return now
-
-def list_emails(since_datetime=None):
-    url = 'https://graph.microsoft.com/v1.0/me/messages?$top=50&$orderby=receivedDateTime desc'
-    resp = requests.get(url, headers=EMAIL_HEADERS)
-    if resp.status_code != 200:
-        logging.error(f"Error fetching emails: {resp.status_code}\n{resp.text}")
-        return []
-    emails = resp.json().get('value', [])
-    filtered_emails = []
-    for msg in emails:
-        received = msg.get('receivedDateTime')
-        if received and since_datetime:
-            try:
-                received_dt = datetime.fromisoformat(received.replace('Z', '+00:00'))
-                if received_dt <= since_datetime:
-                    continue
-            except Exception:
-                pass
-        filtered_emails.append(msg)
-    return filtered_emails
+def notify_wecom(touser, content):
+    # 繁忙、限频和 token 失效时重新取 token 再发；其他错误或重试用尽时抛出
+    for attempt in range(1, WECOM_MAX_ATTEMPTS + 1):
+        try:
+            access_token = get_wecom_access_token(WECOM_CORPID, WECOM_CORPSECRET)
+            return send_wecom_app_message(access_token, WECOM_AGENTID, touser, content)
+        except WeComError as e:
+            if e.errcode not in WECOM_RETRYABLE_ERRCODES or attempt >= WECOM_MAX_ATTEMPTS:
+                raise
+            logging.warning(f"{e}; retrying in {WECOM_RETRY_SECONDS * attempt:.1f}s (attempt {attempt})")
+            time.sleep(WECOM_RETRY_SECONDS * attempt)
+
+@observe_stage(metrics.STAGE_GRAPH_LIST)
+@span(metrics.STAGE_GRAPH_LIST)
+def list_emails(mailbox):
+    tracing.set_attribute('mailbox', mailbox.id)
+    cursor = mailboxes.cursor(mailbox.id)
+    if cursor is None:
+        # 首次运行只看最新一页，历史邮件不在这里补
+        url = mailbox.url(GRAPH_BASE_URL, 'messages?$top=50&$orderby=receivedDateTime desc')
+        pages = 1
+    else:
+        # 从游标开始按时间正序列举，未被选中的旧邮件下一轮仍会出现
+        url = mailbox.url(GRAPH_BASE_URL, f"messages?$filter=receivedDateTime ge {format_graph_datetime(cursor)}"
+                                          f"&$orderby=receivedDateTime asc&$top=50")
+        pages = MAILBOX_MAX_PAGES
+    emails = []
+    while url and pages:
+        resp = http.get(url, headers=mailbox.headers, timeout=60)
+        count_bytes(metrics.STAGE_GRAPH_LIST, 'in', len(resp.content))
+        if resp.status_code != 200:
+            # 列举不完整时返回 None，本轮不推进该邮箱的游标，否则游标之前未下载的邮件会被跳过
+            logging.error(f"Error fetching emails for {mailbox.id}: {resp.status_code}\n{resp.text}")
+            return None
+        data = resp.json()
+        emails.extend(m for m in data.get('value', []) if mailboxes.is_new(mailbox.id, m))
+        if len(emails) >= EMAIL_DEFAULT_EMAIL_COUNT:
+            break
+        url = data.get('@odata.nextLink')
+        pages -= 1
+    return emails
+
+def received_timestamp(msg):
+    received = msg.get('receivedDateTime')
+    if received:
+        try:
+            return datetime.fromisoformat(received.replace('Z', '+00:00')).timestamp()
+        except Exception:
+            pass
+    return datetime.now(timezone.utc).timestamp()
 
 def sanitize_filename(name):
     return re.sub(r'[\\/:*?"<>|]', '_', name)
@@ -151,61 +310,65 @@ def get_email_folder_name(msg):
     folder_name = f"{date}_{from_}_{to}_{subject}"
     return sanitize_filename(folder_name)
 
-def download_eml(message_id, filename, folder):
+@observe_stage(metrics.STAGE_EML_DOWNLOAD)
+@span(metrics.STAGE_EML_DOWNLOAD)
+def download_eml(message_id, filename, folder, mailbox=None):
+    mailbox = mailbox or mailboxes.default
     os.makedirs(folder, exist_ok=True)
     filepath = os.path.join(folder, filename)
-    url = f'https://graph.microsoft.com/v1.0/me/messages/{message_id}/$value'
-    resp = requests.get(url, headers=EMAIL_HEADERS)
+    url = mailbox.url(GRAPH_BASE_URL, f'messages/{message_id}/$value')
+    resp = http.get(url, headers=mailbox.headers, timeout=60)
     if resp.status_code == 200:
         with open(filepath, 'wb') as f:
             f.write(resp.content)
+        count_bytes(metrics.STAGE_EML_DOWNLOAD, 'in', len(resp.content))
     else:
         logging.error(f"Error downloading .eml: {resp.status_code}\n{resp.text}")
+        raise RuntimeError(f"Failed to download message {message_id}: HTTP {resp.status_code}")
     return filepath
 
-def download_attachments(message_id, folder):
-    url = f'https://graph.microsoft.com/v1.0/me/messages/{message_id}/attachments'
-    resp = requests.get(url, headers=EMAIL_HEADERS)
+@observe_stage(metrics.STAGE_ATTACHMENT_DOWNLOAD)
+@span(metrics.STAGE_ATTACHMENT_DOWNLOAD)
+def download_attachments(message_id, folder, mailbox=None):
+    """Downloads the attachments allowed by the attachment policy.
+
+    Only metadata is listed (no ``contentBytes``), so skipped attachments
+    are never transferred. Returns ``(names, skipped)``.
+    """
+    mailbox = mailbox or mailboxes.default
+    url = mailbox.url(GRAPH_BASE_URL, f'messages/{message_id}/attachments?$select=id,name,contentType,size,isInline')
+    resp = http.get(url, headers=mailbox.headers, timeout=60)
+    count_bytes(metrics.STAGE_ATTACHMENT_DOWNLOAD, 'in', len(resp.content))
     if resp.status_code != 200:
+        # 与 download_eml 一样抛出，邮件不记为已处理，下一轮重新下载
         logging.error(f"Error fetching attachments: {resp.status_code}\n{resp.text}")
-        return []
+        raise RuntimeError(f"Failed to list attachments of message {message_id}: HTTP {resp.status_code}")
     attachments = resp.json().get('value', [])
     if not attachments:
-        return []
+        return [], []
+    attachments, skipped = attachment_policy.select(attachments)
+    for item in skipped:
+        metrics.ATTACHMENTS_SKIPPED.labels(item['reason']).inc()
     att_names = []
     for att in attachments:
         att_id = att['id']
         att_name = att['name']
         att_names.append(att_name)
-        if att.get('@odata.mediaContentType'):
-            att_url = f'https://graph.microsoft.com/v1.0/me/messages/{message_id}/attachments/{att_id}/$value'
-            att_resp = requests.get(att_url, headers=EMAIL_HEADERS)
-            if att_resp.status_code == 200:
-                att_path = os.path.join(folder, att_name)
-                with open(att_path, 'wb') as f:
-                    f.write(att_resp.content)
-            else:
-                logging.error(f"Failed to download attachment {att_name}: {att_resp.status_code}")
-        elif 'contentBytes' in att:
+        # 文件附件和邮件附件都可以通过 $value 取原始内容
+        att_url = mailbox.url(GRAPH_BASE_URL, f'messages/{message_id}/attachments/{att_id}/$value')
+        att_resp = http.get(att_url, headers=mailbox.headers, timeout=60)
+        if att_resp.status_code == 200:
             att_path = os.path.join(folder, att_name)
             with open(att_path, 'wb') as f:
-                f.write(base64.b64decode(att['contentBytes']))
+                f.write(att_resp.content)
+            count_bytes(metrics.STAGE_ATTACHMENT_DOWNLOAD, 'in', len(att_resp.content))
         else:
-            logging.warning(f"Unknown attachment type for {att_name}")
-    return att_names
+            logging.error(f"Failed to download attachment {att_name}: {att_resp.status_code}")
+            raise RuntimeError(f"Failed to download attachment {att_name} of message {message_id}: "
+                               f"HTTP {att_resp.status_code}")
+    return att_names, skipped
 
-def eml_to_pdf(eml_path, pdf_path, attachment_names):
-    with open(eml_path, 'rb') as f:
-        msg = email.message_from_binary_file(f, policy=policy.default)
-    headers = [
-        ('From', msg.get('From', '')),
-        ('To', msg.get('To', '')),
-        ('Subject', msg.get('Subject', '')),
-        ('Date', msg.get('Date', '')),
-        ('Cc', msg.get('Cc', '')),
-        ('Bcc', msg.get('Bcc', '')),
-        ('Message-ID', msg.get('Message-ID', '')),
-    ]
+def extract_body(msg):
     body = ''
     if msg.is_multipart():
         for part in msg.walk():
@@ -233,10 +396,28 @@ def eml_to_pdf(eml_path, pdf_path, attachment_names):
                     body = payload.decode(msg.get_content_charset() or 'utf-8', errors='replace')
                 except Exception:
                     body = payload.decode('utf-8', errors='replace')
+    return body
+
+@observe_stage(metrics.STAGE_PDF_RENDER)
+@span(metrics.STAGE_PDF_RENDER)
+def eml_to_pdf(eml_path, pdf_path, attachment_names):
+    with open(eml_path, 'rb') as f:
+        msg = email.message_from_binary_file(f, policy=policy.default)
+    headers = [
+        ('From', msg.get('From', '')),
+        ('To', msg.get('To', '')),
+        ('Subject', msg.get('Subject', '')),
+        ('Date', msg.get('Date', '')),
+        ('Cc', msg.get('Cc', '')),
+        ('Bcc', msg.get('Bcc', '')),
+        ('Message-ID', msg.get('Message-ID', '')),
+    ]
+    body = extract_body(msg)
     pdf = FPDF()
     pdf.add_page()
     font_path = os.path.join('fonts', 'DejaVuSans.ttf')
-    pdf.add_font('DejaVu', '', font_path, uni=True)
+    with font_lock:
+        pdf.add_font('DejaVu', '', font_path, uni=True)
     pdf.set_font('DejaVu', '', 12)
     pdf.cell(0, 10, 'Email Details', ln=True, align='C')
     pdf.ln(5)
@@ -262,54 +443,116 @@ def eml_to_pdf(eml_path, pdf_path, attachment_names):
         pdf.cell(0, 8, 'No attachments.', ln=True)
     pdf.output(pdf_path)
 
-@app.post("/process_emails", response_model=List[ProcessResult], summary="Process all new emails in the processed_emails folder.")
-def process_emails():
-    results = []
-    pre_run_time = datetime.now(timezone.utc)
-    os.makedirs(WORKFLOW_RESPONSES_DIR, exist_ok=True)
-
-    # --- Collect email-attachments groups from processed_emails/ subfolders ---
+def collect_email_groups():
+    # 有 PDF 且尚无工作流结果文件的邮件即为待处理
     email_groups = []
-    if os.path.exists(PROCESSED_DIR):
-        for folder in os.listdir(PROCESSED_DIR):
-            folder_path = os.path.join(PROCESSED_DIR, folder)
-            if not os.path.isdir(folder_path):
-                continue
-            pdf_path = None
-            attachments = []
-            # Find PDF in the main folder
-            for file in os.listdir(folder_path):
-                path = os.path.join(folder_path, file)
-                if not file_is_newer_than(path, pre_run_time):
-                    continue
-                if file.lower().endswith('.pdf'):
-                    pdf_path = path
-            # Find attachments in the attachments subfolder
-            attachments_folder = os.path.join(folder_path, 'attachments')
-            if os.path.exists(attachments_folder) and os.path.isdir(attachments_folder):
-                for att_file in os.listdir(attachments_folder):
-                    att_path = os.path.join(attachments_folder, att_file)
-                    if not file_is_newer_than(att_path, pre_run_time):
-                        continue
-                    attachments.append(att_path)
-            if pdf_path:
-                email_groups.append({
-                    'email': pdf_path,
-                    'attachments': attachments,
-                    'folder_name': folder
-                })
+    if not os.path.exists(PROCESSED_DIR):
+        return email_groups
+    for folder in os.listdir(PROCESSED_DIR):
+        group = load_email_group(folder)
+        if group:
+            email_groups.append(group)
+    return email_groups
 
-    workflow_url = f"{DIFY_BASE_URL}/workflows/run"
-    headers = {
-        'Authorization': f'Bearer {DIFY_API_KEY}',
-        'Content-Type': 'application/json'
+def load_email_group(folder):
+    folder_path = os.path.join(PROCESSED_DIR, folder)
+    if not os.path.isdir(folder_path):
+        return None
+    if os.path.exists(os.path.join(WORKFLOW_RESPONSES_DIR, f"{folder}.txt")):
+        return None
+    pdf_path = None
+    attachments = []
+    # Find PDF in the main folder
+    for file in os.listdir(folder_path):
+        if file.lower().endswith('.pdf'):
+            pdf_path = os.path.join(folder_path, file)
+    # Find attachments in the attachments subfolder
+    attachments_folder = os.path.join(folder_path, 'attachments')
+    if os.path.exists(attachments_folder) and os.path.isdir(attachments_folder):
+        for att_file in os.listdir(attachments_folder):
+            attachments.append(os.path.join(attachments_folder, att_file))
+    if not pdf_path:
+        return None
+    return {
+        'email': pdf_path,
+        'attachments': attachments,
+        'folder_name': folder
     }
 
-    import json
-    for group in email_groups:
-        try:
+def enqueue_email_group(group):
+    if group['folder_name'] in workflow_queue or pipeline.is_active(group['folder_name']):
+        return False
+    route, rule = ROUTE_FULL, None
+    eml_msg = read_eml(group['folder_name'])
+    level = NORMAL
+    if eml_msg is not None:
+        route, rule = triage.classify(eml_msg, record=False)
+        level = workflow_queue.rules.level_for_eml(eml_msg, bulk=route != ROUTE_FULL)
+    if load_source(os.path.dirname(group['email'])).get('backfill'):
+        # 回填的历史邮件排在实时邮件之后（仍会随等待时间老化）
+        level = LOW
+    # 以 PDF 生成时间作为入队时间，等待时长和老化都从邮件就绪时算起
+    enqueued_at = os.path.getmtime(group['email'])
+    group.update({'route': route, 'rule': rule, 'eml': eml_msg, 'priority': level, 'enqueued_at': enqueued_at})
+    return workflow_queue.push(group['folder_name'], group, level, enqueued_at)
+
+def save_triage_response(folder_name, route, rule):
+    # 跳过的邮件也写结果文件，作为完成标记，归档清理据此回收
+    os.makedirs(WORKFLOW_RESPONSES_DIR, exist_ok=True)
+    response_filename = os.path.join(WORKFLOW_RESPONSES_DIR, f"{folder_name}.txt")
+    with open(response_filename, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'triage': {'route': route, 'rule': rule}}, ensure_ascii=False, indent=2))
+
+def process_group(group, deadline=None):
+    trace_id = tracing.load_trace_id(os.path.dirname(group['email']))
+    with start_trace(trace_id, name='process_email', folder_name=group['folder_name']) as trace_id, \
+            profiler.profile_email(trace_id):
+        result = _process_group(group, deadline)
+        result.trace_id = trace_id
+        return result
+
+def _process_group(group, deadline=None):
+    route = group['route']
+    eml_msg = group['eml']
+    try:
+        # 上传前先本地分流，广告/群发邮件不进入完整工作流
+        if route == ROUTE_SKIP:
+            save_triage_response(group['folder_name'], route, group['rule'])
+            return ProcessResult(
+                folder_name=group['folder_name'],
+                workflow_status=0,
+                workflow_response={},
+                triage=route
+            )
+        if route == ROUTE_LIGHTWEIGHT:
+            group['attachments'] = []
+        # 下载时已按策略过滤；这里再按本地文件检查一次，覆盖策略上线前下载的附件
+        group['attachments'], late_skipped = attachment_policy.select_paths(group['attachments'])
+        for item in late_skipped:
+            metrics.ATTACHMENTS_SKIPPED.labels(item['reason']).inc()
+        skipped_attachments = load_skipped(os.path.dirname(group['email'])) + late_skipped
+        # 内容完全相同的邮件（转发、重发、失败重跑）直接复用历史工作流结果
+        cache_key = None
+        if eml_msg is not None:
+            # 附件以文本还是原文件送入工作流会影响结果，提取设置也要计入缓存键
+            extraction_mode = (f"|text:{text_extractor.max_chars}:{int(EXTRACTION_UPLOAD_ORIGINALS)}"
+                               if text_extractor.enabled else '')
+            cache_key = content_key(
+                f"{DIFY_BASE_URL}|{DIFY_API_KEY}|{route}{extraction_mode}",
+                str(eml_msg.get('Subject', '')),
+                extract_body(eml_msg),
+                group['attachments'],
+                normalize_addresses(eml_msg)
+            )
+        cached_response = workflow_cache.get(cache_key) if cache_key else None
+        if cached_response is not None:
+            cache_status = 'hit'
+            workflow_status = 200
+            workflow_response = cached_response
+        else:
+            cache_status = 'miss' if cache_key else None
             # Upload email PDF
-            email_upload_id = upload_file(group['email'])
+            email_upload_id = dify_breaker.call(upload_file, group['email'], deadline)
             emails_payload = []
             if email_upload_id:
                 emails_payload.append({
@@ -318,10 +561,14 @@ def process_emails():
                     'type': get_api_file_type(group['email']),
                     'source_path': group['email']
                 })
+            # 文档类附件在本地提取文本，Dify 不必每次重新解析
+            attachment_texts, upload_paths = [], group['attachments']
+            if text_extractor.enabled:
+                attachment_texts, upload_paths = extract_attachment_texts(group['attachments'])
             # Upload attachments
             attachments_payload = []
-            for att_path in group['attachments']:
-                att_upload_id = upload_file(att_path)
+            for att_path in upload_paths:
+                att_upload_id = dify_breaker.call(upload_file, att_path, deadline)
                 if att_upload_id:
                     attachments_payload.append({
                         'transfer_method': 'local_file',
@@ -333,90 +580,454 @@ def process_emails():
                 'email': emails_payload[0] if emails_payload else None,
                 'attachments': attachments_payload
             }
+            if text_extractor.enabled:
+                inputs[EXTRACTION_INPUT_NAME] = format_attachment_texts(attachment_texts)
             body = {
                 'inputs': inputs,
                 'response_mode': 'blocking',
                 'user': USER_ID
             }
-            resp = requests.post(workflow_url, headers=headers, json=body, timeout=60)
+            resp = dify_breaker.call(run_workflow, body, deadline)
             workflow_status = resp.status_code
             workflow_response = resp.json() if resp.headers.get('content-type', '').startswith('application/json') else {'text': resp.text}
-            # Save response to workflow_responses/folder_name.txt
-            response_filename = os.path.join(WORKFLOW_RESPONSES_DIR, f"{group['folder_name']}.txt")
-            with open(response_filename, 'w', encoding='utf-8') as f:
-                f.write(json.dumps(workflow_response, ensure_ascii=False, indent=2))
-            # --- Extract outputs and send to WeCom App ---
-            data = workflow_response.get('data', {})
-            if isinstance(data, dict):
-                outputs = data.get('outputs', {})
-            else:
-                outputs = {}
-            notification = outputs.get('notification', '')
-            result = outputs.get('result', '')
-            # touser 从 notification.recipient_email 获取
-            touser = None
-            if isinstance(notification, dict):
-                touser = notification.get('recipient_email')
-                notification = touser or str(notification)
-            if isinstance(result, dict):
-                result = json.dumps(result, ensure_ascii=False, indent=2)
-            wecom_status = None
-            wecom_response = None
-            if touser and (notification or result):
-                content = f"{notification}\n\n{result}"
-                logging.info(f"WeCom App message to send to {touser}:\n{content}\n")
-                try:
-                    access_token = get_wecom_access_token(WECOM_CORPID, WECOM_CORPSECRET)
-                    wecom_resp = send_wecom_app_message(access_token, WECOM_AGENTID, touser, content)
-                    wecom_status = wecom_resp.status_code
-                    try:
-                        wecom_response = wecom_resp.json()
-                    except Exception:
-                        wecom_response = {'text': wecom_resp.text}
-                except Exception as e:
-                    logging.exception("WeCom App message send failed")
-                    wecom_response = {'error': str(e)}
-            results.append(ProcessResult(
-                folder_name=group['folder_name'],
-                workflow_status=workflow_status,
-                workflow_response=workflow_response,
-                webhook_status=wecom_status,
-                webhook_response=wecom_response
-            ))
-        except Exception as e:
-            logging.exception(f"Error processing group {group['folder_name']}")
-            results.append(ProcessResult(
-                folder_name=group['folder_name'],
-                workflow_status=0,
-                workflow_response={},
-                error=str(e)
-            ))
-    return results 
+            data = workflow_response.get('data')
+            if cache_key and workflow_status == 200 and isinstance(data, dict) and data.get('status') == 'succeeded':
+                workflow_cache.put(cache_key, workflow_response)
+        # --- Extract outputs and send to WeCom App ---
+        data = workflow_response.get('data', {})
+        if isinstance(data, dict):
+            outputs = data.get('outputs', {})
+        else:
+            outputs = {}
+        notification = outputs.get('notification', '')
+        result = outputs.get('result', '')
+        # touser 从 notification.recipient_email 获取
+        touser = None
+        if isinstance(notification, dict):
+            touser = notification.get('recipient_email')
+            notification = touser or str(notification)
+        if isinstance(result, dict):
+            result = json.dumps(result, ensure_ascii=False, indent=2)
+        wecom_status = None
+        wecom_response = None
+        if touser and (notification or result):
+            content = f"{notification}\n\n{result}"
+            logging.info(f"WeCom App message to send to {touser}:\n{content}\n")
+            try:
+                wecom_resp = notify_wecom(touser, content)
+            except Exception as e:
+                # 不写结果文件，邮件组留在待处理状态；重试时工作流结果命中缓存，只重发通知
+                logging.exception("WeCom App message send failed")
+                return ProcessResult(
+                    folder_name=group['folder_name'],
+                    workflow_status=workflow_status,
+                    workflow_response=workflow_response,
+                    webhook_response={'error': str(e)},
+                    triage=route,
+                    cache=cache_status,
+                    skipped_attachments=skipped_attachments or None,
+                    error=f"wecom: {e}"
+                )
+            wecom_status = wecom_resp.status_code
+            wecom_response = wecom_resp.json()
+        # Save response to workflow_responses/folder_name.txt
+        response_filename = os.path.join(WORKFLOW_RESPONSES_DIR, f"{group['folder_name']}.txt")
+        with open(response_filename, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(workflow_response, ensure_ascii=False, indent=2))
+        return ProcessResult(
+            folder_name=group['folder_name'],
+            workflow_status=workflow_status,
+            workflow_response=workflow_response,
+            webhook_status=wecom_status,
+            webhook_response=wecom_response,
+            triage=route,
+            cache=cache_status,
+            skipped_attachments=skipped_attachments or None
+        )
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        # Dify 不可用或时间用完：由调用方放回队列，下一轮再处理
+        logging.warning(f"Deferring group {group['folder_name']}: {e}")
+        group['deferred'] = True
+        return ProcessResult(
+            folder_name=group['folder_name'],
+            workflow_status=0,
+            workflow_response={},
+            triage=route,
+            error=f"deferred: {e}"
+        )
+    except Exception as e:
+        logging.exception(f"Error processing group {group['folder_name']}")
+        return ProcessResult(
+            folder_name=group['folder_name'],
+            workflow_status=0,
+            workflow_response={},
+            triage=route,
+            error=str(e)
+        )
+
+@app.post("/process_emails", response_model=List[ProcessResult], summary="Process all new emails in the processed_emails folder.")
+def process_emails():
+    if pipeline.enabled:
+        # 流水线模式下邮件由消费线程处理，这里只补扫磁盘上遗漏的邮件组
+        pipeline.recover()
+        return []
+    with pipeline_lock:
+        return _process_emails()
+
+def _process_emails():
+    results = []
+    os.makedirs(WORKFLOW_RESPONSES_DIR, exist_ok=True)
+    for group in collect_email_groups():
+        enqueue_email_group(group)
+    run_deadline = Deadline(PROCESS_RUN_DEADLINE_SECONDS or None)
+    deferred = []
+    while len(workflow_queue):
+        if dify_breaker.is_open() or run_deadline.expired() or scheduler.stopping:
+            logging.warning(f"Stopping run with {len(workflow_queue)} groups still queued "
+                            f"(dify circuit {dify_breaker.snapshot()['state']}, deadline expired: {run_deadline.expired()}, "
+                            f"shutting down: {scheduler.stopping})")
+            break
+        group = workflow_queue.pop()
+        if group is None:
+            break
+        group_deadline = run_deadline.share(len(workflow_queue) + 1, PROCESS_MIN_GROUP_SECONDS)
+        result = run_group(group, group_deadline)
+        if result is None:
+            continue
+        results.append(result)
+        if group.pop('deferred', False):
+            deferred.append(group)
+    for group in deferred:
+        workflow_queue.push(group['folder_name'], group, group['priority'], group['enqueued_at'])
+    return results
+
+def run_group(group, deadline=None):
+    # 另一个副本正在处理或已经处理完时返回 None；推迟的邮件组保留 group['deferred'] 由调用方放回队列
+    lease_key = f"group:{group['folder_name']}"
+    if not leases.claim(lease_key):
+        return None
+    try:
+        result = process_group(group, deadline)
+    except BaseException:
+        leases.release(lease_key)
+        raise
+    if group.get('deferred'):
+        leases.release(lease_key)
+        metrics.EMAILS.labels('deferred').inc()
+    elif result.error:
+        leases.release(lease_key)
+        metrics.EMAILS.labels('failed').inc()
+    elif result.triage == ROUTE_SKIP:
+        leases.complete(lease_key)
+        record_mailbox_completion(group)
+        metrics.EMAILS.labels('skipped').inc()
+    else:
+        leases.complete(lease_key)
+        record_mailbox_completion(group)
+        metrics.EMAILS.labels('cache_hit' if result.cache == 'hit' else 'completed').inc()
+    return result
+
+def fetch_claimed(email_obj, mailbox):
+    # 认领失败（其他副本正在或已经下载）时返回 None
+    lease_key = f"message:{email_obj['id']}"
+    if not leases.claim(lease_key):
+        return None
+    try:
+        folder_name, route, rule = fetch_email(email_obj, mailbox)
+    except BaseException:
+        leases.release(lease_key)
+        raise
+    leases.complete(lease_key)
+    metrics.MAILBOX_EMAILS.labels(mailbox.id, 'fetched').inc()
+    metrics.EMAILS.labels('triage_skipped' if route == ROUTE_SKIP else 'fetched').inc()
+    if pipeline.enabled and route != ROUTE_SKIP:
+        # 直接交给工作流消费线程，队列满时在这里等待（背压）
+        group = load_email_group(folder_name)
+        if group:
+            pipeline.submit(group)
+    return folder_name, route, rule
+
+def processed_message_ids():
+    # Graph id 与 Message-ID 头都计入：早期下载的邮件没有 source.json，已归档的邮件只剩归档索引
+    ids = archive_store.known_message_ids()
+    if os.path.exists(EMAIL_PROCESSED_DIR):
+        for folder in os.listdir(EMAIL_PROCESSED_DIR):
+            message_id = load_source(os.path.join(EMAIL_PROCESSED_DIR, folder)).get('message_id')
+            if message_id:
+                ids.add(message_id)
+    if os.path.exists(EMAIL_DOWNLOAD_DIR):
+        for file in os.listdir(EMAIL_DOWNLOAD_DIR):
+            if not file.endswith('.eml') or file.endswith('.part.eml'):
+                continue
+            try:
+                with open(os.path.join(EMAIL_DOWNLOAD_DIR, file), 'rb') as f:
+                    message_id = eml_message_id(f)
+            except OSError:
+                continue
+            if message_id:
+                ids.add(message_id)
+    return ids
+
+def record_mailbox_completion(group):
+    source = load_source(os.path.dirname(group['email']))
+    mailbox_id = source.get('mailbox') or mailboxes.default.id
+    metrics.MAILBOX_EMAILS.labels(mailbox_id, 'completed').inc()
+    if source.get('received'):
+        lag = datetime.now(timezone.utc) - parse_graph_datetime(source['received'])
+        metrics.MAILBOX_END_TO_END.labels(mailbox_id).observe(max(0.0, lag.total_seconds()))
+
+def fetch_email(email_obj, mailbox=None):
+    mailbox = mailbox or mailboxes.default
+    with start_trace(name='fetch_email', message_id=email_obj['id'], mailbox=mailbox.id) as trace_id, \
+            profiler.profile_email(trace_id, final=False):
+        fetched = _fetch_email(email_obj, mailbox, trace_id)
+        if fetched[1] == ROUTE_SKIP:
+            # 跳过的邮件没有处理阶段，剖析到此为止
+            profiler.end_email(trace_id)
+        return fetched
+
+def _fetch_email(email_obj, mailbox, trace_id):
+    message_id = email_obj['id']
+    # 临时文件按邮件 id 命名，多个副本共用下载目录时不会互相覆盖
+    temp_eml_name = f"{sanitize_filename(message_id)}.part.eml"
+    temp_eml_path = download_eml(message_id, temp_eml_name, EMAIL_DOWNLOAD_DIR, mailbox)
+    with open(temp_eml_path, 'rb') as f:
+        msg = email.message_from_binary_file(f, policy=policy.default)
+    folder_name = get_email_folder_name(msg)
+    eml_named_path = os.path.join(EMAIL_DOWNLOAD_DIR, f"{folder_name}.eml")
+    os.replace(temp_eml_path, eml_named_path)
+    route, rule = triage.classify(msg)
+    tracing.set_attribute('triage', route)
+    if route == ROUTE_SKIP:
+        # 不渲染 PDF、不下载附件，.eml 保留备查，到期后随结果文件一起归档
+        save_triage_response(folder_name, route, rule)
+        return folder_name, route, rule
+    target_folder = os.path.join(EMAIL_PROCESSED_DIR, folder_name)
+    os.makedirs(target_folder, exist_ok=True)
+    attachments_folder = os.path.join(target_folder, 'attachments')
+    os.makedirs(attachments_folder, exist_ok=True)
+    # 记录 trace id，处理阶段沿用同一个 trace
+    tracing.save_trace_id(target_folder, trace_id)
+    save_source(target_folder, mailbox.id, message_id, email_obj.get('receivedDateTime'),
+                backfill=bool(email_obj.get('backfill')))
+    tracing.set_attribute('folder_name', folder_name)
+    attachment_names = []
+    if route == ROUTE_FULL:
+        attachment_names, skipped_attachments = download_attachments(message_id, attachments_folder, mailbox)
+        save_skipped(target_folder, skipped_attachments)
+    pdf_path = os.path.join(target_folder, f"{folder_name}.pdf")
+    eml_to_pdf(eml_named_path, pdf_path, attachment_names)
+    return folder_name, route, rule
 
 @app.post("/get_emails", summary="拉取新邮件并处理为PDF和附件")
 def get_emails():
-    last_run = get_last_run_time()
-    emails = list_emails(last_run)
-    if not emails:
-        return {"message": "No new emails since last run or error fetching emails.", "folders": []}
-    now = log_run_time()
-    emails_to_process = emails[:EMAIL_DEFAULT_EMAIL_COUNT]
+    with pipeline_lock:
+        return _get_emails()
+
+def _get_emails():
+    candidates = {}
+    notified = []
+    handled = set()
+    if graph_notifications.enabled:
+        # 推送模式：默认邮箱只下载通知/delta 中出现的邮件，不再全量列举；其他邮箱照常按游标列举
+        if graph_notifications.needs_delta_poll():
+            graph_notifications.delta_poll()
+        notified = graph_notifications.take_pending(EMAIL_DEFAULT_EMAIL_COUNT)
+    for mailbox in mailboxes.mailboxes.values():
+        if graph_notifications.enabled and mailbox is mailboxes.default:
+            continue
+        emails = list_emails(mailbox)
+        if emails is None:
+            continue
+        candidates[mailbox.id] = emails
+        if leases.enabled:
+            # 其他副本已下载过的邮件不占本轮名额，但照样记入游标
+            handled.update(m['id'] for m in emails if leases.is_done(f"message:{m['id']}"))
+    selectable = {mailbox_id: [m for m in emails if m['id'] not in handled]
+                  for mailbox_id, emails in candidates.items()}
+    if notified:
+        selectable[mailboxes.default.id] = [{'id': message_id} for message_id in notified]
+    # 邮箱之间轮转挑选，邮箱内部按优先级（含按收件时间老化）排序
+    chosen = mailboxes.select(selectable, EMAIL_DEFAULT_EMAIL_COUNT, lambda m: workflow_queue.rules.sort_key(
+        workflow_queue.rules.level_for_graph_message(m), received_timestamp(m)))
+    emails_to_process = [(mailboxes.get(mailbox_id), m) for mailbox_id, m in chosen]
+    if notified:
+        # 本轮名额让给其他邮箱的通知放回队首，下一轮优先下载
+        chosen_ids = {m['id'] for _, m in chosen}
+        for message_id in reversed(notified):
+            if message_id not in chosen_ids:
+                graph_notifications.requeue(message_id, front=True)
+        notified = [message_id for message_id in notified if message_id in chosen_ids]
     processed_folders = []
-    for idx, email_obj in enumerate(emails_to_process):
-        message_id = email_obj['id']
-        temp_eml_path = os.path.join(EMAIL_DOWNLOAD_DIR, f"email_{idx+1}.eml")
-        download_eml(message_id, f"email_{idx+1}.eml", EMAIL_DOWNLOAD_DIR)
-        with open(temp_eml_path, 'rb') as f:
-            msg = email.message_from_binary_file(f, policy=policy.default)
-        folder_name = get_email_folder_name(msg)
-        target_folder = os.path.join(EMAIL_PROCESSED_DIR, folder_name)
-        os.makedirs(target_folder, exist_ok=True)
-        attachments_folder = os.path.join(target_folder, 'attachments')
-        os.makedirs(attachments_folder, exist_ok=True)
-        eml_named_path = os.path.join(EMAIL_DOWNLOAD_DIR, f"{folder_name}.eml")
-        os.replace(temp_eml_path, eml_named_path)
-        attachment_names = download_attachments(message_id, attachments_folder)
-        pdf_path = os.path.join(target_folder, f"{folder_name}.pdf")
-        eml_to_pdf(eml_named_path, pdf_path, attachment_names)
-        processed_folders.append(folder_name)
-    return {"message": f"Processed {len(processed_folders)} new emails.", "folders": processed_folders} 
\ No newline at end of file
+    skipped_folders = []
+    failed_emails = []
+    try:
+        for mailbox, email_obj in emails_to_process:
+            try:
+                fetched = fetch_claimed(email_obj, mailbox)
+            except Exception as e:
+                # 单封邮件失败不影响本轮其他邮件；多次失败后隔离，游标不再卡在这封邮件上
+                logging.exception(f"Failed to fetch message {email_obj['id']} from {mailbox.id}")
+                metrics.MAILBOX_EMAILS.labels(mailbox.id, 'failed').inc()
+                quarantined = mailboxes.record_failure(mailbox.id, email_obj['id'], e)
+                if quarantined:
+                    metrics.MAILBOX_EMAILS.labels(mailbox.id, 'quarantined').inc()
+                    handled.add(email_obj['id'])
+                failed_emails.append({'id': email_obj['id'], 'mailbox': mailbox.id, 'error': str(e),
+                                      'quarantined': quarantined})
+                continue
+            if fetched is None:
+                # 另一个副本正在下载时不记入游标，下一轮确认它已完成
+                if leases.is_done(f"message:{email_obj['id']}"):
+                    handled.add(email_obj['id'])
+                continue
+            handled.add(email_obj['id'])
+            mailboxes.clear_failure(mailbox.id, email_obj['id'])
+            folder_name, route, rule = fetched
+            if route == ROUTE_SKIP:
+                skipped_folders.append({'folder': folder_name, 'rule': rule})
+            else:
+                processed_folders.append(folder_name)
+    finally:
+        # 只把真正处理过的邮件记入游标，中途失败的邮件下一轮还会列出来
+        for mailbox_id, emails in candidates.items():
+            lag = mailboxes.advance(mailbox_id, emails, handled)
+            metrics.MAILBOX_LAG.labels(mailbox_id).set(lag)
+        # 没处理成的通知放回待下载队列，下一轮重试
+        for message_id in notified:
+            if message_id in handled:
+                graph_notifications.ack(message_id)
+            else:
+                graph_notifications.requeue(message_id)
+    if not emails_to_process:
+        return {"message": "No new emails since last run or error fetching emails.", "folders": []}
+    return {
+        "message": f"Processed {len(processed_folders)} new emails.",
+        "folders": processed_folders,
+        "skipped": skipped_folders,
+        "failed": failed_emails,
+        "triage": triage.stats()
+    }
+
+@app.post("/graph/notifications", summary="Graph 邮件变更通知回调（含订阅验证）")
+async def receive_graph_notifications(request: Request):
+    validation_token = request.query_params.get('validationToken')
+    if validation_token is not None:
+        return PlainTextResponse(validation_token)
+    payload = await request.json()
+    enqueued = graph_notifications.handle_notifications(payload)
+    if enqueued and scheduler.running:
+        scheduler.wake()
+    return Response(status_code=202, headers={'X-Enqueued': str(enqueued)})
+
+@app.get("/graph/subscription", summary="Graph 订阅与待下载邮件状态")
+def graph_subscription_status():
+    return graph_notifications.status()
+
+@app.post("/retention/compact", summary="将过期的已完成邮件打包归档并回收磁盘空间")
+def compact_archive(older_than_days: int = RETENTION_DAYS):
+    return archive_store.compact(EMAIL_DOWNLOAD_DIR, PROCESSED_DIR, WORKFLOW_RESPONSES_DIR, older_than_days)
+
+@app.get("/archive/{folder_name}", summary="查询已归档邮件的文件列表")
+def get_archived_email(folder_name: str):
+    entry = archive_store.list_members(folder_name)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Email not found in archive")
+    return entry
+
+@app.get("/archive/{folder_name}/{member:path}", summary="读取已归档邮件的单个文件")
+def get_archived_file(folder_name: str, member: str):
+    found = archive_store.read_member(folder_name, member)
+    if found is None:
+        raise HTTPException(status_code=404, detail="File not found in archive")
+    data, mime_type = found
+    return Response(content=data, media_type=mime_type)
+
+@app.get("/triage/stats", summary="本地分流规则命中统计")
+def triage_stats():
+    return triage.stats()
+
+@app.get("/attachments/stats", summary="附件过滤策略的跳过统计")
+def attachment_stats():
+    return attachment_policy.stats()
+
+@app.get("/extraction/stats", summary="附件本地文本提取统计")
+def extraction_stats():
+    return text_extractor.stats()
+
+@app.get("/workflow_cache/stats", summary="工作流结果缓存命中统计")
+def workflow_cache_stats():
+    return workflow_cache.stats()
+
+@app.get("/pipeline/status", summary="流水线模式的消费线程、背压与计数")
+def pipeline_status():
+    return pipeline.status()
+
+@app.get("/queue/stats", summary="工作流队列各优先级深度与等待时长")
+def queue_stats():
+    return workflow_queue.stats()
+
+@app.get("/throttle/stats", summary="各外部服务的自适应并发与重试统计")
+def throttle_stats():
+    return http.stats()
+
+@app.post("/backfill", summary="按收件时间范围回填历史邮件")
+def start_backfill(start: Optional[str] = None, end: Optional[str] = None, mailbox: Optional[str] = None,
+                   partition_hours: float = BACKFILL_PARTITION_HOURS):
+    if start is None and end is None:
+        # 不带参数时继续上次未完成的回填
+        if not backfill.resume():
+            raise HTTPException(status_code=409, detail="No unfinished backfill to resume or one is already running")
+        return backfill.status()
+    if start is None or end is None:
+        raise HTTPException(status_code=400, detail="Both start and end are required")
+    try:
+        backfill.start(mailbox, parse_range_bound(start), parse_range_bound(end), partition_hours)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return backfill.status()
+
+@app.get("/backfill", summary="回填进度")
+def backfill_status():
+    return backfill.status()
+
+@app.delete("/backfill", summary="暂停回填，之后可用 POST /backfill 继续")
+def pause_backfill():
+    backfill.stop()
+    return backfill.status()
+
+@app.get("/mailboxes", summary="各邮箱的游标与积压")
+def mailbox_status():
+    return mailboxes.stats()
+
+@app.get("/leases/stats", summary="多副本租约状态")
+def lease_stats():
+    return leases.stats()
+
+@app.get("/daemon/status", summary="守护模式调度器状态")
+def daemon_status():
+    return scheduler.status()
+
+@app.get("/metrics", summary="Prometheus 指标", include_in_schema=False)
+def prometheus_metrics():
+    for name, level in workflow_queue.stats()['levels'].items():
+        metrics.QUEUE_DEPTH.labels('workflow', name).set(level['depth'])
+    metrics.QUEUE_DEPTH.labels('graph_pending', '').set(graph_notifications.pending_count())
+    data, content_type = metrics.render_latest()
+    return Response(content=data, media_type=content_type)
+
+@app.post("/debug/profile", summary="对接下来的 N 封邮件进行性能剖析")
+def start_profile(emails: int = 5, mode: str = 'cprofile', top: int = 30):
+    try:
+        profiler.arm(emails, mode, top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return profiler.report()
+
+@app.get("/debug/profile", summary="查看性能剖析结果（最耗时的函数）")
+def get_profile():
+    return profiler.report()
@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# 统一的阶段标签，get_emails 与 process_emails 共用
+STAGE_GRAPH_LIST = 'graph_list'
+STAGE_EML_DOWNLOAD = 'eml_download'
+STAGE_ATTACHMENT_DOWNLOAD = 'attachment_download'
+STAGE_PDF_RENDER = 'pdf_render'
+STAGE_ATTACHMENT_EXTRACT = 'attachment_extract'
+STAGE_DIFY_UPLOAD = 'dify_upload'
+STAGE_WORKFLOW_RUN = 'workflow_run'
+STAGE_WECOM_TOKEN = 'wecom_token'
+STAGE_WECOM_SEND = 'wecom_send'
+
+STAGE_SECONDS = Histogram(
+    'xarl_stage_duration_seconds',
+    'Time spent in each pipeline stage.',
+    ['stage', 'outcome'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+BYTES_TRANSFERRED = Counter(
+    'xarl_bytes_transferred_total',
+    'Bytes downloaded from or uploaded to external services.',
+    ['stage', 'direction'],
+)
+EMAILS = Counter(
+    'xarl_emails_total',
+    'Emails by pipeline outcome.',
+    ['outcome'],
+)
+HTTP_RETRIES = Counter(
+    'xarl_http_retries_total',
+    'Retried HTTP requests per host.',
+    ['host'],
+)
+HTTP_THROTTLED = Counter(
+    'xarl_http_throttled_total',
+    'HTTP 429/503 responses per host.',
+    ['host'],
+)
+QUEUE_DEPTH = Gauge(
+    'xarl_queue_depth',
+    'Items waiting in internal queues.',
+    ['queue', 'priority'],
+)
+ATTACHMENTS_SKIPPED = Counter(
+    'xarl_attachments_skipped_total',
+    'Attachments not downloaded or uploaded, by policy reason.',
+    ['reason'],
+)
+ATTACHMENT_EXTRACTIONS = Counter(
+    'xarl_attachment_extractions_total',
+    'Local attachment text extraction by outcome (hit / extracted / unsupported / failed).',
+    ['outcome'],
+)
+PIPELINE_BLOCKED_SECONDS = Counter(
+    'xarl_pipeline_backpressure_seconds_total',
+    'Time the fetch stage spent blocked on a full hand-off queue.',
+)
+MAILBOX_EMAILS = Counter(
+    'xarl_mailbox_emails_total',
+    'Emails fetched and completed per mailbox.',
+    ['mailbox', 'stage'],
+)
+MAILBOX_LAG = Gauge(
+    'xarl_mailbox_lag_seconds',
+    'Age of the oldest listed message that has not been fetched yet.',
+    ['mailbox'],
+)
+MAILBOX_END_TO_END = Histogram(
+    'xarl_mailbox_end_to_end_seconds',
+    'Time from receivedDateTime until the workflow result is written.',
+    ['mailbox'],
+    buckets=(10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400),
+)
+POLL_INTERVAL = Gauge(
+    'xarl_poll_interval_seconds',
+    'Current adaptive poll interval of the daemon scheduler.',
+)
+IN_FLIGHT = Gauge(
+    'xarl_in_flight',
+    'Work currently in progress per stage.',
+    ['stage'],
+)
+
+
+@contextmanager
+def observe_stage(stage):
+    IN_FLIGHT.labels(stage).inc()
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        STAGE_SECONDS.labels(stage, outcome).observe(time.perf_counter() - start)
+        IN_FLIGHT.labels(stage).dec()
+
+
+def count_bytes(stage, direction, size):
+    if size:
+        BYTES_TRANSFERRED.labels(stage, direction).inc(size)
+
+
+def render_latest():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,180 @@
+import os
+import time
+import logging
+import threading
+
+from .metrics import PIPELINE_BLOCKED_SECONDS
+from .scheduler import DAEMON_DRAIN_SECONDS
+
+PIPELINE_MODE = os.environ.get('PIPELINE_MODE', '').lower() in ('1', 'true', 'yes', 'on')
+PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', '2'))
+# 队列中等待的邮件组达到该数时，下载阶段阻塞等待
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '20'))
+# Dify 不可用时，被推迟的邮件组等这么久再放回队列；处理出错的邮件组从这个间隔开始指数退避
+PIPELINE_RETRY_SECONDS = float(os.environ.get('PIPELINE_RETRY_SECONDS', '30'))
+PIPELINE_MAX_RETRY_SECONDS = float(os.environ.get('PIPELINE_MAX_RETRY_SECONDS', '600'))
+
+
+class Pipeline:
+    """Hands fetched emails straight to workflow consumer threads.
+
+    The fetch stage submits each group as soon as its PDF is rendered;
+    ``workers`` threads pop groups from the shared priority queue and run
+    them. ``submit`` blocks while ``capacity`` groups are waiting, so Graph
+    downloads slow down to the pace Dify can absorb. The folders on disk are
+    only rescanned by ``recover()``, once at startup and on request.
+
+    Deferred and failed groups wait in ``_delayed`` until their retry time
+    and then go back to the queue. A group is always in exactly one of the
+    queue, ``_active`` or ``_delayed``, so it can never be enqueued twice.
+    """
+
+    def __init__(self, queue, enqueue, handle, scan, workers=PIPELINE_WORKERS, capacity=PIPELINE_QUEUE_SIZE,
+                 retry_delay=PIPELINE_RETRY_SECONDS, max_retry_delay=PIPELINE_MAX_RETRY_SECONDS,
+                 drain_seconds=DAEMON_DRAIN_SECONDS, enabled=PIPELINE_MODE):
+        self.queue = queue
+        self.enqueue = enqueue
+        self.handle = handle
+        self.scan = scan
+        self.workers = workers
+        self.capacity = capacity
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.drain_seconds = drain_seconds
+        self.enabled = enabled
+        self.counters = {'submitted': 0, 'recovered': 0, 'processed': 0, 'deferred': 0, 'errors': 0,
+                         'claimed_elsewhere': 0, 'blocked': 0, 'blocked_seconds': 0.0}
+        # Condition 默认带 RLock，enqueue 回调里调用 is_active 不会自锁
+        self._cond = threading.Condition()
+        self._active = set()
+        # folder_name -> (ready_at, group)
+        self._delayed = {}
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def is_active(self, key):
+        with self._cond:
+            return key in self._active or key in self._delayed
+
+    def submit(self, group, block=True, counter='submitted'):
+        with self._cond:
+            if block and len(self.queue) >= self.capacity:
+                self.counters['blocked'] += 1
+                started = time.monotonic()
+                while len(self.queue) >= self.capacity and not self._stop.is_set():
+                    self._cond.wait(1)
+                blocked = time.monotonic() - started
+                self.counters['blocked_seconds'] += blocked
+                PIPELINE_BLOCKED_SECONDS.inc(blocked)
+            pushed = self.enqueue(group)
+            if pushed:
+                self.counters[counter] += 1
+                self._cond.notify_all()
+            return pushed
+
+    def recover(self):
+        # 只把磁盘上还没有结果、也不在队列或处理中的邮件组补进队列
+        recovered = 0
+        for group in self.scan():
+            if self.submit(group, block=False, counter='recovered'):
+                recovered += 1
+        if recovered:
+            logging.info(f"Recovered {recovered} unprocessed groups from disk")
+        return recovered
+
+    def start(self):
+        if not self.enabled or self.running:
+            return
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._work, name=f'pipeline-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        threading.Thread(target=self._recover_quietly, name='pipeline-recover', daemon=True).start()
+        logging.info(f"Pipeline started with {self.workers} workers")
+
+    def _recover_quietly(self):
+        try:
+            self.recover()
+        except Exception:
+            logging.exception("Pipeline recovery scan failed")
+
+    def stop(self):
+        # 只等正在处理的邮件组完成；队列里剩下的仍在磁盘上，下次启动时恢复
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+        deadline = time.monotonic() + self.drain_seconds
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        if self.running:
+            logging.warning(f"Pipeline workers still busy after {self.drain_seconds}s, giving up on drain")
+        self._threads = []
+
+    def _release_due(self):
+        # 调用方持有 self._cond；返回距离下一个待重试邮件组到期的秒数
+        now = time.monotonic()
+        for key in [key for key, (ready_at, _) in self._delayed.items() if ready_at <= now]:
+            _, group = self._delayed.pop(key)
+            self.queue.push(key, group, group['priority'], group['enqueued_at'])
+        return min((ready_at - now for ready_at, _ in self._delayed.values()), default=None)
+
+    def _retry_later(self, group, deferred):
+        # 调用方持有 self._cond；推迟的邮件组固定间隔重试，出错的按连续失败次数指数退避
+        if deferred:
+            delay = self.retry_delay
+        else:
+            group['attempts'] = group.get('attempts', 0) + 1
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** (group['attempts'] - 1))
+        self._delayed[group['folder_name']] = (time.monotonic() + delay, group)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._stop.is_set():
+                    next_due = self._release_due()
+                    if len(self.queue):
+                        break
+                    self._cond.wait(1 if next_due is None else min(1, next_due))
+                if self._stop.is_set():
+                    return
+                group = self.queue.pop()
+                if group is None:
+                    continue
+                self._active.add(group['folder_name'])
+                # 腾出了位置，唤醒被背压阻塞的下载阶段
+                self._cond.notify_all()
+            try:
+                result = self.handle(group)
+                outcome = 'claimed_elsewhere' if result is None else ('errors' if result.error else 'processed')
+            except Exception:
+                logging.exception(f"Pipeline failed on group {group['folder_name']}")
+                outcome = 'errors'
+            deferred = group.pop('deferred', False)
+            with self._cond:
+                # 先登记重试再移出 _active，中间不会被 recover 重复入队
+                if deferred or outcome == 'errors':
+                    self._retry_later(group, deferred)
+                self._active.discard(group['folder_name'])
+                self.counters['deferred' if deferred else outcome] += 1
+
+    def status(self):
+        with self._cond:
+            counters = dict(self.counters)
+            active = len(self._active)
+            delayed = len(self._delayed)
+        counters['blocked_seconds'] = round(counters['blocked_seconds'], 3)
+        return {
+            'enabled': self.enabled,
+            'running': self.running,
+            'workers': self.workers,
+            'capacity': self.capacity,
+            'queued': len(self.queue),
+            'active': active,
+            'delayed': delayed,
+            'counters': counters,
+        }
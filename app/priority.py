@@ -0,0 +1,142 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+from email.utils import parseaddr, getaddresses
+
+PRIORITY_LEVELS = ['urgent', 'high', 'normal', 'low']
+URGENT, HIGH, NORMAL, LOW = range(len(PRIORITY_LEVELS))
+
+
+def _parse_rules(value):
+    # "bigcustomer.com:urgent,boss@corp.com:high" -> {"bigcustomer.com": 0, "boss@corp.com": 1}
+    rules = {}
+    for item in (value or '').split(','):
+        if ':' not in item:
+            continue
+        key, level = item.rsplit(':', 1)
+        level = level.strip().lower()
+        if key.strip() and level in PRIORITY_LEVELS:
+            rules[key.strip().lower().lstrip('@')] = PRIORITY_LEVELS.index(level)
+    return rules
+
+
+PRIORITY_SENDER_RULES = _parse_rules(os.environ.get('PRIORITY_SENDER_RULES', ''))
+PRIORITY_RECIPIENT_RULES = _parse_rules(os.environ.get('PRIORITY_RECIPIENT_RULES', ''))
+PRIORITY_AGING_SECONDS = float(os.environ.get('PRIORITY_AGING_SECONDS', '300'))
+
+
+def _lookup(address, rules):
+    address = address.lower()
+    if address in rules:
+        return rules[address]
+    domain = address.rsplit('@', 1)[-1] if '@' in address else ''
+    while domain:
+        if domain in rules:
+            return rules[domain]
+        domain = domain.partition('.')[2]
+    return None
+
+
+class PriorityRules:
+    """Maps sender, recipients and the importance flag to a priority level."""
+
+    def __init__(self, sender_rules=None, recipient_rules=None, aging_seconds=PRIORITY_AGING_SECONDS):
+        self.sender_rules = PRIORITY_SENDER_RULES if sender_rules is None else sender_rules
+        self.recipient_rules = PRIORITY_RECIPIENT_RULES if recipient_rules is None else recipient_rules
+        self.aging_seconds = aging_seconds
+
+    def level(self, sender, recipients=(), importance=None, bulk=False):
+        candidates = [NORMAL]
+        sender_level = _lookup(sender, self.sender_rules) if sender else None
+        if sender_level is not None:
+            candidates.append(sender_level)
+        for recipient in recipients:
+            recipient_level = _lookup(recipient, self.recipient_rules)
+            if recipient_level is not None:
+                candidates.append(recipient_level)
+        level = min(candidates)
+        importance = (importance or '').strip().lower()
+        if importance in ('high', '1', '2', 'urgent'):
+            level = max(URGENT, level - 1)
+        elif (importance in ('low', '4', '5', 'non-urgent') or bulk) and len(candidates) == 1:
+            level = LOW
+        return level
+
+    def level_for_graph_message(self, msg):
+        sender = msg.get('from', {}).get('emailAddress', {}).get('address', '')
+        recipients = [r.get('emailAddress', {}).get('address', '') for r in msg.get('toRecipients', [])]
+        return self.level(sender, recipients, msg.get('importance'))
+
+    def level_for_eml(self, msg, bulk=False):
+        sender = parseaddr(str(msg.get('From', '')))[1]
+        recipients = [addr for _, addr in getaddresses([str(msg.get('To', '')), str(msg.get('Cc', ''))]) if addr]
+        importance = msg.get('Importance') or msg.get('X-Priority', '').split(' ')[0]
+        return self.level(sender, recipients, str(importance), bulk=bulk)
+
+    def sort_key(self, level, enqueued_at):
+        # 每等待 aging_seconds 提升一级。所有元素以相同速率老化，
+        # 所以 level - (now - t) / aging 的排序等价于 level + t / aging，可作为静态堆键。
+        # aging_seconds <= 0 时不老化：严格按优先级，同级先到先出
+        if self.aging_seconds <= 0:
+            return (level, enqueued_at)
+        return level + enqueued_at / self.aging_seconds
+
+
+class PriorityWorkQueue:
+    """Thread-safe priority queue with aging and per-level wait statistics."""
+
+    def __init__(self, rules=None):
+        self.rules = rules or PriorityRules()
+        self._heap = []
+        self._keys = set()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._depth = [0] * len(PRIORITY_LEVELS)
+        self._waited = [0] * len(PRIORITY_LEVELS)
+        self._wait_total = [0.0] * len(PRIORITY_LEVELS)
+        self._wait_max = [0.0] * len(PRIORITY_LEVELS)
+
+    def push(self, key, item, level, enqueued_at=None):
+        enqueued_at = time.time() if enqueued_at is None else enqueued_at
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            self._depth[level] += 1
+            heapq.heappush(self._heap, (self.rules.sort_key(level, enqueued_at), next(self._seq), key, level, enqueued_at, item))
+            return True
+
+    def pop(self):
+        with self._lock:
+            if not self._heap:
+                return None
+            _, _, key, level, enqueued_at, item = heapq.heappop(self._heap)
+            self._keys.discard(key)
+            self._depth[level] -= 1
+            wait = max(0.0, time.time() - enqueued_at)
+            self._waited[level] += 1
+            self._wait_total[level] += wait
+            self._wait_max[level] = max(self._wait_max[level], wait)
+            return item
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def stats(self):
+        with self._lock:
+            levels = {}
+            for level, name in enumerate(PRIORITY_LEVELS):
+                levels[name] = {
+                    'depth': self._depth[level],
+                    'dequeued': self._waited[level],
+                    'avg_wait_seconds': self._wait_total[level] / self._waited[level] if self._waited[level] else 0.0,
+                    'max_wait_seconds': self._wait_max[level],
+                }
+            return {'depth': len(self._heap), 'levels': levels}
@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', '0.005'))
+
+MODE_CPROFILE = 'cprofile'
+MODE_SAMPLING = 'sampling'
+
+
+def _frame_key(code):
+    return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+
+class _Sampler:
+    """Periodically snapshots the stacks of registered threads."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.threads = set()
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, thread_id):
+        with self._lock:
+            self.threads.add(thread_id)
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+
+    def remove(self, thread_id):
+        with self._lock:
+            self.threads.discard(thread_id)
+            if not self.threads and self._thread is not None:
+                self._stop.set()
+                self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = set(self.threads)
+            frames = sys._current_frames()
+            for thread_id in threads:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                self.samples += 1
+                self.self_counts[_frame_key(frame.f_code)] += 1
+                seen = set()
+                while frame is not None:
+                    key = _frame_key(frame.f_code)
+                    if key not in seen:
+                        seen.add(key)
+                        self.total_counts[key] += 1
+                    frame = frame.f_back
+
+
+class Profiler:
+    """Profiles the next N emails on demand with cProfile or stack sampling.
+
+    Callers pass a per-email key (the trace id), so the fetch and workflow
+    stages of one email count as a single email of the N. An email counts as
+    profiled once its last stage exits (``final=True``, an exception, or
+    ``end_email`` for emails that stop early), and the session stays open
+    until every email it armed has done so.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.mode = None
+        self.remaining = 0
+        self.profiled = 0
+        self.top = 30
+        self.started_at = None
+        self.finished_at = None
+        self._profile = None
+        self._sampler = None
+        self._active = 0
+        # 已计入本次剖析、尚未走完最后阶段的邮件；值为 True 表示本阶段结束后即完成
+        self._open = {}
+
+    def arm(self, emails, mode=MODE_CPROFILE, top=30):
+        if mode not in (MODE_CPROFILE, MODE_SAMPLING):
+            raise ValueError(f"Unknown profile mode: {mode}")
+        with self._lock:
+            if self._active:
+                raise RuntimeError("A profiling session is still running")
+            self.mode = mode
+            self.remaining = emails
+            self.profiled = 0
+            self.top = top
+            self.started_at = time.time()
+            self.finished_at = None
+            self._open = {}
+            self._profile = cProfile.Profile() if mode == MODE_CPROFILE else None
+            self._sampler = _Sampler(PROFILE_SAMPLE_INTERVAL) if mode == MODE_SAMPLING else None
+
+    @contextmanager
+    def profile_email(self, key=None, final=True):
+        with self._lock:
+            # 已计入本次剖析的邮件，其后续阶段继续剖析但不再占名额
+            repeat = key is not None and key in self._open
+            armed = repeat or self.remaining > 0
+            if armed:
+                if not repeat:
+                    self.remaining -= 1
+                if key is not None:
+                    self._open[key] = self._open.get(key, False) or final
+                self._active += 1
+        if not armed:
+            yield
+            return
+        thread_id = threading.get_ident()
+        if self._profile is not None:
+            # cProfile 同一时间只能在一个线程里启用，并发时其余邮件不计入
+            try:
+                self._profile.enable()
+                enabled = True
+            except ValueError:
+                enabled = False
+        else:
+            self._sampler.add(thread_id)
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            if self._profile is not None:
+                if enabled:
+                    self._profile.disable()
+            else:
+                self._sampler.remove(thread_id)
+            with self._lock:
+                self._active -= 1
+                # 出错的邮件不会再进入后续阶段，直接记为完成
+                if key is None or failed or self._open.get(key):
+                    self._open.pop(key, None)
+                    self.profiled += 1
+                self._finish_if_done()
+
+    def end_email(self, key):
+        """Marks an email with no further stages, e.g. one triaged to skip at fetch time."""
+        with self._lock:
+            if key in self._open:
+                self._open[key] = True
+
+    def _finish_if_done(self):
+        if self.remaining == 0 and self._active == 0 and not self._open and self.finished_at is None:
+            self.finished_at = time.time()
+
+    def _hottest_cprofile(self):
+        stats = pstats.Stats(self._profile)
+        rows = []
+        for (filename, line, name), (cc, nc, tt, ct, _) in stats.stats.items():
+            rows.append({
+                'function': f"{filename}:{line}({name})",
+                'calls': nc,
+                'self_seconds': round(tt, 6),
+                'cumulative_seconds': round(ct, 6),
+            })
+        rows.sort(key=lambda r: r['cumulative_seconds'], reverse=True)
+        return rows[:self.top]
+
+    def _hottest_sampling(self):
+        sampler = self._sampler
+        interval = sampler.interval
+        rows = [{
+            'function': key,
+            'samples': count,
+            'self_samples': sampler.self_counts.get(key, 0),
+            'approx_cumulative_seconds': round(count * interval, 3),
+        } for key, count in sampler.total_counts.most_common(self.top)]
+        return rows
+
+    def report(self):
+        with self._lock:
+            if self.mode is None:
+                return {'status': 'idle'}
+            done = self.finished_at is not None
+            status = 'done' if done else ('running' if self._active or self._open or self.profiled else 'armed')
+            report = {
+                'status': status,
+                'mode': self.mode,
+                'emails_profiled': self.profiled,
+                'emails_remaining': self.remaining,
+                'emails_in_progress': len(self._open),
+            }
+            if not done:
+                return report
+            report['elapsed_seconds'] = round(self.finished_at - self.started_at, 3)
+            if self.mode == MODE_CPROFILE:
+                report['functions'] = self._hottest_cprofile()
+            else:
+                report['samples'] = self._sampler.samples
+                report['functions'] = self._hottest_sampling()
+            return report
@@ -0,0 +1,259 @@
+import os
+import json
+import shutil
+import logging
+import zipfile
+import mimetypes
+from email.parser import BytesHeaderParser
+from datetime import datetime, timezone, timedelta
+
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', '30'))
+ARCHIVE_SEGMENT_MAX_BYTES = int(os.environ.get('ARCHIVE_SEGMENT_MAX_MB', '256')) * 1024 * 1024
+
+INDEX_FILE = 'index.json'
+SOURCE_FILE = 'source.json'
+
+# 已压缩格式直接存储，避免重复 deflate 浪费 CPU
+STORED_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.zip', '.gz', '.docx', '.xlsx', '.pptx', '.mp3', '.mp4', '.mov'}
+
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def eml_message_id(fp):
+    # 只解析头部，不读正文和附件
+    value = BytesHeaderParser().parse(fp).get('Message-ID')
+    return str(value).strip() if value else None
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class ArchiveStore:
+    """Packs completed emails into compressed zip segments with a JSON index.
+
+    An email is completed once its workflow response has been written. Each
+    archived email keeps three member groups inside its segment:
+    ``<folder>/eml/``, ``<folder>/processed/`` and ``<folder>/response/``.
+    Old downloads with neither a processed folder nor a response (emails
+    triaged to skip before a marker response was written) are archived as
+    ``eml`` only.
+    """
+
+    def __init__(self, archive_dir=ARCHIVE_DIR, segment_max_bytes=ARCHIVE_SEGMENT_MAX_BYTES):
+        self.archive_dir = archive_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.index_path = os.path.join(archive_dir, INDEX_FILE)
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_index(self, index):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _new_segment_name(self):
+        return f"segment-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}.zip"
+
+    def find_candidates(self, download_dir, processed_dir, responses_dir, older_than_days):
+        cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+        candidates = []
+        for file in os.listdir(responses_dir) if os.path.isdir(responses_dir) else []:
+            if not file.endswith('.txt'):
+                continue
+            response_path = os.path.join(responses_dir, file)
+            mtime = datetime.fromtimestamp(os.path.getmtime(response_path), tz=timezone.utc)
+            if mtime > cutoff:
+                continue
+            folder_name = file[:-len('.txt')]
+            candidates.append({
+                'folder_name': folder_name,
+                'response': response_path,
+                'eml': os.path.join(download_dir, f"{folder_name}.eml"),
+                'processed': os.path.join(processed_dir, folder_name),
+            })
+        if os.path.isdir(download_dir):
+            for file in os.listdir(download_dir):
+                if not file.endswith('.eml') or file.endswith('.part.eml'):
+                    continue
+                folder_name = file[:-len('.eml')]
+                eml_path = os.path.join(download_dir, file)
+                processed = os.path.join(processed_dir, folder_name)
+                if os.path.exists(os.path.join(responses_dir, f"{folder_name}.txt")) or os.path.exists(processed):
+                    continue
+                mtime = datetime.fromtimestamp(os.path.getmtime(eml_path), tz=timezone.utc)
+                if mtime > cutoff:
+                    continue
+                candidates.append({'folder_name': folder_name, 'response': None, 'eml': eml_path,
+                                   'processed': processed})
+        return candidates
+
+    @staticmethod
+    def _message_ids(candidate):
+        ids = []
+        source_path = os.path.join(candidate['processed'], SOURCE_FILE)
+        try:
+            with open(source_path, 'r', encoding='utf-8') as f:
+                ids.append(json.load(f).get('message_id'))
+        except (OSError, ValueError):
+            pass
+        try:
+            with open(candidate['eml'], 'rb') as f:
+                ids.append(eml_message_id(f))
+        except OSError:
+            pass
+        return [message_id for message_id in ids if message_id]
+
+    def known_message_ids(self):
+        """Graph ids and Message-ID headers of every archived email.
+
+        Entries written before ids were recorded in the index are read from
+        their segment, one zip open per segment.
+        """
+        ids = set()
+        legacy = {}
+        for folder_name, entry in self.load_index().items():
+            if 'message_ids' in entry:
+                ids.update(entry['message_ids'])
+            else:
+                legacy.setdefault(entry['segment'], []).append((folder_name, entry))
+        for segment_name, entries in legacy.items():
+            try:
+                with zipfile.ZipFile(os.path.join(self.archive_dir, segment_name)) as segment:
+                    for folder_name, entry in entries:
+                        for member in entry['members']:
+                            if member.startswith(f"{folder_name}/eml/"):
+                                with segment.open(member) as f:
+                                    message_id = eml_message_id(f)
+                            elif member == f"{folder_name}/processed/{SOURCE_FILE}":
+                                message_id = json.loads(segment.read(member)).get('message_id')
+                            else:
+                                continue
+                            if message_id:
+                                ids.add(message_id)
+            except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+                logging.exception(f"Failed to read message ids from archive segment {segment_name}")
+        return ids
+
+    def _members_for(self, candidate):
+        folder_name = candidate['folder_name']
+        members = []
+        if os.path.isfile(candidate['eml']):
+            members.append((candidate['eml'], f"{folder_name}/eml/{os.path.basename(candidate['eml'])}"))
+        if os.path.isdir(candidate['processed']):
+            for root, _, files in os.walk(candidate['processed']):
+                for name in files:
+                    path = os.path.join(root, name)
+                    rel = os.path.relpath(path, candidate['processed']).replace(os.sep, '/')
+                    members.append((path, f"{folder_name}/processed/{rel}"))
+        if candidate['response']:
+            members.append((candidate['response'], f"{folder_name}/response/{os.path.basename(candidate['response'])}"))
+        return members
+
+    def compact(self, download_dir, processed_dir, responses_dir, older_than_days=RETENTION_DAYS):
+        index = self.load_index()
+        candidates = self.find_candidates(download_dir, processed_dir, responses_dir, older_than_days)
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        archived = []
+        bytes_removed = 0
+        bytes_added = 0
+        segments_written = []
+        segment = None
+        segment_path = None
+        segment_name = None
+
+        def close_segment():
+            nonlocal segment, bytes_added
+            if segment is not None:
+                segment.close()
+                bytes_added += os.path.getsize(segment_path)
+                segments_written.append(segment_name)
+                segment = None
+
+        try:
+            for candidate in candidates:
+                folder_name = candidate['folder_name']
+                entry = index.get(folder_name)
+                if entry and os.path.exists(os.path.join(self.archive_dir, entry['segment'])):
+                    # 上次归档后未来得及删除的残留文件
+                    for key in ('eml', 'processed', 'response'):
+                        if candidate[key] and os.path.exists(candidate[key]):
+                            bytes_removed += _tree_size(candidate[key])
+                            _remove(candidate[key])
+                    continue
+                if segment is None or os.path.getsize(segment_path) >= self.segment_max_bytes:
+                    close_segment()
+                    segment_name = self._new_segment_name()
+                    segment_path = os.path.join(self.archive_dir, segment_name)
+                    segment = zipfile.ZipFile(segment_path, 'w')
+                members = self._members_for(candidate)
+                for path, arcname in members:
+                    ext = os.path.splitext(path)[1].lower()
+                    compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                    segment.write(path, arcname, compress_type=compress_type)
+                segment.fp.flush()
+                index[folder_name] = {
+                    'segment': segment_name,
+                    'members': [arcname for _, arcname in members],
+                    'message_ids': self._message_ids(candidate),
+                    'archived_at': datetime.now(timezone.utc).isoformat(),
+                }
+                archived.append((folder_name, candidate))
+        finally:
+            close_segment()
+
+        # 先落盘索引，再删除原文件，保证任意时刻都能找回邮件
+        if archived:
+            self._save_index(index)
+        for folder_name, candidate in archived:
+            for key in ('eml', 'processed', 'response'):
+                if candidate[key] and os.path.exists(candidate[key]):
+                    bytes_removed += _tree_size(candidate[key])
+                    _remove(candidate[key])
+
+        stats = {
+            'archived_emails': len(archived),
+            'segments_written': segments_written,
+            'bytes_removed': bytes_removed,
+            'bytes_added': bytes_added,
+            'bytes_reclaimed': bytes_removed - bytes_added,
+        }
+        logging.info(f"Retention compaction finished: {stats}")
+        return stats
+
+    def list_members(self, folder_name):
+        entry = self.load_index().get(folder_name)
+        if not entry:
+            return None
+        return entry
+
+    def read_member(self, folder_name, member):
+        entry = self.load_index().get(folder_name)
+        if not entry:
+            return None
+        arcname = f"{folder_name}/{member}"
+        if arcname not in entry['members']:
+            return None
+        with zipfile.ZipFile(os.path.join(self.archive_dir, entry['segment'])) as segment:
+            data = segment.read(arcname)
+        mime_type, _ = mimetypes.guess_type(member)
+        return data, mime_type or 'application/octet-stream'
@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+import threading
+
+from .metrics import POLL_INTERVAL
+
+DAEMON_MODE = os.environ.get('DAEMON_MODE', '').lower() in ('1', 'true', 'yes', 'on')
+DAEMON_MIN_INTERVAL = float(os.environ.get('DAEMON_MIN_INTERVAL_SECONDS', '10'))
+DAEMON_MAX_INTERVAL = float(os.environ.get('DAEMON_MAX_INTERVAL_SECONDS', '600'))
+# 每轮希望攒到的邮件数；到达越快轮询越密
+DAEMON_TARGET_BATCH = float(os.environ.get('DAEMON_TARGET_BATCH', '5'))
+DAEMON_IDLE_BACKOFF = float(os.environ.get('DAEMON_IDLE_BACKOFF', '1.5'))
+DAEMON_DRAIN_SECONDS = float(os.environ.get('DAEMON_DRAIN_SECONDS', '120'))
+# 到达率的指数平滑系数
+DAEMON_RATE_SMOOTHING = 0.3
+
+
+class PollScheduler:
+    """Runs fetch -> process in a background thread with an adaptive interval.
+
+    The interval follows the smoothed arrival rate so that each poll picks up
+    roughly ``target_batch`` emails, polls again immediately while a backlog
+    remains, and backs off geometrically while the mailbox is idle.
+    """
+
+    def __init__(self, fetch, process, batch_size, min_interval=DAEMON_MIN_INTERVAL,
+                 max_interval=DAEMON_MAX_INTERVAL, target_batch=DAEMON_TARGET_BATCH,
+                 idle_backoff=DAEMON_IDLE_BACKOFF, drain_seconds=DAEMON_DRAIN_SECONDS):
+        self.fetch = fetch
+        self.process = process
+        self.batch_size = batch_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_batch = target_batch
+        self.idle_backoff = idle_backoff
+        self.drain_seconds = drain_seconds
+        self.interval = min_interval
+        self.arrival_rate = None
+        self.last_poll = None
+        self.next_poll = None
+        self.last_cycle = None
+        self.counters = {'cycles': 0, 'fetched': 0, 'processed': 0, 'errors': 0, 'wakeups': 0}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def stopping(self):
+        return self._stop.is_set()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='poll-scheduler', daemon=True)
+        self._thread.start()
+        logging.info("Poll scheduler started")
+
+    def stop(self):
+        # 只等当前这封邮件处理完；队列里剩下的邮件仍在磁盘上，下次启动继续
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.drain_seconds)
+            if self._thread.is_alive():
+                logging.warning(f"Poll scheduler still busy after {self.drain_seconds}s, giving up on drain")
+            self._thread = None
+        logging.info("Poll scheduler stopped")
+
+    def wake(self):
+        # 收到推送通知等明确信号时提前开始下一轮
+        self.counters['wakeups'] += 1
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            fetched = None
+            try:
+                fetched = self._cycle()
+            except Exception:
+                self.counters['errors'] += 1
+                logging.exception("Scheduled poll failed")
+            wait = self._adapt(fetched)
+            POLL_INTERVAL.set(self.interval)
+            self.next_poll = time.time() + wait
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def _cycle(self):
+        started = time.monotonic()
+        fetch_result = self.fetch() or {}
+        fetched = len(fetch_result.get('folders', [])) + len(fetch_result.get('skipped', []))
+        processed = 0
+        # 流水线模式下由消费线程处理，process 为 None
+        if self.process is not None and not self._stop.is_set():
+            processed = len(self.process() or [])
+        self.counters['cycles'] += 1
+        self.counters['fetched'] += fetched
+        self.counters['processed'] += processed
+        self.last_cycle = {
+            'finished_at': time.time(),
+            'fetched': fetched,
+            'processed': processed,
+            'seconds': round(time.monotonic() - started, 3),
+        }
+        return fetched
+
+    def _adapt(self, fetched):
+        now = time.monotonic()
+        previous, self.last_poll = self.last_poll, now
+        if fetched is None:
+            # 出错时按空闲处理，避免对故障的上游频繁重试
+            self.interval = min(self.max_interval, self.interval * self.idle_backoff)
+            return self.interval
+        if previous is not None:
+            sample = fetched / max(now - previous, 1e-3)
+            if self.arrival_rate is None:
+                self.arrival_rate = sample
+            else:
+                self.arrival_rate = DAEMON_RATE_SMOOTHING * sample + (1 - DAEMON_RATE_SMOOTHING) * self.arrival_rate
+        if fetched >= self.batch_size:
+            # 本轮取满说明还有积压，立即再取，间隔本身按到达率继续调整
+            interval = self.target_batch / self.arrival_rate if self.arrival_rate else self.min_interval
+        elif fetched == 0:
+            interval = self.interval * self.idle_backoff
+            if self.arrival_rate:
+                interval = max(interval, self.target_batch / self.arrival_rate)
+        elif self.arrival_rate:
+            interval = self.target_batch / self.arrival_rate
+        else:
+            interval = self.interval
+        self.interval = min(self.max_interval, max(self.min_interval, interval))
+        return 0.0 if fetched >= self.batch_size else self.interval
+
+    def status(self):
+        return {
+            'enabled': DAEMON_MODE,
+            'running': self.running,
+            'stopping': self.stopping,
+            'interval_seconds': round(self.interval, 2),
+            'arrival_rate_per_minute': round(self.arrival_rate * 60, 3) if self.arrival_rate is not None else None,
+            'next_poll_in_seconds': round(max(0.0, self.next_poll - time.time()), 1) if self.next_poll and self.running else None,
+            'last_cycle': self.last_cycle,
+            'counters': dict(self.counters),
+        }
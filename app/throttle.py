@@ -0,0 +1,235 @@
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from .circuit import DeadlineExceeded
+from .metrics import HTTP_RETRIES, HTTP_THROTTLED
+
+THROTTLE_MAX_ATTEMPTS = int(os.environ.get('THROTTLE_MAX_ATTEMPTS', '5'))
+THROTTLE_BASE_DELAY = float(os.environ.get('THROTTLE_BASE_DELAY', '0.5'))
+THROTTLE_MAX_DELAY = float(os.environ.get('THROTTLE_MAX_DELAY', '60'))
+THROTTLE_INITIAL_CONCURRENCY = float(os.environ.get('THROTTLE_INITIAL_CONCURRENCY', '4'))
+THROTTLE_MAX_CONCURRENCY = float(os.environ.get('THROTTLE_MAX_CONCURRENCY', '16'))
+# 重试预算：每个请求存入 ratio 个令牌，每次重试消耗 1 个，避免故障时重试风暴
+THROTTLE_RETRY_BUDGET_RATIO = float(os.environ.get('THROTTLE_RETRY_BUDGET_RATIO', '0.2'))
+THROTTLE_RETRY_BUDGET_MAX = float(os.environ.get('THROTTLE_RETRY_BUDGET_MAX', '10'))
+# "graph.microsoft.com:5,qyapi.weixin.qq.com:3"，超过目标延迟时同样收缩并发
+THROTTLE_LATENCY_TARGETS = {
+    host.strip(): float(seconds)
+    for host, _, seconds in (item.rpartition(':') for item in os.environ.get('THROTTLE_LATENCY_TARGETS', '').split(','))
+    if host.strip() and seconds
+}
+
+THROTTLED_STATUSES = (429, 503)
+TRANSIENT_STATUSES = (502, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+def request_not_sent(error):
+    # 连接建立失败时服务端肯定没有收到请求，非幂等请求也可以安全重试
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """AIMD concurrency limit and retry budget for a single host."""
+
+    def __init__(self, host, initial=THROTTLE_INITIAL_CONCURRENCY, maximum=THROTTLE_MAX_CONCURRENCY,
+                 latency_target=None, max_block=THROTTLE_MAX_DELAY):
+        self.host = host
+        self.limit = initial
+        self.maximum = maximum
+        self.latency_target = latency_target
+        # 单次 Retry-After 最多封锁这么久，异常的超大值不会让整个主机卡死
+        self.max_block = max_block
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.retry_tokens = THROTTLE_RETRY_BUDGET_MAX
+        self.last_decrease = 0.0
+        self.counters = {'requests': 0, 'retries': 0, 'throttled': 0, 'budget_exhausted': 0, 'errors': 0}
+        self._cond = threading.Condition()
+
+    def acquire(self, deadline=None):
+        with self._cond:
+            while True:
+                wait = self.blocked_until - time.monotonic()
+                if wait <= 0 and self.in_flight < max(1, int(self.limit)):
+                    self.in_flight += 1
+                    self.counters['requests'] += 1
+                    self.retry_tokens = min(self.retry_tokens + THROTTLE_RETRY_BUDGET_RATIO, THROTTLE_RETRY_BUDGET_MAX)
+                    return
+                timeout = wait if wait > 0 else None
+                remaining = deadline.remaining() if deadline is not None else None
+                if remaining is not None:
+                    # 封锁期比剩余时间还长时不必干等，交给调用方推迟
+                    if remaining <= 0 or wait > remaining:
+                        raise DeadlineExceeded(f"{self.host} is throttled for {max(0.0, wait):.1f}s, "
+                                               f"deadline in {remaining:.1f}s")
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                self._cond.wait(timeout=timeout)
+
+    def _decrease(self, factor, latency):
+        # 同一批并发请求的多次拥塞信号只收缩一次
+        now = time.monotonic()
+        if now - self.last_decrease < latency:
+            return
+        self.last_decrease = now
+        self.limit = max(1.0, self.limit * factor)
+
+    def release(self, status, latency, retry_after=None):
+        with self._cond:
+            self.in_flight -= 1
+            if status in THROTTLED_STATUSES:
+                self.counters['throttled'] += 1
+                HTTP_THROTTLED.labels(self.host).inc()
+                self._decrease(0.5, latency)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + min(retry_after, self.max_block))
+            elif status is None or status >= 500:
+                self.counters['errors'] += 1
+                self._decrease(0.5, latency)
+            elif self.latency_target and latency > self.latency_target:
+                self._decrease(0.9, latency)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def try_spend_retry(self):
+        with self._cond:
+            if self.retry_tokens >= 1:
+                self.retry_tokens -= 1
+                self.counters['retries'] += 1
+                HTTP_RETRIES.labels(self.host).inc()
+                return True
+            self.counters['budget_exhausted'] += 1
+            return False
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, limit=round(self.limit, 2), in_flight=self.in_flight,
+                        retry_tokens=round(self.retry_tokens, 2),
+                        blocked_for=max(0.0, round(self.blocked_until - time.monotonic(), 2)))
+
+
+class AdaptiveThrottle:
+    """Per-host adaptive concurrency with Retry-After aware, jittered retries.
+
+    Throttling responses (429/503) are always safe to retry because the
+    server rejected the request. Timeouts, connection errors and 502/504 are
+    only retried when the call is idempotent, since the server may already
+    have acted on it.
+    """
+
+    def __init__(self, max_attempts=THROTTLE_MAX_ATTEMPTS, base_delay=THROTTLE_BASE_DELAY,
+                 max_delay=THROTTLE_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, url):
+        host = urlsplit(url).hostname or ''
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = HostLimiter(host, latency_target=THROTTLE_LATENCY_TARGETS.get(host),
+                                                max_block=self.max_delay)
+            return self._hosts[host]
+
+    def _backoff(self, attempt, retry_after):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        return delay
+
+    @staticmethod
+    def _rewind(kwargs):
+        for value in (kwargs.get('files') or {}).values():
+            fileobj = value[1] if isinstance(value, tuple) else value
+            if hasattr(fileobj, 'seek'):
+                fileobj.seek(0)
+
+    def request(self, method, url, idempotent=None, deadline=None, **kwargs):
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        limiter = self.limiter(url)
+        timeout_cap = kwargs.get('timeout')
+        attempt = 0
+        while True:
+            if deadline is not None:
+                kwargs['timeout'] = deadline.timeout(timeout_cap)
+            limiter.acquire(deadline)
+            start = time.monotonic()
+            resp = None
+            try:
+                self._rewind(kwargs)
+                resp = requests.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                limiter.release(None, time.monotonic() - start)
+                error = e
+            except Exception:
+                limiter.release(None, time.monotonic() - start)
+                raise
+            else:
+                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                limiter.release(resp.status_code, time.monotonic() - start, retry_after)
+                error = None
+            attempt += 1
+            if resp is not None:
+                retryable = resp.status_code in THROTTLED_STATUSES or (
+                    idempotent and resp.status_code in TRANSIENT_STATUSES)
+            else:
+                retryable = idempotent or request_not_sent(error)
+            if not retryable or attempt >= self.max_attempts or not limiter.try_spend_retry():
+                if error is not None:
+                    raise error
+                return resp
+            delay = self._backoff(attempt, retry_after if resp is not None else None)
+            if deadline is not None and deadline.remaining() is not None and deadline.remaining() <= delay:
+                # 等不到下一次重试了，直接把本次结果交给调用方
+                if error is not None:
+                    raise error
+                return resp
+            logging.warning(f"Retrying {method} {url} in {delay:.1f}s (attempt {attempt}, "
+                            f"{resp.status_code if resp is not None else type(error).__name__})")
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            hosts = list(self._hosts.values())
+        return {limiter.host: limiter.stats() for limiter in hosts}
+
+
+http = AdaptiveThrottle()
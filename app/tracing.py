@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import logging
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+
+TRACE_EXPORT_FILE = os.environ.get('TRACE_EXPORT_FILE', os.path.join('traces', 'spans.jsonl'))
+TRACE_EXPORT_MAX_BYTES = int(os.environ.get('TRACE_EXPORT_MAX_MB', '50')) * 1024 * 1024
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'xarl-email-agent')
+TRACE_ID_FILE = 'trace_id'
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class SpanExporter:
+    """Writes finished traces as OTLP/JSON ``ExportTraceServiceRequest`` lines."""
+
+    def __init__(self, path=TRACE_EXPORT_FILE, max_bytes=TRACE_EXPORT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        if not self.path or not spans:
+            return
+        request = {'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', TRACE_SERVICE_NAME)]},
+            'scopeSpans': [{'scope': {'name': 'app.tracing'}, 'spans': spans}],
+        }]}
+        line = json.dumps(request, ensure_ascii=False) + '\n'
+        with self._lock:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    os.replace(self.path, f"{self.path}.1")
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError:
+                logging.exception("Failed to export spans")
+
+
+exporter = SpanExporter()
+
+
+class _Trace:
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+
+
+@contextmanager
+def start_trace(trace_id=None, name='email', **attributes):
+    """Opens a root span; every span finished inside it is exported together."""
+    trace = _Trace(trace_id or new_trace_id())
+    token = _current_trace.set(trace)
+    try:
+        with span(name, **attributes):
+            yield trace.trace_id
+    finally:
+        _current_trace.reset(token)
+        exporter.export(trace.spans)
+
+
+@contextmanager
+def span(name, **attributes):
+    trace = _current_trace.get()
+    if trace is None:
+        # 不在任何 trace 内（例如单独调用工具函数）时不记录
+        yield None
+        return
+    parent = _current_span.get()
+    record = {
+        'traceId': trace.trace_id,
+        'spanId': secrets.token_hex(8),
+        'parentSpanId': parent['spanId'] if parent else '',
+        'name': name,
+        'kind': 1,
+        'startTimeUnixNano': str(time.time_ns()),
+        'attributes': [_attribute(k, v) for k, v in attributes.items()],
+        'status': {'code': STATUS_OK},
+    }
+    token = _current_span.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record['status'] = {'code': STATUS_ERROR, 'message': str(e)}
+        raise
+    finally:
+        record['endTimeUnixNano'] = str(time.time_ns())
+        _current_span.reset(token)
+        trace.spans.append(record)
+
+
+def set_attribute(key, value):
+    record = _current_span.get()
+    if record is not None:
+        record['attributes'].append(_attribute(key, value))
+
+
+def current_trace_id():
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+def save_trace_id(folder, trace_id):
+    with open(os.path.join(folder, TRACE_ID_FILE), 'w') as f:
+        f.write(trace_id)
+
+
+def load_trace_id(folder):
+    path = os.path.join(folder, TRACE_ID_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return f.read().strip() or None
@@ -0,0 +1,102 @@
+import os
+import re
+import threading
+from collections import Counter
+from email.utils import parseaddr
+
+ROUTE_SKIP = 'skip'
+ROUTE_LIGHTWEIGHT = 'lightweight'
+ROUTE_FULL = 'full'
+ROUTES = (ROUTE_SKIP, ROUTE_LIGHTWEIGHT, ROUTE_FULL)
+
+
+def _split_list(value):
+    return [item.strip().lower() for item in (value or '').split(',') if item.strip()]
+
+
+def _split_patterns(value):
+    # 正则里可能含逗号，所以用 || 分隔
+    return [re.compile(p.strip(), re.IGNORECASE) for p in (value or '').split('||') if p.strip()]
+
+
+def _route(name, value):
+    # 拼错的路由会让邮件落到未知分支，启动时直接报错
+    route = (value or '').strip().lower()
+    if route not in ROUTES:
+        raise ValueError(f"{name} must be one of {', '.join(ROUTES)}, got {value!r}")
+    return route
+
+
+TRIAGE_SENDER_ALLOW = _split_list(os.environ.get('TRIAGE_SENDER_ALLOW', ''))
+TRIAGE_SENDER_DENY = _split_list(os.environ.get('TRIAGE_SENDER_DENY', ''))
+TRIAGE_SKIP_SUBJECT_PATTERNS = _split_patterns(os.environ.get('TRIAGE_SKIP_SUBJECT_PATTERNS', r'^\s*\[广告\]||^\s*\[AD\]'))
+TRIAGE_LIGHTWEIGHT_SUBJECT_PATTERNS = _split_patterns(os.environ.get('TRIAGE_LIGHTWEIGHT_SUBJECT_PATTERNS', r'newsletter||digest'))
+TRIAGE_BULK_ROUTE = _route('TRIAGE_BULK_ROUTE', os.environ.get('TRIAGE_BULK_ROUTE', ROUTE_SKIP))
+TRIAGE_UNSUBSCRIBE_ROUTE = _route('TRIAGE_UNSUBSCRIBE_ROUTE', os.environ.get('TRIAGE_UNSUBSCRIBE_ROUTE', ROUTE_LIGHTWEIGHT))
+
+
+def _sender_matches(address, entries):
+    domain = address.rsplit('@', 1)[-1] if '@' in address else ''
+    for entry in entries:
+        if entry == address:
+            return True
+        if domain and (entry == domain or entry == f'@{domain}' or domain.endswith(f'.{entry.lstrip("@")}')):
+            return True
+    return False
+
+
+class Triage:
+    """Rule-based router deciding how much work an email deserves.
+
+    Rules are evaluated in order and the first hit wins:
+    sender allow list, sender deny list, skip subject patterns,
+    ``Precedence`` header, ``List-Unsubscribe`` header and lightweight
+    subject patterns. Emails matching no rule take the full workflow.
+    """
+
+    def __init__(self, sender_allow=None, sender_deny=None, skip_subject_patterns=None,
+                 lightweight_subject_patterns=None, bulk_route=TRIAGE_BULK_ROUTE,
+                 unsubscribe_route=TRIAGE_UNSUBSCRIBE_ROUTE):
+        self.sender_allow = TRIAGE_SENDER_ALLOW if sender_allow is None else sender_allow
+        self.sender_deny = TRIAGE_SENDER_DENY if sender_deny is None else sender_deny
+        self.skip_subject_patterns = TRIAGE_SKIP_SUBJECT_PATTERNS if skip_subject_patterns is None else skip_subject_patterns
+        self.lightweight_subject_patterns = (TRIAGE_LIGHTWEIGHT_SUBJECT_PATTERNS
+                                             if lightweight_subject_patterns is None else lightweight_subject_patterns)
+        self.bulk_route = _route('bulk_route', bulk_route)
+        self.unsubscribe_route = _route('unsubscribe_route', unsubscribe_route)
+        self._hits = Counter()
+        self._routes = Counter()
+        self._lock = threading.Lock()
+
+    def _evaluate(self, msg):
+        address = parseaddr(str(msg.get('From', '')))[1].lower()
+        subject = str(msg.get('Subject', ''))
+        if address and _sender_matches(address, self.sender_allow):
+            return ROUTE_FULL, 'sender_allow'
+        if address and _sender_matches(address, self.sender_deny):
+            return ROUTE_SKIP, 'sender_deny'
+        for pattern in self.skip_subject_patterns:
+            if pattern.search(subject):
+                return ROUTE_SKIP, 'subject_skip'
+        precedence = str(msg.get('Precedence', '')).strip().lower()
+        if precedence in ('bulk', 'junk', 'list'):
+            return self.bulk_route, 'precedence_bulk'
+        if msg.get('List-Unsubscribe'):
+            return self.unsubscribe_route, 'list_unsubscribe'
+        for pattern in self.lightweight_subject_patterns:
+            if pattern.search(subject):
+                return ROUTE_LIGHTWEIGHT, 'subject_lightweight'
+        return ROUTE_FULL, 'default'
+
+    def classify(self, msg, record=True):
+        route, rule = self._evaluate(msg)
+        if not record:
+            return route, rule
+        with self._lock:
+            self._hits[rule] += 1
+            self._routes[route] += 1
+        return route, rule
+
+    def stats(self):
+        with self._lock:
+            return {'rule_hits': dict(self._hits), 'routes': dict(self._routes)}
@@ -0,0 +1,139 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from email.utils import getaddresses
+
+WORKFLOW_CACHE_DIR = os.environ.get('WORKFLOW_CACHE_DIR', 'workflow_cache')
+WORKFLOW_CACHE_TTL_SECONDS = int(os.environ.get('WORKFLOW_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+WORKFLOW_CACHE_MAX_ENTRIES = int(os.environ.get('WORKFLOW_CACHE_MAX_ENTRIES', '1000'))
+
+SUBJECT_PREFIX_RE = re.compile(r'^\s*((re|fw|fwd|回复|答复|转发)\s*[:：]\s*)+', re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'[ \t\r\f\v]+')
+
+
+def normalize_subject(subject):
+    return WHITESPACE_RE.sub(' ', SUBJECT_PREFIX_RE.sub('', subject or '')).strip().lower()
+
+
+def normalize_body(body):
+    lines = [WHITESPACE_RE.sub(' ', line).strip() for line in (body or '').splitlines()]
+    return '\n'.join(line for line in lines if line)
+
+
+def normalize_addresses(msg):
+    # 只保留小写地址并排序，显示名和顺序不同不影响命中；工作流输出的收件人取决于这些头
+    parts = []
+    for header in ('From', 'To', 'Cc'):
+        values = [str(v) for v in msg.get_all(header, [])]
+        addresses = sorted({addr.strip().lower() for _, addr in getaddresses(values) if addr.strip()})
+        parts.append(f"{header.lower()}:{','.join(addresses)}")
+    return '|'.join(parts)
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def content_key(namespace, subject, body, attachment_paths, addresses=''):
+    h = hashlib.sha256()
+    h.update(namespace.encode('utf-8'))
+    h.update(b'\0')
+    h.update(addresses.encode('utf-8'))
+    h.update(b'\0')
+    h.update(normalize_subject(subject).encode('utf-8'))
+    h.update(b'\0')
+    h.update(normalize_body(body).encode('utf-8'))
+    # 附件按内容哈希排序，和文件名、顺序无关
+    for digest in sorted(file_digest(p) for p in attachment_paths):
+        h.update(b'\0')
+        h.update(digest.encode('ascii'))
+    return h.hexdigest()
+
+
+class WorkflowCache:
+    """On-disk LRU cache of workflow responses with a TTL.
+
+    One JSON file per key lives under ``cache_dir``; recency is tracked in
+    memory and persisted through the file mtime so it survives restarts.
+    """
+
+    def __init__(self, cache_dir=WORKFLOW_CACHE_DIR, ttl_seconds=WORKFLOW_CACHE_TTL_SECONDS,
+                 max_entries=WORKFLOW_CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for file in os.listdir(self.cache_dir):
+                if file.endswith('.json'):
+                    entries.append((os.path.getmtime(os.path.join(self.cache_dir, file)), file[:-len('.json')]))
+        self._entries = OrderedDict((key, None) for _, key in sorted(entries))
+
+    def _discard(self, key):
+        self._entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                self._discard(key)
+                self.misses += 1
+                return None
+            if time.time() - entry['created_at'] > self.ttl_seconds:
+                self._discard(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            os.utime(self._path(key))
+            self.hits += 1
+            return entry['response']
+
+    def put(self, key, response):
+        with self._lock:
+            self._load()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{self._path(key)}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'created_at': time.time(), 'response': response}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+            self._entries[key] = None
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                logging.info(f"Evicting workflow cache entry {oldest}")
+                self._discard(oldest)
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
@@ -0,0 +1,296 @@
+"""End-to-end benchmark of the /get_emails -> /process_emails pipeline.
+
+Starts fake Graph, Dify and WeCom servers (see ``fakes/``), runs the app with
+uvicorn in a subprocess inside a scratch working directory, feeds it emails
+in batches and prints a JSON baseline::
+
+    python -m benchmarks.e2e --emails 200 --batch 50 --attachment-kb 256 --output baseline.json
+
+Latency per email is measured from the moment the email lands in the fake
+mailbox until the ``/process_emails`` call that handled it returns.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+from fakes.graph import FakeGraph
+from fakes.dify import FakeDify
+from fakes.wecom import FakeWeCom
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 4)
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p99': percentile(values, 99),
+        'max': round(max(values), 4) if values else None,
+    }
+
+
+def peak_rss_mb(pid):
+    # VmHWM 是进程生命周期内的常驻内存峰值，只在 Linux 上可用
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def stage_means(metrics_text):
+    sums, counts = {}, {}
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name != 'xarl_stage_duration_seconds':
+            continue
+        for sample in family.samples:
+            stage = sample.labels.get('stage')
+            if sample.name.endswith('_sum'):
+                sums[stage] = sums.get(stage, 0.0) + sample.value
+            elif sample.name.endswith('_count'):
+                counts[stage] = counts.get(stage, 0.0) + sample.value
+    return {stage: {'count': int(counts[stage]), 'mean_seconds': round(sums.get(stage, 0.0) / counts[stage], 4)}
+            for stage in sorted(counts) if counts[stage]}
+
+
+def prepare_workdir(path):
+    # 只复制字体本身，fpdf 会按当前路径重新生成字体缓存
+    os.makedirs(os.path.join(path, 'fonts'), exist_ok=True)
+    shutil.copy(os.path.join(REPO_ROOT, 'fonts', 'DejaVuSans.ttf'), os.path.join(path, 'fonts'))
+    for name in ('downloaded_emails', 'processed_emails', 'workflow_responses'):
+        os.makedirs(os.path.join(path, name), exist_ok=True)
+
+
+def start_app(workdir, port, graph, dify, wecom, args):
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''),
+        GRAPH_BASE_URL=graph.url,
+        DIFY_BASE_URL=dify.url,
+        WECOM_BASE_URL=wecom.url,
+        EMAIL_ACCESS_TOKEN='benchmark',
+        DIFY_API_KEY='benchmark',
+        WECOM_CORPID='benchmark',
+        WECOM_CORPSECRET='benchmark',
+        WECOM_AGENTID='1',
+        EMAIL_DEFAULT_EMAIL_COUNT=str(args.batch),
+        PROCESS_RUN_DEADLINE_SECONDS='0',
+    )
+    if args.pipeline:
+        env.update(PIPELINE_MODE='1', PIPELINE_RETRY_SECONDS=str(args.retry_after))
+    log = open(os.path.join(workdir, 'app.log'), 'w')
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        if proc.poll() is not None:
+            raise RuntimeError(f"App exited during startup, see {log.name}")
+        try:
+            if requests.get(f"{base}/health", timeout=1).status_code == 200:
+                return proc, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"App did not become healthy, see {log.name}")
+
+
+def inject(graph, rng, start, count, args):
+    received = datetime.now(timezone.utc).replace(microsecond=0)
+    for i in range(start, start + count):
+        attachments = [(f'data_{i + 1}_{n + 1}.bin', 'application/octet-stream',
+                        rng.randbytes(args.attachment_kb * 1024))
+                       for n in range(args.attachments)]
+        graph.add_message(subject=f'Benchmark message {i + 1}',
+                          sender=f'sender{i % 50}@example.com',
+                          body=f'Benchmark body {i + 1} {rng.getrandbits(64):x}\n' + 'Lorem ipsum dolor sit amet. ' * 40,
+                          attachments=attachments, received=received)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    graph = FakeGraph(latency=args.graph_latency, error_rate=args.error_rate, retry_after=args.retry_after,
+                      seed=args.seed).start()
+    dify = FakeDify(latency=args.dify_latency, workflow_latency=args.workflow_latency, error_rate=args.error_rate,
+                    retry_after=args.retry_after, recipient_email='bench@example.com' if args.notify else None,
+                    seed=args.seed).start()
+    wecom = FakeWeCom(latency=args.wecom_latency, error_rate=args.error_rate, seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix='xarl-bench-')
+    prepare_workdir(workdir)
+    proc, base = start_app(workdir, free_port(), graph, dify, wecom, args)
+    responses_dir = os.path.join(workdir, 'workflow_responses')
+    latencies = {'get_emails': [], 'process_emails': [], 'email': []}
+    outcomes = {}
+    injected = 0
+    pending = {}
+    finished = set()
+    pipeline = None
+    started = time.monotonic()
+    last_progress = started
+    try:
+        while injected < args.emails or pending:
+            count = min(args.batch, args.emails - injected)
+            if count:
+                inject(graph, rng, injected, count, args)
+                injected += count
+            # 墙钟时间，流水线模式下与结果文件的 mtime 比较
+            injected_at = time.time()
+
+            t = time.monotonic()
+            resp = requests.post(f"{base}/get_emails", timeout=args.timeout)
+            latencies['get_emails'].append(time.monotonic() - t)
+            resp.raise_for_status()
+            fetched = resp.json()
+            for folder in fetched.get('folders', []):
+                if folder not in finished:
+                    pending.setdefault(folder, injected_at)
+            if fetched.get('skipped'):
+                outcomes['triage_skipped'] = outcomes.get('triage_skipped', 0) + len(fetched['skipped'])
+
+            if args.pipeline:
+                # 流水线模式下 /process_emails 不返回结果，邮件由消费线程处理，以结果文件出现为完成
+                done = time.monotonic()
+                if fetched.get('folders'):
+                    last_progress = done
+                for folder in list(pending):
+                    path = os.path.join(responses_dir, f"{folder}.txt")
+                    if os.path.exists(path):
+                        latencies['email'].append(max(0.0, os.path.getmtime(path) - pending.pop(folder)))
+                        finished.add(folder)
+                        outcomes['completed'] = outcomes.get('completed', 0) + 1
+                        last_progress = done
+                if not count and pending:
+                    if done - last_progress > args.idle_seconds:
+                        break
+                    time.sleep(0.2)
+                if args.max_seconds and done - started > args.max_seconds:
+                    break
+                continue
+
+            t = time.monotonic()
+            resp = requests.post(f"{base}/process_emails", timeout=args.timeout)
+            done = time.monotonic()
+            latencies['process_emails'].append(done - t)
+            resp.raise_for_status()
+            progressed = bool(fetched.get('folders'))
+            for result in resp.json():
+                if result.get('error'):
+                    outcome = 'failed'
+                elif result.get('workflow_status') == 0:
+                    outcome = 'deferred'
+                else:
+                    outcome = 'completed'
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                if outcome == 'completed' and result['folder_name'] in pending:
+                    latencies['email'].append(time.time() - pending.pop(result['folder_name']))
+                    finished.add(result['folder_name'])
+                    progressed = True
+            if not count and not progressed:
+                # 邮件已全部投递且本轮没有任何进展，剩下的都是失败的，避免死循环
+                break
+            if args.max_seconds and done - started > args.max_seconds:
+                break
+        elapsed = time.monotonic() - started
+        metrics_text = requests.get(f"{base}/metrics", timeout=30).text
+        throttle = requests.get(f"{base}/throttle/stats", timeout=30).json()
+        if args.pipeline:
+            pipeline = requests.get(f"{base}/pipeline/status", timeout=30).json()
+        rss = peak_rss_mb(proc.pid)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        for fake in (graph, dify, wecom):
+            fake.stop()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    completed = outcomes.get('completed', 0)
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'keep_workdir')},
+        'emails_injected': injected,
+        'outcomes': outcomes,
+        'unfinished': len(pending),
+        'duration_seconds': round(elapsed, 3),
+        'throughput_emails_per_second': round(completed / elapsed, 3) if elapsed else None,
+        'latency_seconds': {name: summarize(values) for name, values in latencies.items()},
+        'stages': stage_means(metrics_text),
+        'peak_rss_mb': rss,
+        'requests': {'graph': graph.request_counts, 'dify': dify.request_counts, 'wecom': wecom.request_counts},
+        'dify_bytes_received': dify.bytes_received,
+        'wecom_messages_delivered': len(wecom.messages),
+        'throttle': throttle,
+        'pipeline': pipeline,
+        'workdir': workdir if args.keep_workdir else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark against local fake Graph/Dify/WeCom servers.')
+    parser.add_argument('--emails', type=int, default=100, help='total emails to push through the pipeline')
+    parser.add_argument('--batch', type=int, default=50, help='emails per /get_emails round (max 50, the Graph page size)')
+    parser.add_argument('--attachments', type=int, default=1, help='attachments per email')
+    parser.add_argument('--attachment-kb', type=int, default=64, help='size of each attachment in KiB')
+    parser.add_argument('--graph-latency', type=float, default=0.0)
+    parser.add_argument('--dify-latency', type=float, default=0.0)
+    parser.add_argument('--workflow-latency', type=float, default=0.0)
+    parser.add_argument('--wecom-latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of fake requests answered with 429/503')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--notify', action='store_true', help='make workflow outputs trigger WeCom messages')
+    parser.add_argument('--timeout', type=float, default=3600, help='HTTP timeout for each pipeline call')
+    parser.add_argument('--max-seconds', type=float, default=0, help='stop after this long (0 = no limit)')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='run with PIPELINE_MODE and wait for workflow_responses instead of /process_emails results')
+    parser.add_argument('--idle-seconds', type=float, default=120,
+                        help='pipeline mode: give up when no email completes for this long')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--keep-workdir', action='store_true')
+    args = parser.parse_args()
+    if not 1 <= args.batch <= 50:
+        parser.error('--batch must be between 1 and 50')
+
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Micro-benchmarks for the CPU-bound half of the pipeline.
+
+Replays the ``downloaded_emails/*.eml`` corpus plus a few synthetic emails
+(large HTML body, many attachments, CJK-heavy text) through MIME parsing,
+``get_email_folder_name``, ``extract_body`` and ``eml_to_pdf``, and reports
+per-function time and memory allocation as JSON::
+
+    python -m benchmarks.micro --iterations 20 --output micro.json
+
+Timing and allocation are measured in separate passes because tracemalloc
+slows down allocation-heavy code considerably.
+"""
+import os
+import io
+import json
+import time
+import email
+import random
+import argparse
+import tempfile
+import tracemalloc
+from email import policy
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+from datetime import datetime, timezone
+
+from app.main import EMAIL_DOWNLOAD_DIR, extract_body, eml_to_pdf, get_email_folder_name
+
+CJK_SAMPLE = '邮件工作流测试：请于本周五前完成季度报告的审核并反馈意见，谢谢。附件为合同草案与报价单。'
+
+
+def synthetic_emails(scale=1, seed=1):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+
+    def base(subject, sender='Benchmark <bench@example.com>'):
+        msg = EmailMessage()
+        msg['From'] = sender
+        msg['To'] = 'Alex Ma <alex.ma@example.com>'
+        msg['Subject'] = subject
+        msg['Date'] = format_datetime(now)
+        msg['Message-ID'] = make_msgid()
+        return msg
+
+    html = base('Large HTML newsletter')
+    rows = ''.join(
+        f'<tr><td>{i}</td><td><a href="https://example.com/item/{i}">Item {i}</a></td>'
+        f'<td style="color:#333;font-family:Arial">{rng.getrandbits(48):x}</td></tr>'
+        for i in range(4000 * scale))
+    html.set_content(f'<html><body><h1>Weekly digest</h1><table>{rows}</table></body></html>', subtype='html')
+
+    many = base('Many attachments')
+    many.set_content('Please find the documents attached.\n')
+    for i in range(100 * scale):
+        many.add_attachment(rng.randbytes(2048), maintype='application', subtype='octet-stream',
+                            filename=f'document_{i + 1:03d}.bin')
+
+    cjk = base('季度报告审核与合同草案确认 ' * 2, sender='马 亚历克斯 <alex.ma@example.com>')
+    cjk.set_content('\n'.join(CJK_SAMPLE * 4 for _ in range(300 * scale)))
+
+    return {
+        'synthetic:large_html': html.as_bytes(),
+        'synthetic:many_attachments': many.as_bytes(),
+        'synthetic:cjk_text': cjk.as_bytes(),
+    }
+
+
+def corpus_emails(directory):
+    emails = {}
+    if not os.path.isdir(directory):
+        return emails
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.eml'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                emails[f'corpus:{name}'] = f.read()
+    return emails
+
+
+def attachment_names(msg):
+    return [part.get_filename() for part in msg.iter_attachments() if part.get_filename()]
+
+
+def build_cases(raw, workdir):
+    eml_path = os.path.join(workdir, 'case.eml')
+    pdf_path = os.path.join(workdir, 'case.pdf')
+    msg = email.message_from_bytes(raw, policy=policy.default)
+    names = attachment_names(msg)
+
+    def render():
+        with open(eml_path, 'wb') as f:
+            f.write(raw)
+        eml_to_pdf(eml_path, pdf_path, names)
+
+    return {
+        'message_from_binary_file': lambda: email.message_from_binary_file(io.BytesIO(raw), policy=policy.default),
+        'get_email_folder_name': lambda: get_email_folder_name(msg),
+        'extract_body': lambda: extract_body(msg),
+        'eml_to_pdf': render,
+    }
+
+
+def measure(func, iterations):
+    try:
+        func()  # 预热：字体缓存、惰性解析的头部等
+    except Exception as e:
+        # 记录下来而不是中断整个套件，渲染失败本身就是要发现的回归
+        return {'error': f"{type(e).__name__}: {e}"}
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'iterations': iterations,
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3),
+        'p50_ms': round(timings[len(timings) // 2] * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+        'alloc_peak_kb': round((peak - before) / 1024, 1),
+        'alloc_retained_kb': round((after - before) / 1024, 1),
+    }
+
+
+def run(args):
+    emails = {}
+    if not args.synthetic_only:
+        emails.update(corpus_emails(args.corpus))
+    if not args.corpus_only:
+        emails.update(synthetic_emails(args.scale, args.seed))
+    functions = set(args.functions.split(',')) if args.functions else None
+    results = {}
+    totals = {}
+    with tempfile.TemporaryDirectory(prefix='xarl-micro-') as workdir:
+        for case, raw in emails.items():
+            results[case] = {'bytes': len(raw)}
+            for name, func in build_cases(raw, workdir).items():
+                if functions and name not in functions:
+                    continue
+                iterations = max(1, args.iterations // 5) if name == 'eml_to_pdf' else args.iterations
+                stats = measure(func, iterations)
+                results[case][name] = stats
+                total = totals.setdefault(name, {'cases': 0, 'errors': 0, 'mean_ms': 0.0, 'alloc_peak_kb': 0.0})
+                if 'error' in stats:
+                    total['errors'] += 1
+                    continue
+                total['cases'] += 1
+                total['mean_ms'] += stats['mean_ms']
+                total['alloc_peak_kb'] = max(total['alloc_peak_kb'], stats['alloc_peak_kb'])
+    for total in totals.values():
+        total['mean_ms'] = round(total['mean_ms'] / total['cases'], 3) if total['cases'] else None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'summary': totals,
+        'cases': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for MIME parsing, folder naming and PDF rendering.')
+    parser.add_argument('--corpus', default=EMAIL_DOWNLOAD_DIR, help='directory of .eml files to replay')
+    parser.add_argument('--iterations', type=int, default=50, help='timed runs per function (eml_to_pdf runs 1/5 of that)')
+    parser.add_argument('--scale', type=int, default=1, help='size multiplier for the synthetic emails')
+    parser.add_argument('--functions', help='comma-separated subset of functions to run')
+    parser.add_argument('--corpus-only', action='store_true')
+    parser.add_argument('--synthetic-only', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Local stand-in for the Dify file upload and workflow endpoints.
+
+Run it standalone with ``python -m fakes.dify --port 8002`` and point
+``DIFY_BASE_URL`` at ``http://127.0.0.1:8002/v1``.
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+class FakeDify:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, latency_jitter=0.0, workflow_latency=0.0,
+                 error_rate=0.0, retry_after=None, recipient_email=None, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.workflow_latency = workflow_latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        # 设置后工作流输出带上 notification.recipient_email，触发企业微信推送
+        self.recipient_email = recipient_email
+        self.random = random.Random(seed)
+        self.uploads = {}
+        self.request_counts = {}
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-dify', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _outputs(self, inputs):
+        files = [inputs.get('email')] + list(inputs.get('attachments') or [])
+        names = [self.uploads.get(f.get('upload_file_id'), {}).get('name') for f in files if isinstance(f, dict)]
+        outputs = {'result': {'summary': f"Processed {len(names)} file(s)", 'files': names}}
+        # 文本类输入（如本地提取的附件文本）只回显长度
+        texts = {key: len(value) for key, value in inputs.items() if isinstance(value, str)}
+        if texts:
+            outputs['result']['text_inputs'] = texts
+        if self.recipient_email:
+            outputs['notification'] = {'recipient_email': self.recipient_email}
+        return outputs
+
+    # --- HTTP ---
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, headers=None):
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                data = self.rfile.read(length)
+                with fake._lock:
+                    fake.bytes_received += len(data)
+                return data
+
+            def _simulate(self, kind, extra_latency=0.0):
+                with fake._lock:
+                    fake.request_counts[kind] = fake.request_counts.get(kind, 0) + 1
+                delay = fake.latency + extra_latency + fake.random.uniform(0, fake.latency_jitter)
+                if delay:
+                    time.sleep(delay)
+                if fake.error_rate and fake.random.random() < fake.error_rate:
+                    headers = {'Retry-After': str(fake.retry_after)} if fake.retry_after is not None else None
+                    self._send(503, {'code': 'service_unavailable', 'message': 'Fake Dify error'}, headers)
+                    return False
+                return True
+
+            def do_POST(self):
+                path = urlsplit(self.path).path
+                if path.endswith('/files/upload'):
+                    data = self._read()
+                    if not self._simulate('upload'):
+                        return
+                    file_id = str(uuid.uuid4())
+                    name = 'upload'
+                    # multipart 里只取文件名，内容本身不保存
+                    marker = data.find(b'filename="')
+                    if marker >= 0:
+                        end = data.find(b'"', marker + 10)
+                        name = data[marker + 10:end].decode('utf-8', errors='replace')
+                    record = {'id': file_id, 'name': name, 'size': len(data), 'created_at': int(time.time())}
+                    with fake._lock:
+                        fake.uploads[file_id] = record
+                    return self._send(201, record)
+                if path.endswith('/workflows/run'):
+                    body = json.loads(self._read() or b'{}')
+                    started = time.monotonic()
+                    if not self._simulate('workflow', fake.workflow_latency):
+                        return
+                    run_id = str(uuid.uuid4())
+                    return self._send(200, {
+                        'task_id': str(uuid.uuid4()),
+                        'workflow_run_id': run_id,
+                        'data': {
+                            'id': run_id,
+                            'status': 'succeeded',
+                            'outputs': fake._outputs(body.get('inputs') or {}),
+                            'error': None,
+                            'elapsed_time': round(time.monotonic() - started, 3),
+                            'created_at': int(time.time()),
+                        },
+                    })
+                return self._send(404, {'code': 'not_found', 'message': path})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local fake Dify API server.')
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--workflow-latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--recipient-email')
+    args = parser.parse_args()
+    fake = FakeDify(port=args.port, latency=args.latency, workflow_latency=args.workflow_latency,
+                    error_rate=args.error_rate, recipient_email=args.recipient_email)
+    print(f"Fake Dify listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""Local stand-in for the Microsoft Graph mail endpoints used by the app.
+
+Run it standalone with ``python -m fakes.graph --port 8001 --messages 20``
+and point ``GRAPH_BASE_URL`` at ``http://127.0.0.1:8001``.
+"""
+import re
+import json
+import time
+import uuid
+import base64
+import random
+import argparse
+import threading
+from datetime import datetime, timezone, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import requests
+
+MAILBOX_RE = re.compile(r"^/(me|users/[^/]+)(/.*)$")
+FILTER_RE = re.compile(r"receivedDateTime\s+(ge|gt|le|lt)\s+([0-9T:\-\.Z+]+)")
+
+
+def _iso(dt):
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _parse_iso(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class FakeGraph:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                 retry_after=1, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.mailboxes = {}
+        self.changes = {}
+        self.subscriptions = {}
+        self.request_counts = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-graph', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- test data ---
+
+    def add_message(self, mailbox='me', subject='Test', sender='sender@example.com', to='me@example.com',
+                    body='Hello', html=False, attachments=(), received=None, importance='normal', headers=None):
+        message_id = uuid.uuid4().hex
+        received = received or datetime.now(timezone.utc)
+        msg = EmailMessage()
+        msg['From'] = sender
+        msg['To'] = to
+        msg['Subject'] = subject
+        msg['Date'] = format_datetime(received)
+        msg['Message-ID'] = make_msgid()
+        if importance != 'normal':
+            msg['Importance'] = importance
+        for key, value in (headers or {}).items():
+            msg[key] = value
+        msg.set_content(body, subtype='html' if html else 'plain')
+        stored_attachments = []
+        for att in attachments:
+            name, content_type, data = att[0], att[1], att[2]
+            is_inline = att[3] if len(att) > 3 else False
+            maintype, _, subtype = content_type.partition('/')
+            msg.add_attachment(data, maintype=maintype, subtype=subtype or 'octet-stream', filename=name,
+                               disposition='inline' if is_inline else 'attachment')
+            stored_attachments.append({
+                'id': uuid.uuid4().hex,
+                'name': name,
+                'contentType': content_type,
+                'size': len(data),
+                'isInline': is_inline,
+                'data': data,
+            })
+        record = {
+            'id': message_id,
+            'subject': subject,
+            'internetMessageId': msg['Message-ID'],
+            'receivedDateTime': _iso(received),
+            'importance': importance,
+            'from': {'emailAddress': {'address': sender}},
+            'toRecipients': [{'emailAddress': {'address': to}}],
+            'hasAttachments': bool(stored_attachments),
+            'eml': msg.as_bytes(),
+            'attachments': stored_attachments,
+        }
+        with self._lock:
+            self.mailboxes.setdefault(mailbox, {})[message_id] = record
+            self.changes.setdefault(mailbox, []).append(message_id)
+        self._notify(mailbox, message_id)
+        return message_id
+
+    def _notify(self, mailbox, message_id):
+        with self._lock:
+            subscriptions = [s for s in self.subscriptions.values()
+                             if s['mailbox'] == mailbox and _parse_iso(s['expirationDateTime']) > datetime.now(timezone.utc)]
+        for subscription in subscriptions:
+            payload = {'value': [{
+                'subscriptionId': subscription['id'],
+                'clientState': subscription.get('clientState'),
+                'changeType': 'created',
+                'resource': f"Users/{mailbox}/Messages/{message_id}",
+                'resourceData': {'@odata.type': '#Microsoft.Graph.Message', 'id': message_id},
+            }]}
+            threading.Thread(target=self._post_quietly, args=(subscription['notificationUrl'], payload), daemon=True).start()
+
+    @staticmethod
+    def _post_quietly(url, payload):
+        try:
+            requests.post(url, json=payload, timeout=10)
+        except requests.RequestException:
+            pass
+
+    # --- HTTP ---
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=b'', content_type='application/json', headers=None):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def _simulate(self, kind):
+                with fake._lock:
+                    fake.request_counts[kind] = fake.request_counts.get(kind, 0) + 1
+                delay = fake.latency + fake.random.uniform(0, fake.latency_jitter)
+                if delay:
+                    time.sleep(delay)
+                if fake.error_rate and fake.random.random() < fake.error_rate:
+                    self._send(429, {'error': {'code': 'TooManyRequests'}}, headers={'Retry-After': str(fake.retry_after)})
+                    return False
+                return True
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                match = MAILBOX_RE.match(unquote(parts.path))
+                if not match:
+                    return self._send(404, {'error': {'code': 'NotFound'}})
+                prefix, rest = match.group(1), match.group(2)
+                mailbox = prefix.split('/')[-1]
+                if rest.startswith("/mailFolders('inbox')/messages/delta"):
+                    if not self._simulate('delta'):
+                        return
+                    return self._delta(prefix, mailbox, query)
+                if rest == '/messages':
+                    if not self._simulate('list'):
+                        return
+                    return self._list(mailbox, query)
+                segments = rest.strip('/').split('/')
+                message = fake.mailboxes.get(mailbox, {}).get(segments[1]) if len(segments) > 1 else None
+                if message is None:
+                    return self._send(404, {'error': {'code': 'ErrorItemNotFound'}})
+                if len(segments) == 2:
+                    if not self._simulate('message'):
+                        return
+                    return self._send(200, self._metadata(message))
+                if segments[2] == '$value':
+                    if not self._simulate('eml'):
+                        return
+                    return self._send(200, message['eml'], content_type='message/rfc822')
+                if segments[2] == 'attachments' and len(segments) == 3:
+                    if not self._simulate('attachments'):
+                        return
+                    selected = 'contentBytes' in query.get('$select', 'contentBytes')
+                    value = []
+                    for att in message['attachments']:
+                        item = {
+                            '@odata.type': '#microsoft.graph.fileAttachment',
+                            '@odata.mediaContentType': att['contentType'],
+                            'id': att['id'], 'name': att['name'], 'contentType': att['contentType'],
+                            'size': att['size'], 'isInline': att['isInline'],
+                        }
+                        if selected:
+                            item['contentBytes'] = base64.b64encode(att['data']).decode('ascii')
+                        value.append(item)
+                    return self._send(200, {'value': value})
+                if segments[2] == 'attachments' and len(segments) == 5 and segments[4] == '$value':
+                    if not self._simulate('attachment_value'):
+                        return
+                    for att in message['attachments']:
+                        if att['id'] == segments[3]:
+                            return self._send(200, att['data'], content_type=att['contentType'])
+                return self._send(404, {'error': {'code': 'NotFound'}})
+
+            def _metadata(self, message):
+                return {k: v for k, v in message.items() if k not in ('eml', 'attachments')}
+
+            def _list(self, mailbox, query):
+                messages = list(fake.mailboxes.get(mailbox, {}).values())
+                for op, value in FILTER_RE.findall(query.get('$filter', '')):
+                    bound = _parse_iso(value)
+                    compare = {
+                        'ge': lambda d: d >= bound, 'gt': lambda d: d > bound,
+                        'le': lambda d: d <= bound, 'lt': lambda d: d < bound,
+                    }[op]
+                    messages = [m for m in messages if compare(_parse_iso(m['receivedDateTime']))]
+                descending = 'desc' in query.get('$orderby', 'receivedDateTime desc')
+                messages.sort(key=lambda m: m['receivedDateTime'], reverse=descending)
+                top = int(query.get('$top', '10'))
+                skip = int(query.get('$skip', '0'))
+                page = messages[skip:skip + top]
+                body = {'value': [self._metadata(m) for m in page]}
+                if skip + top < len(messages):
+                    next_query = dict(query, **{'$skip': str(skip + top)})
+                    body['@odata.nextLink'] = f"{fake.url}{urlsplit(self.path).path}?" + '&'.join(
+                        f"{k}={v}" for k, v in next_query.items())
+                return self._send(200, body)
+
+            def _delta(self, prefix, mailbox, query):
+                changes = fake.changes.get(mailbox, [])
+                start = int(query.get('$deltatoken', '0'))
+                value = [self._metadata(fake.mailboxes[mailbox][mid]) for mid in changes[start:]]
+                return self._send(200, {
+                    'value': value,
+                    '@odata.deltaLink': f"{fake.url}/{prefix}/mailFolders('inbox')/messages/delta?$deltatoken={len(changes)}",
+                })
+
+            def do_POST(self):
+                if urlsplit(self.path).path != '/subscriptions':
+                    return self._send(404, {'error': {'code': 'NotFound'}})
+                body = self._body()
+                # 与真实 Graph 一样，先对 notificationUrl 做验证握手
+                token = uuid.uuid4().hex
+                try:
+                    resp = requests.post(body['notificationUrl'], params={'validationToken': token}, timeout=10)
+                except requests.RequestException:
+                    resp = None
+                if resp is None or resp.status_code != 200 or resp.text != token:
+                    return self._send(400, {'error': {'code': 'ValidationError'}})
+                resource = body.get('resource', '')
+                mailbox = 'me' if resource.startswith('me/') else resource.split('/')[1]
+                subscription = dict(body, id=uuid.uuid4().hex, mailbox=mailbox)
+                with fake._lock:
+                    fake.subscriptions[subscription['id']] = subscription
+                return self._send(201, {k: v for k, v in subscription.items() if k != 'mailbox'})
+
+            def do_PATCH(self):
+                subscription_id = urlsplit(self.path).path.rsplit('/', 1)[-1]
+                with fake._lock:
+                    subscription = fake.subscriptions.get(subscription_id)
+                    if subscription is None:
+                        return self._send(404, {'error': {'code': 'ResourceNotFound'}})
+                    subscription['expirationDateTime'] = self._body()['expirationDateTime']
+                return self._send(200, {k: v for k, v in subscription.items() if k != 'mailbox'})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local fake Microsoft Graph mail server.')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--messages', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeGraph(port=args.port, latency=args.latency, error_rate=args.error_rate)
+    now = datetime.now(timezone.utc)
+    for i in range(args.messages):
+        fake.add_message(subject=f'Test message {i + 1}', body=f'Body of message {i + 1}',
+                         received=now - timedelta(minutes=args.messages - i))
+    print(f"Fake Graph listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Local stand-in for the WeCom (企业微信) app message endpoints.
+
+Run it standalone with ``python -m fakes.wecom --port 8003`` and point
+``WECOM_BASE_URL`` at ``http://127.0.0.1:8003``.
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class FakeWeCom:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, latency_jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.tokens = set()
+        self.messages = []
+        self.request_counts = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-wecom', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- HTTP ---
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, body):
+                # 企业微信的业务错误也以 HTTP 200 返回，靠 errcode 区分
+                body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _simulate(self, kind):
+                with fake._lock:
+                    fake.request_counts[kind] = fake.request_counts.get(kind, 0) + 1
+                delay = fake.latency + fake.random.uniform(0, fake.latency_jitter)
+                if delay:
+                    time.sleep(delay)
+                if fake.error_rate and fake.random.random() < fake.error_rate:
+                    self._send({'errcode': -1, 'errmsg': 'system busy'})
+                    return False
+                return True
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if parts.path != '/cgi-bin/gettoken':
+                    return self._send({'errcode': 404, 'errmsg': 'not found'})
+                if not self._simulate('gettoken'):
+                    return
+                token = uuid.uuid4().hex
+                with fake._lock:
+                    fake.tokens.add(token)
+                return self._send({'errcode': 0, 'errmsg': 'ok', 'access_token': token, 'expires_in': 7200})
+
+            def do_POST(self):
+                parts = urlsplit(self.path)
+                if parts.path != '/cgi-bin/message/send':
+                    return self._send({'errcode': 404, 'errmsg': 'not found'})
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if not self._simulate('send'):
+                    return
+                token = parse_qs(parts.query).get('access_token', [''])[0]
+                if token not in fake.tokens:
+                    return self._send({'errcode': 40014, 'errmsg': 'invalid access_token'})
+                with fake._lock:
+                    fake.messages.append(payload)
+                return self._send({'errcode': 0, 'errmsg': 'ok', 'msgid': uuid.uuid4().hex})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local fake WeCom app message server.')
+    parser.add_argument('--port', type=int, default=8003)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeWeCom(port=args.port, latency=args.latency, error_rate=args.error_rate)
+    print(f"Fake WeCom listening on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
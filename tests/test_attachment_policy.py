@@ -0,0 +1,67 @@
+from app.attachment_policy import (AttachmentPolicy, effective_content_type, REASON_INLINE, REASON_TYPE,
+                                   REASON_TOO_SMALL, REASON_TOO_LARGE, REASON_BUDGET, REASON_REFERENCE)
+
+
+def attachment(name, content_type='application/pdf', size=10_000, **extra):
+    return dict(name=name, contentType=content_type, size=size, **extra)
+
+
+def make_policy(**kwargs):
+    options = dict(skip_inline=True, allow_types=[], deny_types=['video/', 'audio/'], min_bytes=1024,
+                   max_bytes=100_000, email_budget=150_000)
+    options.update(kwargs)
+    return AttachmentPolicy(**options)
+
+
+def reasons(policy, attachments):
+    kept, skipped = policy.select(attachments)
+    return [att['name'] for att in kept], {item['name']: item['reason'] for item in skipped}
+
+
+def test_skip_reasons():
+    kept, skipped = reasons(make_policy(), [
+        attachment('link', **{'@odata.type': '#microsoft.graph.referenceAttachment'}),
+        attachment('logo.png', 'image/png', isInline=True),
+        attachment('clip.mp4', 'video/mp4'),
+        attachment('pixel.gif', 'image/gif', size=43),
+        attachment('huge.pdf', size=200_000),
+        attachment('report.pdf'),
+    ])
+    assert kept == ['report.pdf']
+    assert skipped == {'link': REASON_REFERENCE, 'logo.png': REASON_INLINE, 'clip.mp4': REASON_TYPE,
+                       'pixel.gif': REASON_TOO_SMALL, 'huge.pdf': REASON_TOO_LARGE}
+
+
+def test_inline_documents_and_small_text_are_kept():
+    kept, skipped = reasons(make_policy(), [
+        attachment('inline.pdf', isInline=True),
+        attachment('invite.ics', 'text/calendar', size=300),
+    ])
+    assert kept == ['inline.pdf', 'invite.ics'] and skipped == {}
+
+
+def test_allow_list_and_octet_stream_guess():
+    assert effective_content_type('clip.mp3', 'application/octet-stream') == 'audio/mpeg'
+    kept, skipped = reasons(make_policy(allow_types=['application/pdf', 'image/']), [
+        attachment('a.pdf'),
+        attachment('sheet.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+        attachment('song.mp3', 'application/octet-stream'),
+    ])
+    assert kept == ['a.pdf']
+    assert skipped == {'sheet.xlsx': REASON_TYPE, 'song.mp3': REASON_TYPE}
+
+
+def test_budget_keeps_original_order():
+    kept, skipped = reasons(make_policy(), [
+        attachment('first.pdf', size=90_000),
+        attachment('second.pdf', size=90_000),
+        attachment('third.pdf', size=50_000),
+    ])
+    assert kept == ['first.pdf', 'third.pdf']
+    assert skipped == {'second.pdf': REASON_BUDGET}
+
+
+def test_stats_count_reasons():
+    policy = make_policy()
+    policy.select([attachment('clip.mp4', 'video/mp4'), attachment('song.ogg', 'audio/ogg')])
+    assert policy.stats() == {'skipped': {REASON_TYPE: 2}}
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+import requests
+
+from app.circuit import (CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, ServiceUnavailableError,
+                         CLOSED, OPEN, HALF_OPEN)
+
+
+def ok():
+    return 'ok'
+
+
+def raise_(error):
+    def func():
+        raise error
+    return func
+
+
+def open_breaker(reset_seconds=60):
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_seconds=reset_seconds)
+    for _ in range(2):
+        with pytest.raises(ServiceUnavailableError):
+            breaker.call(raise_(ServiceUnavailableError('503')))
+    return breaker
+
+
+def test_opens_after_threshold_and_rejects():
+    breaker = open_breaker()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(ok)
+    assert breaker.counters['rejected'] == 1
+
+
+def test_network_errors_count_as_failures():
+    breaker = CircuitBreaker('test', failure_threshold=1)
+    with pytest.raises(requests.ConnectionError):
+        breaker.call(raise_(requests.ConnectionError('refused')))
+    assert breaker.state == OPEN
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker('test', failure_threshold=2)
+    with pytest.raises(ServiceUnavailableError):
+        breaker.call(raise_(ServiceUnavailableError('503')))
+    assert breaker.call(ok) == 'ok'
+    with pytest.raises(ServiceUnavailableError):
+        breaker.call(raise_(ServiceUnavailableError('503')))
+    assert breaker.state == CLOSED
+
+
+def test_half_open_success_closes():
+    breaker = open_breaker(reset_seconds=0.05)
+    time.sleep(0.06)
+    assert breaker.snapshot()['state'] == HALF_OPEN
+    assert breaker.call(ok) == 'ok'
+    assert breaker.state == CLOSED
+
+
+def test_half_open_failure_reopens():
+    breaker = open_breaker(reset_seconds=0.05)
+    time.sleep(0.06)
+    with pytest.raises(ServiceUnavailableError):
+        breaker.call(raise_(ServiceUnavailableError('503')))
+    assert breaker.state == OPEN
+
+
+def test_half_open_allows_a_single_trial():
+    breaker = open_breaker(reset_seconds=0.05)
+    time.sleep(0.06)
+    breaker._before_call()
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError):
+        breaker.call(ok)
+
+
+def test_half_open_timeout_does_not_close():
+    breaker = open_breaker(reset_seconds=0.05)
+    time.sleep(0.06)
+    with pytest.raises(DeadlineExceeded):
+        breaker.call(raise_(DeadlineExceeded('Deadline exceeded')))
+    assert breaker.state == HALF_OPEN
+    # 超时的试探不占位，下一次调用可以继续试探
+    assert not breaker.is_open()
+    assert breaker.call(ok) == 'ok'
+    assert breaker.state == CLOSED
+
+
+def test_unrelated_errors_keep_state():
+    breaker = CircuitBreaker('test', failure_threshold=2)
+    with pytest.raises(ServiceUnavailableError):
+        breaker.call(raise_(ServiceUnavailableError('503')))
+    with pytest.raises(ValueError):
+        breaker.call(raise_(ValueError('bad input')))
+    assert breaker.failures == 1
+    with pytest.raises(ServiceUnavailableError):
+        breaker.call(raise_(ServiceUnavailableError('503')))
+    assert breaker.state == OPEN
+
+
+def test_deadline_timeout_and_share():
+    assert Deadline(None).timeout(10) == 10
+    assert Deadline(None).share(4).remaining() is None
+    deadline = Deadline(100)
+    assert deadline.timeout(10) == 10
+    assert deadline.share(4).remaining() == pytest.approx(25, abs=0.5)
+    assert deadline.share(100, minimum=30).remaining() == pytest.approx(30, abs=0.5)
+    with pytest.raises(DeadlineExceeded):
+        Deadline(0).timeout(10)
@@ -0,0 +1,74 @@
+import json
+
+from app import graph_notifications
+from app.graph_notifications import GraphNotifications
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data or {}
+        self.text = json.dumps(self.data)
+
+    def json(self):
+        return self.data
+
+
+def make_notifications(tmp_path, monkeypatch, responses, **kwargs):
+    monkeypatch.setattr(graph_notifications, 'GRAPH_DELTA_FILE', str(tmp_path / 'graph_delta.json'))
+    monkeypatch.setattr(graph_notifications.http, 'get', lambda url, **kw: responses.pop(0))
+    return GraphNotifications('https://graph.example', {}, notification_url='https://hook.example',
+                              pending_file=str(tmp_path / 'state' / 'graph_pending.json'), **kwargs)
+
+
+def test_delta_skips_old_and_processed_messages(tmp_path, monkeypatch):
+    (tmp_path / 'graph_delta.json').write_text(json.dumps({'deltaLink': 'https://graph.example/delta?token=1'}))
+    changes = {'value': [{'id': 'old', 'receivedDateTime': '2024-01-01T09:00:00Z'},
+                         {'id': 'done', 'receivedDateTime': '2024-01-01T11:00:00Z'},
+                         {'id': 'gone', '@removed': {'reason': 'deleted'}},
+                         {'id': 'new', 'receivedDateTime': '2024-01-01T11:00:00Z'}],
+               '@odata.deltaLink': 'https://graph.example/delta?token=2'}
+    notifications = make_notifications(tmp_path, monkeypatch, [FakeResponse(200, changes)],
+                                       is_new=lambda msg: msg['receivedDateTime'] >= '2024-01-01T10:00:00Z',
+                                       processed_ids=lambda: {'done'})
+    # 标记已读、移动等变更也会出现在 delta 里，只有新邮件入队
+    assert notifications.delta_poll() == 1
+    assert notifications.take_pending(10) == ['new']
+
+
+def test_expired_delta_without_saved_link_does_not_crash(tmp_path, monkeypatch):
+    notifications = make_notifications(tmp_path, monkeypatch, [FakeResponse(410, {'error': 'syncStateNotFound'})])
+    assert notifications.delta_poll() == 0
+    assert not (tmp_path / 'graph_delta.json').exists()
+
+
+def test_expired_delta_link_rebuilds_baseline(tmp_path, monkeypatch):
+    (tmp_path / 'graph_delta.json').write_text(json.dumps({'deltaLink': 'https://graph.example/delta?token=1'}))
+    baseline = {'value': [{'id': 'a', 'receivedDateTime': '2024-01-01T11:00:00Z'}],
+                '@odata.deltaLink': 'https://graph.example/delta?token=2'}
+    notifications = make_notifications(tmp_path, monkeypatch, [FakeResponse(410), FakeResponse(200, baseline)])
+    assert notifications.delta_poll() == 0
+    assert json.loads((tmp_path / 'graph_delta.json').read_text())['deltaLink'].endswith('token=2')
+
+
+def test_pending_and_inflight_ids_survive_restart(tmp_path, monkeypatch):
+    notifications = make_notifications(tmp_path, monkeypatch, [])
+    for message_id in ('a', 'b', 'c'):
+        notifications.enqueue(message_id)
+    assert notifications.take_pending(2) == ['a', 'b']
+    notifications.ack('a')
+    restarted = make_notifications(tmp_path, monkeypatch, [])
+    # 下载中的 b 在重启前没有完成，和待下载的 c 一起重新入队
+    assert restarted.take_pending(10) == ['b', 'c']
+
+
+def test_legacy_delta_file_is_read_and_replaced(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'graph_delta.json').write_text(json.dumps({'deltaLink': 'https://graph.example/delta?token=1'}))
+    state_file = str(tmp_path / 'state' / 'graph_delta.json')
+    monkeypatch.setattr(graph_notifications, 'LEGACY_GRAPH_FILES', {state_file: 'graph_delta.json'})
+    changes = {'value': [{'id': 'new'}], '@odata.deltaLink': 'https://graph.example/delta?token=2'}
+    notifications = make_notifications(tmp_path, monkeypatch, [FakeResponse(200, changes)])
+    monkeypatch.setattr(graph_notifications, 'GRAPH_DELTA_FILE', state_file)
+    assert notifications.delta_poll() == 1
+    assert json.loads((tmp_path / 'state' / 'graph_delta.json').read_text())['deltaLink'].endswith('token=2')
@@ -0,0 +1,132 @@
+import time
+import threading
+
+from app.leases import LeaseStore
+
+
+def make_store(tmp_path, worker_id, ttl=300):
+    return LeaseStore(path=str(tmp_path / 'state' / 'leases.db'), worker_id=worker_id, ttl=ttl, enabled=True)
+
+
+def test_disabled_store_claims_in_process(tmp_path):
+    store = LeaseStore(path=str(tmp_path / 'leases.db'), worker_id='a', enabled=False)
+    assert store.claim('message:1')
+    assert not store.claim('message:1')
+    store.complete('message:1')
+    assert store.claim('message:1')
+    assert not store.is_done('message:1')
+    assert not (tmp_path / 'leases.db').exists()
+
+
+def test_claim_is_exclusive_until_released(tmp_path):
+    a, b = make_store(tmp_path, 'a'), make_store(tmp_path, 'b')
+    assert a.claim('group:x')
+    assert not b.claim('group:x')
+    assert b.counters['contended'] == 1
+    a.release('group:x')
+    assert b.claim('group:x')
+    assert 'group:x' in b.held and 'group:x' not in a.held
+
+
+def test_completed_keys_are_never_claimed_again(tmp_path):
+    a, b = make_store(tmp_path, 'a'), make_store(tmp_path, 'b')
+    assert a.claim('message:1')
+    a.complete('message:1')
+    assert a.is_done('message:1') and b.is_done('message:1')
+    assert not a.claim('message:1')
+    assert not b.claim('message:1')
+
+
+def test_same_worker_cannot_claim_held_lease(tmp_path):
+    a = make_store(tmp_path, 'a')
+    assert a.claim('group:x')
+    # 回填和实时拉取共用一个进程，第二次认领必须失败
+    assert not a.claim('group:x')
+    assert a.counters == dict(a.counters, claimed=1, contended=1)
+    a.release('group:x')
+    assert a.claim('group:x')
+
+
+def test_restarted_worker_takes_over_its_stale_lease(tmp_path):
+    assert make_store(tmp_path, 'a').claim('group:x')
+    restarted = make_store(tmp_path, 'a')
+    assert restarted.claim('group:x')
+    assert 'group:x' in restarted.held
+
+
+def test_threads_of_one_worker_have_one_winner(tmp_path):
+    store = make_store(tmp_path, 'a')
+    store.claim('warmup')
+    barrier = threading.Barrier(8)
+    wins = []
+
+    def worker():
+        barrier.wait()
+        if store.claim('message:1'):
+            wins.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(wins) == 1
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    a, b = make_store(tmp_path, 'a', ttl=0.05), make_store(tmp_path, 'b', ttl=0.05)
+    assert a.claim('group:x')
+    time.sleep(0.1)
+    assert b.claim('group:x')
+    assert b.counters['reclaimed'] == 1
+    # 原持有者晚到的完成不生效，记为丢失
+    a.complete('group:x')
+    assert a.counters['lost'] == 1
+    assert not a.is_done('group:x')
+    b.complete('group:x')
+    assert b.is_done('group:x')
+
+
+def test_renew_keeps_lease_alive(tmp_path):
+    a, b = make_store(tmp_path, 'a', ttl=0.2), make_store(tmp_path, 'b', ttl=0.2)
+    assert a.claim('group:x')
+    for _ in range(3):
+        time.sleep(0.1)
+        a.renew()
+    assert not b.claim('group:x')
+
+
+def test_concurrent_claims_have_one_winner(tmp_path):
+    stores = [make_store(tmp_path, f'w{i}') for i in range(8)]
+    stores[0].claim('warmup')
+    barrier = threading.Barrier(len(stores))
+    wins = []
+
+    def worker(store):
+        barrier.wait()
+        if store.claim('group:contended'):
+            wins.append(store.worker_id)
+
+    threads = [threading.Thread(target=worker, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(wins) == 1
+
+
+def test_stop_releases_held_leases(tmp_path):
+    a, b = make_store(tmp_path, 'a'), make_store(tmp_path, 'b')
+    assert a.claim('group:x')
+    a.stop()
+    assert b.claim('group:x')
+
+
+def test_stats_counts_store_rows(tmp_path):
+    a = make_store(tmp_path, 'a')
+    a.claim('group:x')
+    a.claim('group:y')
+    a.complete('group:y')
+    stats = a.stats()
+    assert stats['held'] == 1
+    assert stats['store'] == {'done': 1, 'active': 1, 'expired': 0}
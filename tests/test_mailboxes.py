@@ -0,0 +1,222 @@
+import json
+
+import pytest
+
+from app import main
+from app.graph_notifications import GraphNotifications
+from app.mailboxes import Mailbox, MailboxRegistry, parse_graph_datetime
+
+
+def message(message_id, received):
+    return {'id': message_id, 'receivedDateTime': received}
+
+
+def make_registry(tmp_path, ids=('me',), max_attempts=3):
+    return MailboxRegistry([Mailbox(mailbox_id, 'token') for mailbox_id in ids],
+                           state_file=str(tmp_path / 'state' / 'mailbox_cursors.json'), max_attempts=max_attempts)
+
+
+def test_advance_stops_at_oldest_unchosen(tmp_path):
+    registry = make_registry(tmp_path)
+    emails = [message('a', '2024-01-01T10:00:00Z'), message('b', '2024-01-01T11:00:00Z'),
+              message('c', '2024-01-01T12:00:00Z')]
+    lag = registry.advance('me', emails, {'a', 'c'})
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T11:00:00Z')
+    assert lag > 0
+    # 游标之后已下载的邮件不会再次被当作新邮件
+    assert not registry.is_new('me', emails[2])
+    assert registry.is_new('me', emails[1])
+    assert not registry.is_new('me', message('old', '2024-01-01T09:00:00Z'))
+
+
+def test_advance_moves_to_latest_when_all_chosen(tmp_path):
+    registry = make_registry(tmp_path)
+    emails = [message('a', '2024-01-01T10:00:00Z'), message('b', '2024-01-01T11:00:00Z')]
+    assert registry.advance('me', emails, {'a', 'b'}) == 0.0
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T11:00:00Z')
+    # 与游标同一时刻的邮件仍按 id 去重
+    assert not registry.is_new('me', emails[1])
+    assert registry.is_new('me', message('c', '2024-01-01T11:00:00Z'))
+
+
+def test_advance_without_progress_keeps_cursor(tmp_path):
+    registry = make_registry(tmp_path)
+    registry.advance('me', [message('a', '2024-01-01T10:00:00Z')], {'a'})
+    registry.advance('me', [], set())
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T10:00:00Z')
+
+
+def test_cursors_persist_in_state_dir(tmp_path):
+    registry = make_registry(tmp_path)
+    registry.advance('me', [message('a', '2024-01-01T10:00:00Z')], {'a'})
+    assert (tmp_path / 'state' / 'mailbox_cursors.json').exists()
+    reloaded = make_registry(tmp_path)
+    assert reloaded.cursor('me') == parse_graph_datetime('2024-01-01T10:00:00Z')
+
+
+def test_legacy_cursor_file_is_migrated(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'run_log.txt').write_text('2024-01-01T08:00:00+00:00')
+    registry = MailboxRegistry([Mailbox('me', 'token')], state_file=str(tmp_path / 'state' / 'cursors.json'),
+                               legacy_cursor_file='run_log.txt')
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T08:00:00Z')
+    (tmp_path / 'mailbox_cursors.json').write_text(json.dumps({'me': {'cursor': '2024-02-01T00:00:00Z', 'fetched': {}}}))
+    registry = MailboxRegistry([Mailbox('me', 'token')], state_file=str(tmp_path / 'state' / 'cursors.json'),
+                               legacy_cursor_file='run_log.txt')
+    assert registry.cursor('me') == parse_graph_datetime('2024-02-01T00:00:00Z')
+
+
+def test_select_round_robins_and_rotates(tmp_path):
+    registry = make_registry(tmp_path, ids=('a', 'b'))
+    candidates = {'a': [message(f'a{i}', '2024-01-01T10:00:00Z') for i in range(5)],
+                  'b': [message('b0', '2024-01-01T10:00:00Z')]}
+    chosen = registry.select(candidates, 3, lambda m: m['id'])
+    assert [mailbox_id for mailbox_id, _ in chosen] == ['a', 'b', 'a']
+    chosen = registry.select(candidates, 3, lambda m: m['id'])
+    assert [mailbox_id for mailbox_id, _ in chosen] == ['b', 'a', 'a']
+
+
+def test_failures_quarantine_after_max_attempts(tmp_path):
+    registry = make_registry(tmp_path, max_attempts=2)
+    assert not registry.record_failure('me', 'bad', IndexError('list index out of range'))
+    assert registry.stats()['me']['failing']['bad']['attempts'] == 1
+    assert registry.record_failure('me', 'bad', IndexError('list index out of range'))
+    stats = make_registry(tmp_path)._load()['me']
+    assert 'bad' not in stats['failures']
+    assert stats['quarantined']['bad']['error'] == 'IndexError: list index out of range'
+
+
+def test_clear_failure_resets_attempts(tmp_path):
+    registry = make_registry(tmp_path, max_attempts=2)
+    registry.record_failure('me', 'flaky', RuntimeError('HTTP 503'))
+    registry.clear_failure('me', 'flaky')
+    assert not registry.record_failure('me', 'flaky', RuntimeError('HTTP 503'))
+
+
+@pytest.fixture
+def inbox(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path, max_attempts=3)
+    emails = [message('good-1', '2024-01-01T10:00:00Z'), message('poison', '2024-01-01T10:05:00Z'),
+              message('good-2', '2024-01-01T10:10:00Z')]
+    fetched = []
+
+    def fake_fetch(email_obj, mailbox):
+        if email_obj['id'] == 'poison':
+            raise IndexError('list index out of range')
+        fetched.append(email_obj['id'])
+        return email_obj['id'], main.ROUTE_FULL, None
+
+    monkeypatch.setattr(main, 'mailboxes', registry)
+    monkeypatch.setattr(main, 'list_emails', lambda mailbox: [m for m in emails if registry.is_new(mailbox.id, m)])
+    monkeypatch.setattr(main, 'fetch_claimed', fake_fetch)
+    return registry, fetched
+
+
+def test_poison_message_does_not_abort_batch(inbox):
+    registry, fetched = inbox
+    result = main._get_emails()
+    assert sorted(result['folders']) == ['good-1', 'good-2']
+    assert result['failed'] == [{'id': 'poison', 'mailbox': 'me', 'error': 'list index out of range',
+                                 'quarantined': False}]
+    # 游标停在失败的邮件上，下一轮重试
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T10:05:00Z')
+    assert sorted(fetched) == ['good-1', 'good-2']
+
+
+def test_poison_message_is_quarantined_and_cursor_moves_on(inbox):
+    registry, fetched = inbox
+    for _ in range(2):
+        result = main._get_emails()
+        assert result['failed'][0]['quarantined'] is False
+    result = main._get_emails()
+    assert result['failed'][0]['quarantined'] is True
+    # 本轮只列到隔离的邮件，游标推进到它为止；上一轮已下载的 good-2 仍按 id 去重
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T10:05:00Z')
+    assert not registry.is_new('me', message('good-2', '2024-01-01T10:10:00Z'))
+    assert 'poison' in registry.stats()['me']['quarantined']
+    assert main._get_emails()['folders'] == []
+    assert sorted(fetched) == ['good-1', 'good-2']
+
+
+def test_advance_ignores_later_fetches_from_earlier_rounds(tmp_path):
+    registry = make_registry(tmp_path)
+    x, y, z = (message('x', '2024-01-01T10:00:00Z'), message('y', '2024-01-01T10:02:00Z'),
+               message('z', '2024-01-01T10:05:00Z'))
+    registry.advance('me', [x, y, z], {'x', 'z'})
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T10:02:00Z')
+    # 本轮只列到 y：游标停在 y，不能跳到上一轮下载的 z，否则 10:02 到 10:05 之间晚到的邮件会丢
+    registry.advance('me', [y], {'y'})
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T10:02:00Z')
+    assert registry.is_new('me', message('late', '2024-01-01T10:03:00Z'))
+    assert not registry.is_new('me', z)
+
+
+def test_partial_fetch_keeps_unfetched_listed_message(inbox_by_priority):
+    registry, listing, _ = inbox_by_priority
+    result = main._get_emails()
+    assert sorted(result['folders']) == ['x', 'z']
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T10:02:00Z')
+    assert registry.is_new('me', listing[1])
+
+
+def test_failed_listing_does_not_advance_cursor(inbox_by_priority, monkeypatch):
+    registry, listing, fetched = inbox_by_priority
+    main._get_emails()
+    monkeypatch.setattr(main, 'list_emails', lambda mailbox: None)
+    result = main._get_emails()
+    assert result['folders'] == []
+    assert registry.cursor('me') == parse_graph_datetime('2024-01-01T10:02:00Z')
+    assert registry.is_new('me', listing[1])
+    monkeypatch.setattr(main, 'list_emails', lambda mailbox: [m for m in listing if registry.is_new(mailbox.id, m)])
+    assert main._get_emails()['folders'] == ['y']
+    assert sorted(fetched) == ['x', 'y', 'z']
+
+
+@pytest.fixture
+def inbox_by_priority(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path)
+    listing = [dict(message('x', '2024-01-01T10:00:00Z'), importance='high'),
+               message('y', '2024-01-01T10:02:00Z'),
+               dict(message('z', '2024-01-01T10:05:00Z'), importance='high')]
+    fetched = []
+
+    def fake_fetch(email_obj, mailbox):
+        fetched.append(email_obj['id'])
+        return email_obj['id'], main.ROUTE_FULL, None
+
+    monkeypatch.setattr(main, 'mailboxes', registry)
+    monkeypatch.setattr(main, 'EMAIL_DEFAULT_EMAIL_COUNT', 2)
+    monkeypatch.setattr(main, 'list_emails', lambda mailbox: [m for m in listing if registry.is_new(mailbox.id, m)])
+    monkeypatch.setattr(main, 'fetch_claimed', fake_fetch)
+    return registry, listing, fetched
+
+
+def test_push_mode_still_lists_other_mailboxes(tmp_path, monkeypatch):
+    registry = make_registry(tmp_path, ids=('me', 'shared'))
+    notifications = GraphNotifications('https://graph.example', {}, notification_url='https://hook.example',
+                                       pending_file=str(tmp_path / 'graph_pending.json'))
+    for message_id in ('n1', 'n2', 'n3'):
+        notifications.enqueue(message_id)
+    listed = []
+    shared = [message('s1', '2024-01-01T10:00:00Z'), message('s2', '2024-01-01T10:01:00Z')]
+
+    def fake_list(mailbox):
+        listed.append(mailbox.id)
+        return [m for m in shared if registry.is_new(mailbox.id, m)]
+
+    monkeypatch.setattr(main, 'mailboxes', registry)
+    monkeypatch.setattr(main, 'graph_notifications', notifications)
+    monkeypatch.setattr(notifications, 'needs_delta_poll', lambda: False)
+    monkeypatch.setattr(main, 'EMAIL_DEFAULT_EMAIL_COUNT', 3)
+    monkeypatch.setattr(main, 'list_emails', fake_list)
+    monkeypatch.setattr(main, 'fetch_claimed', lambda email_obj, mailbox: (email_obj['id'], main.ROUTE_FULL, None))
+    result = main._get_emails()
+    # 默认邮箱走通知队列，不列举；其他邮箱按游标列举，名额轮转分配
+    assert listed == ['shared']
+    assert sorted(result['folders']) == ['n1', 'n2', 's1']
+    assert registry.cursor('shared') == parse_graph_datetime('2024-01-01T10:01:00Z')
+    # 让出名额的通知回到队首，已下载的不会再入队
+    assert list(notifications._pending) == ['n3']
+    assert not notifications.enqueue('n1')
+    result = main._get_emails()
+    assert sorted(result['folders']) == ['n3', 's2']
@@ -0,0 +1,88 @@
+import time
+import threading
+from types import SimpleNamespace
+
+from app.pipeline import Pipeline
+from app.priority import PriorityWorkQueue, NORMAL
+
+
+def make_group(name):
+    return {'folder_name': name, 'priority': NORMAL, 'enqueued_at': time.time()}
+
+
+def make_pipeline(handle, groups, **kwargs):
+    queue = PriorityWorkQueue()
+    pipeline = None
+
+    def enqueue(group):
+        if group['folder_name'] in queue or pipeline.is_active(group['folder_name']):
+            return False
+        return queue.push(group['folder_name'], group, group['priority'], group['enqueued_at'])
+
+    pipeline = Pipeline(queue, enqueue, handle, lambda: [make_group(name) for name in groups], workers=1,
+                        capacity=10, drain_seconds=5, enabled=True, **kwargs)
+    return pipeline
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_failed_group_is_retried_with_backoff():
+    calls = []
+
+    def handle(group):
+        calls.append(group['folder_name'])
+        return SimpleNamespace(error='boom' if len(calls) < 3 else None)
+
+    pipeline = make_pipeline(handle, [], retry_delay=0.05, max_retry_delay=0.1)
+    pipeline.start()
+    try:
+        pipeline.submit(make_group('a'))
+        assert wait_until(lambda: pipeline.status()['counters']['processed'] == 1)
+    finally:
+        pipeline.stop()
+    assert calls == ['a', 'a', 'a']
+    assert pipeline.status()['counters']['errors'] == 2
+
+
+def test_deferred_group_is_not_enqueued_twice():
+    calls = []
+    started = threading.Event()
+
+    def handle(group):
+        calls.append(group['folder_name'])
+        started.set()
+        if len(calls) == 1:
+            group['deferred'] = True
+            return SimpleNamespace(error='deferred')
+        return SimpleNamespace(error=None)
+
+    pipeline = make_pipeline(handle, ['a'], retry_delay=0.3)
+    pipeline.start()
+    try:
+        assert wait_until(lambda: pipeline.status()['delayed'] == 1)
+        # 推迟期间的补扫不能把同一个邮件组再放进队列
+        assert pipeline.recover() == 0
+        assert pipeline.status()['queued'] == 0
+        assert wait_until(lambda: pipeline.status()['counters']['processed'] == 1)
+    finally:
+        pipeline.stop()
+    assert calls == ['a', 'a']
+    assert pipeline.status()['counters']['deferred'] == 1
+
+
+def test_claimed_elsewhere_is_dropped():
+    pipeline = make_pipeline(lambda group: None, [])
+    pipeline.start()
+    try:
+        pipeline.submit(make_group('a'))
+        assert wait_until(lambda: pipeline.status()['counters']['claimed_elsewhere'] == 1)
+        assert pipeline.status()['delayed'] == 0
+    finally:
+        pipeline.stop()
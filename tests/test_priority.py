@@ -0,0 +1,78 @@
+from app.priority import PriorityRules, PriorityWorkQueue, URGENT, HIGH, NORMAL, LOW
+
+
+def make_queue(aging_seconds=300):
+    rules = PriorityRules(sender_rules={'bigcustomer.com': URGENT}, recipient_rules={'boss@corp.com': HIGH},
+                          aging_seconds=aging_seconds)
+    return PriorityWorkQueue(rules)
+
+
+def test_level_from_rules_and_importance():
+    rules = make_queue().rules
+    assert rules.level('a@mail.bigcustomer.com') == URGENT
+    assert rules.level('x@other.com', ['boss@corp.com']) == HIGH
+    assert rules.level('x@other.com') == NORMAL
+    assert rules.level('x@other.com', importance='high') == HIGH
+    assert rules.level('x@other.com', importance='low') == LOW
+    assert rules.level('x@other.com', bulk=True) == LOW
+    # 命中规则的邮件不会因为 bulk 或低重要性被降到 low
+    assert rules.level('a@bigcustomer.com', bulk=True) == URGENT
+
+
+def test_higher_level_pops_first():
+    queue = make_queue()
+    queue.push('low', 'low', LOW, 1000.0)
+    queue.push('urgent', 'urgent', URGENT, 1000.0)
+    queue.push('normal', 'normal', NORMAL, 1000.0)
+    assert [queue.pop(), queue.pop(), queue.pop()] == ['urgent', 'normal', 'low']
+    assert queue.pop() is None
+
+
+def test_aging_promotes_old_items():
+    queue = make_queue(aging_seconds=300)
+    # 等了 3 个老化周期的 low 排在刚到的 normal 之前
+    queue.push('old-low', 'old-low', LOW, 1000.0)
+    queue.push('new-normal', 'new-normal', NORMAL, 1000.0 + 3 * 300 + 1)
+    assert queue.pop() == 'old-low'
+    assert queue.pop() == 'new-normal'
+
+
+def test_zero_aging_disables_aging():
+    for aging_seconds in (0, -1):
+        queue = make_queue(aging_seconds=aging_seconds)
+        queue.push('old-low', 'old-low', LOW, 1000.0)
+        queue.push('new-normal', 'new-normal', NORMAL, 1_000_000.0)
+        queue.push('old-normal', 'old-normal', NORMAL, 2000.0)
+        assert [queue.pop(), queue.pop(), queue.pop()] == ['old-normal', 'new-normal', 'old-low']
+
+
+def test_aging_does_not_overtake_within_one_step():
+    queue = make_queue(aging_seconds=300)
+    queue.push('low', 'low', LOW, 1000.0)
+    queue.push('normal', 'normal', NORMAL, 1000.0 + 200)
+    assert queue.pop() == 'normal'
+
+
+def test_duplicate_keys_are_ignored_until_popped():
+    queue = make_queue()
+    assert queue.push('a', 1, NORMAL)
+    assert not queue.push('a', 2, URGENT)
+    assert 'a' in queue and len(queue) == 1
+    assert queue.pop() == 1
+    assert 'a' not in queue
+    assert queue.push('a', 3, NORMAL)
+
+
+def test_stats_track_depth_and_waits():
+    queue = make_queue()
+    queue.push('a', 'a', HIGH)
+    queue.push('b', 'b', LOW)
+    stats = queue.stats()
+    assert stats['depth'] == 2
+    assert stats['levels']['high']['depth'] == 1
+    queue.pop()
+    stats = queue.stats()
+    assert stats['levels']['high']['depth'] == 0
+    assert stats['levels']['high']['dequeued'] == 1
+    assert stats['levels']['high']['max_wait_seconds'] >= 0.0
+    assert stats['levels']['low']['depth'] == 1
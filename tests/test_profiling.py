@@ -0,0 +1,52 @@
+import pytest
+
+from app.profiling import Profiler, MODE_CPROFILE, MODE_SAMPLING
+
+
+def fetch_stage():
+    return sum(i * i for i in range(20000))
+
+
+def process_stage():
+    return sorted(str(i) for i in range(20000))
+
+
+def profiled_functions(report):
+    return ' '.join(row['function'] for row in report['functions'])
+
+
+def test_single_email_is_profiled_across_both_stages():
+    profiler = Profiler()
+    profiler.arm(1, MODE_CPROFILE, top=1000)
+    with profiler.profile_email('trace-1', final=False):
+        fetch_stage()
+    # 下载阶段结束后剖析仍在进行，等待同一封邮件的处理阶段
+    assert profiler.report()['status'] == 'running'
+    with profiler.profile_email('other'):
+        pass
+    with profiler.profile_email('trace-1'):
+        process_stage()
+    report = profiler.report()
+    assert report['status'] == 'done'
+    assert report['emails_profiled'] == 1
+    assert 'fetch_stage' in profiled_functions(report)
+    assert 'process_stage' in profiled_functions(report)
+
+
+def test_email_ending_early_finishes_session():
+    profiler = Profiler()
+    profiler.arm(1, MODE_CPROFILE)
+    with profiler.profile_email('trace-1', final=False):
+        profiler.end_email('trace-1')
+    assert profiler.report()['status'] == 'done'
+
+
+def test_failed_stage_counts_as_done():
+    profiler = Profiler()
+    profiler.arm(1, MODE_SAMPLING)
+    with pytest.raises(RuntimeError):
+        with profiler.profile_email('trace-1', final=False):
+            raise RuntimeError('download failed')
+    report = profiler.report()
+    assert report['status'] == 'done'
+    assert report['emails_profiled'] == 1
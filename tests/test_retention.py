@@ -0,0 +1,119 @@
+import os
+import time
+
+import pytest
+
+from app import retention
+from app.retention import ArchiveStore
+
+OLD = time.time() - 40 * 86400
+
+
+def make_email(tmp_path, folder_name, size=64):
+    files = {
+        ('downloaded_emails', f'{folder_name}.eml'): f'Message-ID: <{folder_name}@example.com>\r\n\r\nbody'.encode(),
+        ('processed_emails', folder_name, f'{folder_name}.pdf'): os.urandom(size),
+        ('processed_emails', folder_name, 'attachments', 'report.txt'): b'attachment ' * 8,
+        ('processed_emails', folder_name, 'source.json'): f'{{"message_id": "graph-{folder_name}"}}'.encode(),
+        ('workflow_responses', f'{folder_name}.txt'): b'{"status": "ok"}',
+    }
+    for parts, data in files.items():
+        path = tmp_path.joinpath(*parts)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        os.utime(path, (OLD, OLD))
+    return files
+
+
+def compact(tmp_path, store):
+    return store.compact(str(tmp_path / 'downloaded_emails'), str(tmp_path / 'processed_emails'),
+                         str(tmp_path / 'workflow_responses'), older_than_days=30)
+
+
+def member_name(folder_name, parts):
+    if parts[0] == 'downloaded_emails':
+        return f'eml/{parts[-1]}'
+    if parts[0] == 'workflow_responses':
+        return f'response/{parts[-1]}'
+    return 'processed/' + '/'.join(parts[2:])
+
+
+def assert_archived(tmp_path, store, folder_name, files):
+    for parts, data in files.items():
+        assert not tmp_path.joinpath(*parts).exists()
+        assert store.read_member(folder_name, member_name(folder_name, parts))[0] == data
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArchiveStore(str(tmp_path / 'archive'), segment_max_bytes=1024 * 1024)
+
+
+def test_compact_round_trips_every_member(tmp_path, store):
+    files = make_email(tmp_path, 'a')
+    stats = compact(tmp_path, store)
+    assert stats['archived_emails'] == 1
+    assert_archived(tmp_path, store, 'a', files)
+    assert store.known_message_ids() == {'graph-a', '<a@example.com>'}
+
+
+def test_compact_is_idempotent(tmp_path, store):
+    files = make_email(tmp_path, 'a')
+    compact(tmp_path, store)
+    index = store.load_index()
+    stats = compact(tmp_path, store)
+    assert stats['archived_emails'] == 0 and stats['segments_written'] == []
+    assert store.load_index() == index
+    assert_archived(tmp_path, store, 'a', files)
+
+
+def test_recent_emails_are_kept(tmp_path, store):
+    make_email(tmp_path, 'a')
+    os.utime(tmp_path / 'workflow_responses' / 'a.txt')
+    assert compact(tmp_path, store)['archived_emails'] == 0
+    assert (tmp_path / 'downloaded_emails' / 'a.eml').exists()
+
+
+def test_crash_after_index_save_is_recovered(tmp_path, store, monkeypatch):
+    files = make_email(tmp_path, 'a')
+
+    def crash(path):
+        raise OSError('disk went away')
+
+    monkeypatch.setattr(retention, '_remove', crash)
+    with pytest.raises(OSError):
+        compact(tmp_path, store)
+    # 索引已落盘，原文件还在：下一轮只删除残留，不重复写入分段
+    segment = store.load_index()['a']['segment']
+    assert (tmp_path / 'downloaded_emails' / 'a.eml').exists()
+    monkeypatch.undo()
+    stats = compact(tmp_path, store)
+    assert stats['archived_emails'] == 0 and stats['segments_written'] == []
+    assert stats['bytes_removed'] > 0
+    assert store.load_index()['a']['segment'] == segment
+    assert_archived(tmp_path, store, 'a', files)
+
+
+def test_segments_roll_over_at_size_limit(tmp_path):
+    store = ArchiveStore(str(tmp_path / 'archive'), segment_max_bytes=2048)
+    emails = {name: make_email(tmp_path, name, size=4096) for name in ('a', 'b', 'c')}
+    stats = compact(tmp_path, store)
+    assert stats['archived_emails'] == 3
+    assert len(stats['segments_written']) == 3
+    index = store.load_index()
+    assert len({index[name]['segment'] for name in emails}) == 3
+    for name, files in emails.items():
+        assert_archived(tmp_path, store, name, files)
+
+
+def test_orphan_skipped_eml_is_archived(tmp_path, store):
+    eml = tmp_path / 'downloaded_emails' / 'skipped.eml'
+    eml.parent.mkdir(parents=True)
+    eml.write_bytes(b'Message-ID: <skipped@example.com>\r\n\r\nsale')
+    os.utime(eml, (OLD, OLD))
+    make_email(tmp_path, 'pending')
+    (tmp_path / 'workflow_responses' / 'pending.txt').unlink()
+    assert compact(tmp_path, store)['archived_emails'] == 1
+    assert store.read_member('skipped', 'eml/skipped.eml')[0] == b'Message-ID: <skipped@example.com>\r\n\r\nsale'
+    # 已渲染但尚未跑完工作流的邮件不归档
+    assert (tmp_path / 'downloaded_emails' / 'pending.eml').exists()
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+import requests
+
+from app import throttle
+from app.circuit import Deadline, DeadlineExceeded
+from app.throttle import AdaptiveThrottle, HostLimiter, parse_retry_after
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_additive_increase_and_multiplicative_decrease():
+    limiter = HostLimiter('example.com', initial=4, maximum=6)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(200, 0.01)
+    assert limiter.limit == pytest.approx(5.0, abs=0.1)
+    limiter.acquire()
+    limiter.release(429, 0.01)
+    assert limiter.limit == pytest.approx(2.5, abs=0.1)
+    for _ in range(100):
+        limiter.acquire()
+        limiter.release(200, 0.01)
+    assert limiter.limit == 6
+
+
+def test_one_decrease_per_burst_of_failures():
+    limiter = HostLimiter('example.com', initial=8)
+    for _ in range(3):
+        limiter.acquire()
+    for _ in range(3):
+        limiter.release(503, 1.0)
+    assert limiter.limit == 4
+
+
+def test_latency_target_shrinks_limit():
+    limiter = HostLimiter('example.com', initial=10, latency_target=0.5)
+    limiter.acquire()
+    limiter.release(200, 2.0)
+    assert limiter.limit == pytest.approx(9.0)
+
+
+def test_retry_after_is_capped():
+    limiter = HostLimiter('example.com', max_block=2)
+    limiter.acquire()
+    limiter.release(429, 0.01, retry_after=3600)
+    assert 0 < limiter.stats()['blocked_for'] <= 2
+
+
+def test_acquire_raises_when_block_outlasts_deadline():
+    limiter = HostLimiter('example.com', max_block=30)
+    limiter.acquire()
+    limiter.release(429, 0.01, retry_after=30)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire(Deadline(1))
+    assert time.monotonic() - started < 0.5
+
+
+def test_acquire_waits_for_slot_until_deadline():
+    limiter = HostLimiter('example.com', initial=1)
+    limiter.acquire()
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire(Deadline(0.2))
+    limiter.release(200, 0.01)
+    limiter.acquire(Deadline(0.2))
+
+
+def test_retry_budget_limits_retries():
+    limiter = HostLimiter('example.com')
+    limiter.retry_tokens = 1.5
+    assert limiter.try_spend_retry()
+    assert not limiter.try_spend_retry()
+    assert limiter.counters['budget_exhausted'] == 1
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('5') == 5.0
+    assert parse_retry_after('-3') == 0.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_request_retries_throttled_with_capped_delay(monkeypatch):
+    responses = [FakeResponse(429, {'Retry-After': '3600'}), FakeResponse(200)]
+    sleeps = []
+    monkeypatch.setattr(throttle.requests, 'request', lambda method, url, **kwargs: responses.pop(0))
+    monkeypatch.setattr(throttle.time, 'sleep', sleeps.append)
+    client = AdaptiveThrottle(base_delay=0.01, max_delay=0.05)
+    resp = client.get('http://example.com/x')
+    assert resp.status_code == 200
+    assert len(sleeps) == 1 and sleeps[0] <= 0.06
+
+
+def test_request_does_not_retry_non_idempotent_timeout(monkeypatch):
+    calls = []
+
+    def fail(method, url, **kwargs):
+        calls.append(method)
+        raise requests.ReadTimeout('slow')
+
+    monkeypatch.setattr(throttle.requests, 'request', fail)
+    monkeypatch.setattr(throttle.time, 'sleep', lambda delay: None)
+    with pytest.raises(requests.ReadTimeout):
+        AdaptiveThrottle().post('http://example.com/run')
+    assert calls == ['POST']
@@ -0,0 +1,74 @@
+import importlib
+from email.message import EmailMessage
+
+import pytest
+
+from app import triage
+from app.triage import Triage, ROUTE_SKIP, ROUTE_LIGHTWEIGHT, ROUTE_FULL, _split_patterns
+
+
+def make_message(sender='alice@example.com', subject='Quarterly report', **headers):
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['Subject'] = subject
+    for name, value in headers.items():
+        msg[name.replace('_', '-')] = value
+    return msg
+
+
+def make_triage(**kwargs):
+    options = dict(sender_allow=['boss@corp.com', 'vip.com'], sender_deny=['spam.com'],
+                   skip_subject_patterns=_split_patterns(r'^\s*\[AD\]'),
+                   lightweight_subject_patterns=_split_patterns('newsletter'))
+    options.update(kwargs)
+    return Triage(**options)
+
+
+def test_rules_apply_in_order():
+    rules = make_triage()
+    assert rules.classify(make_message()) == (ROUTE_FULL, 'default')
+    assert rules.classify(make_message('x@mail.spam.com')) == (ROUTE_SKIP, 'sender_deny')
+    assert rules.classify(make_message(subject='[AD] 50% off')) == (ROUTE_SKIP, 'subject_skip')
+    assert rules.classify(make_message(Precedence='bulk')) == (ROUTE_SKIP, 'precedence_bulk')
+    assert rules.classify(make_message(List_Unsubscribe='<mailto:u@x>')) == (ROUTE_LIGHTWEIGHT, 'list_unsubscribe')
+    assert rules.classify(make_message(subject='Weekly newsletter')) == (ROUTE_LIGHTWEIGHT, 'subject_lightweight')
+
+
+def test_allow_list_wins_over_every_other_rule():
+    rules = make_triage(sender_deny=['corp.com'])
+    msg = make_message('boss@corp.com', '[AD] newsletter', Precedence='bulk', List_Unsubscribe='<mailto:u@x>')
+    assert rules.classify(msg) == (ROUTE_FULL, 'sender_allow')
+    assert rules.classify(make_message('news@mail.vip.com', Precedence='bulk')) == (ROUTE_FULL, 'sender_allow')
+
+
+def test_deny_wins_over_header_rules():
+    msg = make_message('promo@spam.com', List_Unsubscribe='<mailto:u@x>')
+    assert make_triage().classify(msg) == (ROUTE_SKIP, 'sender_deny')
+
+
+def test_precedence_wins_over_unsubscribe_and_routes_are_configurable():
+    msg = make_message(Precedence='list', List_Unsubscribe='<mailto:u@x>')
+    assert make_triage().classify(msg) == (ROUTE_SKIP, 'precedence_bulk')
+    rules = make_triage(bulk_route=ROUTE_LIGHTWEIGHT, unsubscribe_route=ROUTE_FULL)
+    assert rules.classify(msg) == (ROUTE_LIGHTWEIGHT, 'precedence_bulk')
+    assert rules.classify(make_message(List_Unsubscribe='<mailto:u@x>')) == (ROUTE_FULL, 'list_unsubscribe')
+
+
+def test_classify_without_record_leaves_stats():
+    rules = make_triage()
+    rules.classify(make_message(Precedence='bulk'), record=False)
+    assert rules.stats() == {'rule_hits': {}, 'routes': {}}
+    rules.classify(make_message(Precedence='bulk'))
+    assert rules.stats() == {'rule_hits': {'precedence_bulk': 1}, 'routes': {ROUTE_SKIP: 1}}
+
+
+def test_unknown_route_is_rejected(monkeypatch):
+    with pytest.raises(ValueError):
+        make_triage(bulk_route='drop')
+    monkeypatch.setenv('TRIAGE_UNSUBSCRIBE_ROUTE', 'lite')
+    with pytest.raises(ValueError, match='TRIAGE_UNSUBSCRIBE_ROUTE'):
+        importlib.reload(triage)
+    monkeypatch.setenv('TRIAGE_UNSUBSCRIBE_ROUTE', ' Full ')
+    assert importlib.reload(triage).TRIAGE_UNSUBSCRIBE_ROUTE == ROUTE_FULL
+    monkeypatch.delenv('TRIAGE_UNSUBSCRIBE_ROUTE')
+    importlib.reload(triage)
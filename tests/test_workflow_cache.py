@@ -0,0 +1,62 @@
+import os
+import time
+from email.message import EmailMessage
+
+from app.workflow_cache import WorkflowCache, content_key, normalize_addresses
+
+
+def make_message(to='bob@example.com, carol@example.com'):
+    msg = EmailMessage()
+    msg['From'] = 'Alice <Alice@Example.com>'
+    msg['To'] = to
+    return msg
+
+
+def test_key_ignores_prefixes_whitespace_and_attachment_order(tmp_path):
+    a, b = tmp_path / 'a.txt', tmp_path / 'b.txt'
+    a.write_bytes(b'first')
+    b.write_bytes(b'second')
+    key = content_key('ns', 'Invoice 42', 'Hello\n\n  world ', [str(a), str(b)])
+    assert content_key('ns', 'RE: Fwd:  invoice 42', 'Hello\nworld', [str(b), str(a)]) == key
+    assert content_key('other', 'Invoice 42', 'Hello\nworld', [str(a), str(b)]) != key
+    assert content_key('ns', 'Invoice 42', 'Hello\nworld', [str(a)]) != key
+    b.write_bytes(b'changed')
+    assert content_key('ns', 'Invoice 42', 'Hello\nworld', [str(a), str(b)]) != key
+
+
+def test_key_depends_on_addresses_not_display_names():
+    same = normalize_addresses(make_message('Carol <carol@example.com>, bob@EXAMPLE.com'))
+    assert normalize_addresses(make_message()) == same
+    assert normalize_addresses(make_message('dave@example.com')) != same
+    assert content_key('ns', 's', 'b', [], same) != content_key('ns', 's', 'b', [], '')
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = WorkflowCache(str(tmp_path), ttl_seconds=0.05, max_entries=10)
+    cache.put('k', {'answer': 1})
+    assert cache.get('k') == {'answer': 1}
+    time.sleep(0.1)
+    assert cache.get('k') is None
+    assert not os.path.exists(tmp_path / 'k.json')
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 0}
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = WorkflowCache(str(tmp_path), ttl_seconds=3600, max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    # 读取 a 后它成为最近使用，放入 c 时淘汰 b
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
+def test_recency_survives_restart(tmp_path):
+    cache = WorkflowCache(str(tmp_path), ttl_seconds=3600, max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    os.utime(tmp_path / 'a.json', (time.time() + 10, time.time() + 10))
+    restarted = WorkflowCache(str(tmp_path), ttl_seconds=3600, max_entries=2)
+    restarted.put('c', 3)
+    assert sorted(f[:-len('.json')] for f in os.listdir(tmp_path)) == ['a', 'c']